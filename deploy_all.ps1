@@ -116,7 +116,7 @@ $services = @{
 }
 
 $workerArgs = @{
-    "cas-lookup"  = ""
+    "cas-lookup"  = "--threads 8"
     "email-demo"  = ""
     "apollo-demo" = ""
     "scm-static"  = "-k uvicorn.workers.UvicornWorker"
@@ -2,7 +2,6 @@ from flask import Flask, request, Response, send_file, jsonify, send_from_direct
 print("STARTING APP V4 - Modular Refactor")
 from flask_cors import CORS
 import os
-from sqlalchemy import text
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -58,17 +57,30 @@ app.register_blueprint(enrichment_bp)
 
 with app.app_context():
     db.create_all()
-    # Migration hacks
-    try:
-        with db.engine.connect() as conn:
-            conn.execute(text("ALTER TABLE enrichment_rule ADD COLUMN purity_rules TEXT DEFAULT '[]'"))
-            conn.commit()
-    except: pass
-    try:
-        with db.engine.connect() as conn:
-            conn.execute(text("ALTER TABLE enrichment_rule ADD COLUMN hierarchy TEXT DEFAULT '[\"Region\", \"Identifier\", \"Factory\"]'"))
-            conn.commit()
-    except: pass
+    # Versioned, idempotent schema changes for databases created by older releases
+    from db_migrations import run_migrations
+    run_migrations(db.engine)
+
+    from spend_links import ensure_spend_material_links
+    ensure_spend_material_links()
+
+    from site_geocoding import ensure_site_locations
+    ensure_site_locations()
+
+    # Rollups missing or behind the spend data (first start, external writes): rebuild in the background
+    from spend_rollup import rollups_current, schedule_rollup_rebuild
+    if not rollups_current():
+        schedule_rollup_rebuild(app)
+
+    # Continue an enrichment job whose process died (restart, crashed gunicorn worker)
+    if os.environ.get('ENRICHMENT_RESUME', '1') == '1':
+        from enrichment_jobs import resume_orphaned_job
+        resume_orphaned_job(app)
+
+# Build the in-memory spend cube in the background so the first dashboard request is fast
+if os.environ.get('SPEND_CUBE_PRELOAD', '1') == '1':
+    from spend_cube import preload_spend_cube
+    preload_spend_cube(app)
 
 # ==========================================
 # COMMON ROUTES
@@ -109,6 +121,20 @@ def save_user_preference():
     db.session.commit()
     return jsonify({"success": True})
 
+@app.route('/api/diagnostics/query-plans', methods=['GET'])
+def get_query_plans():
+    from query_plans import explain_hot_queries
+    from db_migrations import migration_status
+    try:
+        report = explain_hot_queries(db.session)
+        return jsonify({
+            "schema": migration_status(db.engine),
+            "queries": report,
+            "flagged": [e["name"] for e in report if e["flagged"]]
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     with app.app_context():
         init_spend_data()
@@ -1,93 +1,20 @@
-from flask import Blueprint, jsonify, request, current_app
-import threading
+import json
+import os
+import time
 from datetime import datetime
-from models import db, SpendRecord
-from llm_helper import BedrockCleaner
-from chemical_utils import hyper_clean_chemical
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
+from models import db, SpendRecord, EnrichmentJob, EnrichmentWorkItem
+from enrichment_jobs import (create_job, start_job, claim_job, set_job_status, latest_job, resume_orphaned_job,
+                             enrichment_candidates, EnrichmentJobConflict, PRIORITY_SCORES, DEFAULT_PRIORITY)
+from spend_sync import after_spend_enrichment
 
 enrichment_bp = Blueprint('enrichment', __name__)
 
-# Global state for enrichment progress
-enrichment_progress = {
-    "status": "idle",
-    "total": 0,
-    "current": 0,
-    "processed": 0,
-    "errors": 0,
-    "last_run": None
-}
-
-def run_enrichment_task(app, descriptions):
-    global enrichment_progress
-    enrichment_progress["status"] = "running"
-    enrichment_progress["total"] = len(descriptions)
-    enrichment_progress["current"] = 0
-    enrichment_progress["processed"] = 0
-    enrichment_progress["errors"] = 0
-    
-    try:
-        cleaner = BedrockCleaner()
-    except Exception as e:
-        print(f"Failed to init cleaner in background: {e}")
-        enrichment_progress["status"] = "failed"
-        return
-
-    with app.app_context():
-        for (raw_desc,) in descriptions:
-            if not raw_desc:
-                enrichment_progress["current"] += 1
-                continue
-                
-            try:
-                # Use get_chemical_details to get both INC and CAS
-                details = cleaner.get_chemical_details(raw_desc)
-                if details and (details.get('inci') != "NOT FOUND" or details.get('cas') != "NOT FOUND"):
-                    name = details.get('inci') if details.get('inci') != "NOT FOUND" else raw_desc
-                    cas = details.get('cas') if details.get('cas') != "NOT FOUND" else ""
-                    
-                    # Standardized format: Name_cas_Number (e.g., Glycerin_cas_56-81-5)
-                    name_clean = hyper_clean_chemical(name).title().replace(' ', '')
-                    
-                    # We MUST have both a meaningful name and a CAS number
-                    if name_clean and len(name_clean) > 2 and cas and cas != "NOT FOUND":
-                        enriched_formatted = f"{name_clean}_cas_{cas}"
-                        
-                        # Update all records with this raw description in both tables
-                        SpendRecord.query.filter_by(item_description=raw_desc).update(
-                            {
-                                "enriched_description": enriched_formatted,
-                                "cas_number": cas
-                            }
-                        )
-                        
-                        from models import MaterialData
-                        MaterialData.query.filter_by(item_description=raw_desc).update(
-                            {
-                                "enriched_description": enriched_formatted,
-                                "cas_number": cas,
-                                "inci_name": name
-                            }
-                        )
-                    else:
-                        # If either is missing, do not apply the standardized format
-                        # This keeps it clean from "_cas_123" noise
-                        pass
-                    
-                    db.session.commit()
-                    enrichment_progress["processed"] += 1
-                else:
-                    # No high-quality match found with both name and CAS.
-                    # Per user request: "use the correct material name and cas both else keep empty"
-                    # We skip the update to keep the field empty/null.
-                    enrichment_progress["errors"] += 1
-            except Exception as e:
-                print(f"Enrichment error for {raw_desc}: {e}")
-                enrichment_progress["errors"] += 1
-            
-            enrichment_progress["current"] += 1
-    
-    enrichment_progress["status"] = "done"
-    enrichment_progress["last_run"] = datetime.utcnow().isoformat()
+# Progress stream: at most one event per interval, a keep-alive comment when idle, and the stream
+# is recycled (the browser reconnects after `retry` ms) before gunicorn's worker timeout
+EVENT_INTERVAL = float(os.environ.get('ENRICHMENT_EVENT_INTERVAL', 1.0))
+EVENT_KEEPALIVE = 15.0
+EVENT_STREAM_SECONDS = int(os.environ.get('ENRICHMENT_EVENT_STREAM_SECONDS', 300))
 
 @enrichment_bp.route('/api/spend-analysis/clear-enrichment', methods=['POST'])
 def clear_enrichment():
@@ -97,6 +24,7 @@ def clear_enrichment():
         from models import MaterialData
         MaterialData.query.update({"enriched_description": None, "cas_number": None})
         db.session.commit()
+        after_spend_enrichment()
         return jsonify({"message": "All enrichment data cleared", "status": "done"})
     except Exception as e:
         db.session.rollback()
@@ -105,40 +33,150 @@ def clear_enrichment():
 @enrichment_bp.route('/api/spend-analysis/enrich', methods=['POST'])
 def trigger_spend_enrichment():
     try:
-        # Find all items that are missing the new standardized format
-        query = db.session.query(SpendRecord.item_description).filter(
-            db.or_(
-                SpendRecord.enriched_description == None,
-                SpendRecord.enriched_description == "",
-                db.not_(SpendRecord.enriched_description.like('%_cas_%'))
-            )
-        )
-        
-        unique_descriptions = query.distinct().all()
-        print(f"DEBUG: Found {len(unique_descriptions)} unique items for global enrichment trigger.")
+        # Optional overrides of the worker count, Bedrock calls per second and work order
+        options = request.get_json(silent=True) or {}
+        try:
+            workers = int(options['concurrency']) if options.get('concurrency') is not None else None
+            rate = float(options['rate']) if options.get('rate') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "concurrency and rate must be numbers"}), 400
+        if (workers is not None and workers < 1) or (rate is not None and rate <= 0):
+            return jsonify({"error": "concurrency and rate must be positive"}), 400
+        cluster = options.get('cluster', True) not in (False, 0, '0', 'false')
+        priority = options.get('priority') or DEFAULT_PRIORITY
+        if priority not in PRIORITY_SCORES:
+            return jsonify({"error": f"priority must be one of {', '.join(PRIORITY_SCORES)}"}), 400
+
+        # Items missing the standardized format, the ones carrying most spend (or the chosen score) first
+        candidates, spend_total, spend_enriched = enrichment_candidates(priority)
+        print(f"DEBUG: Found {len(candidates)} unique items for global enrichment trigger.")
         
-        if not unique_descriptions:
+        if not candidates:
             return jsonify({"message": "No unenriched items found", "status": "done"})
 
-        # Reset global progress before starting
-        global enrichment_progress
-        enrichment_progress["status"] = "running"
-        enrichment_progress["total"] = len(unique_descriptions)
-        enrichment_progress["current"] = 0
-        enrichment_progress["processed"] = 0
-        enrichment_progress["errors"] = 0
-
-        # Start background thread
-        thread = threading.Thread(
-            target=run_enrichment_task, 
-            args=(current_app._get_current_object(), unique_descriptions)
-        )
-        thread.start()
+        # One active job across all workers: a second trigger gets the running one back
+        try:
+            job = create_job(candidates, {"workers": workers, "rate": rate, "cluster": cluster}, priority=priority,
+                             spend_total=spend_total, spend_enriched=spend_enriched, cluster=cluster)
+        except EnrichmentJobConflict as conflict:
+            return jsonify({"error": str(conflict), "job": conflict.job.to_dict()}), 409
+        start_job(current_app._get_current_object(), job.id)
         
-        return jsonify({"message": "Enrichment started", "status": "running", "total": len(unique_descriptions)})
+        return jsonify({"message": "Enrichment started", "status": "running", "total": job.total, "job_id": job.id,
+                        "priority": priority, "llm_items": job.llm_items, "coverage": job.coverage()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @enrichment_bp.route('/api/spend-analysis/enrich-status')
 def get_enrichment_status():
-    return jsonify(enrichment_progress)
+    """Latest enrichment job (any worker); also picks up a running job whose process died"""
+    try:
+        resume_orphaned_job(current_app._get_current_object())
+        job = latest_job()
+        if job is None:
+            return jsonify({"status": "idle", "total": 0, "current": 0, "processed": 0, "errors": 0, "last_run": None})
+        return jsonify(job.to_dict())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@enrichment_bp.route('/api/spend-analysis/enrich-jobs/<int:job_id>')
+def get_enrichment_job(job_id):
+    job = db.session.get(EnrichmentJob, job_id)
+    if job is None:
+        return jsonify({"error": f"Enrichment job {job_id} not found"}), 404
+    return jsonify(job.to_dict())
+
+@enrichment_bp.route('/api/spend-analysis/enrich-jobs/<int:job_id>/events')
+def stream_enrichment_job(job_id):
+    """
+    Server-sent events for one job: 'progress' with the job (counters,
+    coverage, live throughput / ETA / latency / recent results) whenever it
+    changed, coalesced to one per EVENT_INTERVAL, and 'end' once it is no
+    longer running. Every open stream reads the job row once per interval,
+    whichever worker runs the job.
+    """
+    if db.session.get(EnrichmentJob, job_id) is None:
+        return jsonify({"error": f"Enrichment job {job_id} not found"}), 404
+    app = current_app._get_current_object()
+
+    def generate():
+        opened = last_sent = time.monotonic()
+        last_payload = None
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                job = db.session.get(EnrichmentJob, job_id)
+                if job.status == 'running' and job.lease_expires_at and job.lease_expires_at < datetime.utcnow():
+                    # The runner died and nobody polls enrich-status any more: take the job over here
+                    resume_orphaned_job(app)
+                payload = json.dumps(job.to_dict())
+                running = job.status == 'running'
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                return
+            finally:
+                # Hand the connection back to the pool between reads; the next read sees a fresh row
+                db.session.remove()
+            now = time.monotonic()
+            if not running:
+                yield f"event: end\ndata: {payload}\n\n"
+                return
+            if payload != last_payload:
+                yield f"event: progress\ndata: {payload}\n\n"
+                last_payload, last_sent = payload, now
+            elif now - last_sent >= EVENT_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = now
+            if now - opened >= EVENT_STREAM_SECONDS:
+                return
+            time.sleep(EVENT_INTERVAL)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@enrichment_bp.route('/api/spend-analysis/enrich-jobs/<int:job_id>/clusters')
+def get_enrichment_job_clusters(job_id):
+    """Descriptions that took over a representative's outcome, least similar first (for review)"""
+    try:
+        limit = int(request.args.get('limit', 200))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    match_type = request.args.get('match_type')
+    try:
+        if db.session.get(EnrichmentJob, job_id) is None:
+            return jsonify({"error": f"Enrichment job {job_id} not found"}), 404
+        query = EnrichmentWorkItem.query.filter(EnrichmentWorkItem.job_id == job_id,
+                                                EnrichmentWorkItem.cluster_of.isnot(None))
+        if match_type:
+            query = query.filter(EnrichmentWorkItem.match_type == match_type)
+        members = query.order_by(EnrichmentWorkItem.similarity, EnrichmentWorkItem.id).limit(limit).all()
+        return jsonify([{
+            "raw_description": m.raw_description,
+            "representative": m.cluster_of,
+            "match_type": m.match_type,
+            "similarity": m.similarity,
+            "status": m.status,
+            "enriched_description": m.enriched_description,
+            "cas_number": m.cas_number
+        } for m in members])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@enrichment_bp.route('/api/spend-analysis/enrich-jobs/<int:job_id>/<action>', methods=['POST'])
+def control_enrichment_job(job_id, action):
+    """pause / resume / cancel; the runner stops within one write interval"""
+    statuses = {'pause': 'paused', 'resume': 'running', 'cancel': 'cancelled'}
+    if action not in statuses:
+        return jsonify({"error": f"Unknown action '{action}'"}), 404
+    try:
+        if db.session.get(EnrichmentJob, job_id) is None:
+            return jsonify({"error": f"Enrichment job {job_id} not found"}), 404
+        job = set_job_status(job_id, statuses[action])
+        if job is None:
+            return jsonify({"error": f"Cannot {action} enrichment job {job_id}"}), 409
+        if action == 'resume' and claim_job(job_id):
+            start_job(current_app._get_current_object(), job_id)
+        return jsonify(job.to_dict())
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
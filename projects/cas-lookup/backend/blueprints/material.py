@@ -9,10 +9,12 @@ import uuid
 from sqlalchemy import func
 from pypdf import PdfReader
 from werkzeug.utils import secure_filename
-from models import db, MaterialData, MaterialParameter, EnrichmentRule, NodeAnnotation, ClusterOverride
+from models import db, MaterialData, MaterialParameter, EnrichmentRule, NodeAnnotation, ClusterOverride, SpendMaterialLink
 from chemical_utils import hyper_clean_chemical, extract_inci_from_synonyms, lookup_inci_from_pubchem
 from cas_client import CASClient
 from llm_helper import BedrockCleaner
+from spend_sync import after_material_change, after_material_edit
+from spend_search import search_available, fts_match_query, material_relevance
 
 material_bp = Blueprint('material', __name__)
 
@@ -441,6 +443,7 @@ def process_file(filename):
     def generate():
         with app.app_context():
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            cleared = synced = False
             try:
                 if filename.lower().endswith(('.xlsx', '.xls')):
                     df = pd.read_excel(filepath)
@@ -455,12 +458,15 @@ def process_file(filename):
                 # Use CAS_API_KEY from config
                 client = CASClient(app.config.get('CAS_API_KEY', "XBr7txDIgp8FNY3ziNqaqRFiTShZBdb3V3GN3QAb"))
                 
-                # Clear existing data for fresh session
+                # Clear existing data for fresh session. Links go in the same transaction:
+                # SQLite reuses the freed material ids, so they would point at the new rows
                 try:
+                    db.session.query(SpendMaterialLink).delete()
                     db.session.query(MaterialParameter).delete()
                     db.session.query(MaterialData).delete()
                     db.session.query(NodeAnnotation).delete()
                     db.session.commit()
+                    cleared = True
                 except: db.session.rollback()
 
                 cleaner = None
@@ -540,10 +546,17 @@ def process_file(filename):
                 } for r in results])
                 out_filename = f"output_{filename}"
                 out_df.to_csv(os.path.join(app.config['OUTPUT_FOLDER'], out_filename), index=False)
+                after_material_change()
+                synced = True
                 found_count = sum(1 for r in results if r['cas_number'] != 'NOT FOUND')
                 yield f"data: {json.dumps({'type': 'complete', 'total': total, 'found': found_count, 'output_file': out_filename})}\n\n"
             except Exception as e:
                 yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            finally:
+                if cleared and not synced:
+                    # Failed or disconnected midway: link spend to the materials written so far
+                    db.session.rollback()
+                    after_material_change()
     return Response(generate(), mimetype='text/event-stream')
 
 @material_bp.route('/download/<filename>')
@@ -584,6 +597,7 @@ def update_result(row_id):
         for key in ['item_description', 'enriched_description', 'cas_number', 'inci_name']:
             if key in data: setattr(row, key, data[key])
         db.session.commit()
+        after_material_edit([row.id])
         return jsonify(row.to_dict())
     except Exception as e: return jsonify({"error": str(e)}), 500
 
@@ -609,12 +623,17 @@ def move_cluster_node():
 @material_bp.route('/api/spend-analysis/<material_name>')
 def spend_analysis(material_name):
     try:
-        search = f"%{material_name}%"
-        results = MaterialData.query.filter(
-            (MaterialData.final_search_term.ilike(search)) | 
-            (MaterialData.enriched_description.ilike(search)) |
-            (MaterialData.item_description.ilike(search))
-        ).all()
+        if search_available() and fts_match_query(material_name):
+            # FTS5 token-prefix match, best bm25 matches first
+            rank = material_relevance(material_name)
+            results = MaterialData.query.join(rank, rank.c.id == MaterialData.id).order_by(rank.c.rank).all()
+        else:
+            search = f"%{material_name}%"
+            results = MaterialData.query.filter(
+                (MaterialData.final_search_term.ilike(search)) | 
+                (MaterialData.enriched_description.ilike(search)) |
+                (MaterialData.item_description.ilike(search))
+            ).all()
         stats = {}
         for r in results:
             reg = r.region or 'Unknown'
@@ -634,6 +653,7 @@ def update_clusters():
         data = request.json
         changes = data.get('changes', [])
         applied = 0
+        edited = set()
         for change in changes:
             ctype = change.get('type')
             if ctype == 'move':
@@ -660,13 +680,16 @@ def update_clusters():
                         else:
                             p_entry = next((p for p in mat.parameters if p.name == key), None)
                             if p_entry: db.session.delete(p_entry)
+                    edited.add(mat.id)
                     applied += 1
             elif ctype == 'rename':
                 mat = MaterialData.query.filter_by(item_description=change.get('old_name')).first()
                 if mat:
                     mat.item_description = change.get('new_name')
+                    edited.add(mat.id)
                     applied += 1
         db.session.commit()
+        after_material_edit(edited)
         return jsonify({"success": True, "message": f"Applied {applied} changes"})
     except Exception as e:
         db.session.rollback()
@@ -757,6 +780,7 @@ def validate_cas(row_id):
         row.confidence_score = 100
         row.validation_status = f'Validated ({len(docs)} docs)'
         db.session.commit()
+        after_material_edit([row.id])
         return jsonify(row.to_dict())
     except Exception as e: return jsonify({"error": str(e)}), 500
 
@@ -1,25 +1,27 @@
-from flask import Blueprint, jsonify, request, current_app, send_file
+from flask import Blueprint, jsonify, request, current_app, send_file, Response, stream_with_context
 import os
-import pandas as pd
 from sqlalchemy import func
-from models import db, SpendRecord, MaterialData, UserPreference
-from geocoding_data import CITY_COORDS
+from models import db, SpendRecord, MaterialData, UserPreference, SiteLocation
+from spend_aggregation import read_spend_filters, cube_filters, build_spend_dashboard
+from spend_cube import get_spend_cube
+from spend_rollup import rollup_stats
+from spend_table import (SORT_COLUMNS, DEFAULT_PER_PAGE, MAX_PER_PAGE, fetch_page, table_total, table_query,
+                         filter_table_query, validate_sort)
+from spend_export import EXPORT_FORMATS, EXPORT_WRITERS, export_entities, export_filename, format_available
+from spend_ingest import ingest_spend_file
+from spend_snapshot import snapshot_available, write_snapshot, list_snapshots
+from data_version import get_data_version, bump_data_version, SPEND, RISK_CONFIG
+from result_cache import cached_endpoint, spend_result_cache
+from risk_engine import load_risk_config
+from map_clusters import get_map_index, MAX_ZOOM as MAX_MAP_ZOOM
+from risk_table import (read_material_risks, schedule_material_risk_rebuild, SEVERITY_RANK,
+                        DEFAULT_PER_PAGE as RISK_DEFAULT_PER_PAGE, MAX_PER_PAGE as RISK_MAX_PER_PAGE)
 import json
+import re
 
 spend_bp = Blueprint('spend', __name__)
 
-def parse_float(val):
-    try:
-        if pd.isna(val):
-            return 0.0
-        return float(str(val).replace(',', '').strip())
-    except:
-        return 0.0
-
-def parse_str(val):
-    if pd.isna(val):
-        return None
-    return str(val).strip()
+CAS_FORMAT_PATTERN = re.compile(r'.cas.', re.IGNORECASE | re.DOTALL)
 
 def init_spend_data():
     """Initialize spend data from Excel file into database"""
@@ -37,207 +39,25 @@ def init_spend_data():
             print(f"❌ Purchase History.xlsx not found at {xlsx_path}")
             return
         
-        df = pd.read_excel(xlsx_path, sheet_name='Sheet1', header=None, engine='openpyxl')
-        
-        records = []
-        for idx, row in df.iterrows():
-            if idx == 0 or (pd.isna(row[9]) and pd.isna(row[12])):
-                continue
-            
-            try:
-                record = SpendRecord(
-                    operating_unit=parse_str(row[0]),
-                    po_number=parse_str(row[1]),
-                    po_date=parse_str(row[2]),
-                    line_number=parse_str(row[3]),
-                    shipment_number=parse_str(row[4]),
-                    distribution_number=parse_str(row[5]),
-                    release_number=parse_str(row[6]),
-                    po_version=parse_str(row[7]),
-                    supplier_number=parse_str(row[8]),
-                    vendor_name=parse_str(row[9]) or "Unknown",
-                    buyer_name=parse_str(row[10]),
-                    item_category=parse_str(row[11]),
-                    item_description=parse_str(row[12]) or "Unknown",
-                    quantity=parse_float(row[13]),
-                    uom=parse_str(row[14]),
-                    unit_price_fc=parse_float(row[15]),
-                    unit_price_inr=parse_float(row[16]),
-                    currency_code=parse_str(row[17]),
-                    base_price_fc=parse_float(row[18]),
-                    base_price_inr=parse_float(row[19]),
-                    amount=parse_float(row[20]),
-                    tax_amount=parse_float(row[21]) if len(row) > 21 else 0.0,
-                    total_amount=parse_float(row[22]) if len(row) > 22 else 0.0,
-                    fob_dsp=parse_str(row[23]) if len(row) > 23 else None,
-                    is_contract=False
-                )
-                records.append(record)
-            except Exception as e:
-                print(f"⚠️ Error processing row {idx}: {e}")
-                continue
-        
-        if records:
-            db.session.bulk_save_objects(records)
-            db.session.commit()
-            print(f"✅ Successfully ingested {len(records)} spend records.")
+        ingest_spend_file(xlsx_path)
     except Exception as e:
         print(f"❌ Spend Data Ingestion Failed: {e}")
         db.session.rollback()
 
 @spend_bp.route('/api/spend-analysis/dashboard')
+@cached_endpoint('dashboard', ['category', 'supplier', 'operating_unit', 'enriched_description', 'year', 'fiscal_year',
+                               'exact'])
 def solve_spend_dashboard():
     try:
-        # Get query parameters
-        category = request.args.get('category')
-        supplier = request.args.get('supplier')
-        region = request.args.get('region')
-        enriched_desc = request.args.get('enriched_description')
-        operating_unit = request.args.get('operating_unit')
-        year = request.args.get('year')
-        
-        # Build query with join to potentially get enriched description from MaterialData
-        query = db.session.query(SpendRecord).outerjoin(
-            MaterialData,
-            db.or_(
-                db.and_(MaterialData.cas_number == SpendRecord.cas_number, MaterialData.cas_number != None, SpendRecord.cas_number != "NOT FOUND"),
-                MaterialData.enriched_description == SpendRecord.enriched_description,
-                db.and_(MaterialData.enriched_description.like(SpendRecord.enriched_description + '%'), SpendRecord.enriched_description != None)
-            )
-        )
-
-        if category and category != 'All':
-            query = query.filter(SpendRecord.item_category == category)
-        if supplier and supplier != 'All':
-            query = query.filter(SpendRecord.vendor_name == supplier)
-        if operating_unit and operating_unit != 'All':
-            query = query.filter(SpendRecord.operating_unit == operating_unit)
-        if region and region != 'All':
-            # Note: region exists in MaterialData or is mapped from Operating Unit
-            # If region is not explicitly in SpendRecord, we might skip it or map it.
-            # For now, let's stick to operating_unit as the primary filter requested.
-            pass
-        if enriched_desc and enriched_desc != 'All':
-             query = query.filter(SpendRecord.enriched_description == enriched_desc)
-        if year and year != 'All':
-             query = query.filter(SpendRecord.year == year)
-            
-        # Overall Stats for KPIs
-        total_spend = db.session.query(func.sum(SpendRecord.amount)).filter(
-            SpendRecord.id.in_(query.with_entities(SpendRecord.id))
-        ).scalar() or 0
-        total_suppliers = db.session.query(func.count(func.distinct(SpendRecord.vendor_name))).filter(
-            SpendRecord.id.in_(query.with_entities(SpendRecord.id))
-        ).scalar() or 0
-        po_count = db.session.query(func.count(func.distinct(SpendRecord.po_number))).filter(
-            SpendRecord.id.in_(query.with_entities(SpendRecord.id))
-        ).scalar() or 0
-        total_buyers = db.session.query(func.count(func.distinct(SpendRecord.buyer_name))).filter(
-            SpendRecord.id.in_(query.with_entities(SpendRecord.id))
-        ).scalar() or 0
-        
-        # Mocks for PR counts (based on original logic)
-        pr_count = int(po_count * 1.1)
-
-        # 1. Spend by Material/Item Description (Top 8)
-        cat_result = db.session.query(
-            SpendRecord.item_description, 
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.item_description
-        ).order_by(func.sum(SpendRecord.amount).desc()).limit(8).all()
-        category_data = [{"name": str(r[0]), "value": float(r[1])} for r in cat_result]
-
-        # 2. Market Trend (Aggregated by Month)
-        trend_query = db.session.query(
-            SpendRecord.po_date, 
-            SpendRecord.amount
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).all()
-
-        trend_map = {}
-        for date_str, amt in trend_query:
-            try:
-                # Expected format: 2023-01-02 or similar
-                if date_str and len(str(date_str)) >= 7:
-                    month_key = str(date_str)[:7]  # '2023-01'
-                    trend_map[month_key] = trend_map.get(month_key, 0) + (amt or 0)
-            except:
-                continue
-        
-        trend_sorted = sorted(trend_map.items())
-        trend_data = [{"name": k, "value": float(v)} for k, v in trend_sorted]
-
-        # 3. Spend by Region (Operating Unit)
-        reg_result = db.session.query(
-            SpendRecord.operating_unit, 
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.operating_unit
-        ).order_by(func.sum(SpendRecord.amount).desc()).all()
-        region_data = [{"name": str(r[0]), "value": float(r[1])} for r in reg_result]
-
-        # 4. Spend by Supplier (Top 10)
-        sup_result = db.session.query(
-            SpendRecord.vendor_name, 
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.vendor_name
-        ).order_by(func.sum(SpendRecord.amount).desc()).limit(10).all()
-        supplier_data = [{"name": str(r[0]), "value": float(r[1])} for r in sup_result]
-
-        # 5. Pareto Analysis (Suppliers)
-        pareto_raw = db.session.query(
-            SpendRecord.vendor_name, 
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.vendor_name
-        ).order_by(func.sum(SpendRecord.amount).desc()).limit(20).all()
-        
-        pareto_data = []
-        cum_spend_val = 0
-        for name, val in pareto_raw:
-            cum_spend_val += (val or 0)
-            cum_pct = (cum_spend_val / total_spend) * 100 if total_spend > 0 else 0
-            pareto_data.append({
-                "name": str(name),
-                "spend": float(val or 0),
-                "cumulativePercentage": round(float(cum_pct), 1)
-            })
-
-        # 6. Payment Term Distribution
-        pt_result = db.session.query(
-            SpendRecord.payment_term,
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.payment_term
-        ).order_by(func.sum(SpendRecord.amount).desc()).limit(10).all()
-        payment_term_data = [{"name": str(r[0]) if r[0] else "Other", "value": float(r[1] or 0)} for r in pt_result]
-
-        # 7. PO Status Distribution
-        ps_result = db.session.query(
-            SpendRecord.po_status,
-            func.sum(SpendRecord.amount)
-        ).filter(SpendRecord.id.in_(query.with_entities(SpendRecord.id))).group_by(
-            SpendRecord.po_status
-        ).order_by(func.sum(SpendRecord.amount).desc()).all()
-        po_status_data = [{"name": str(r[0]) if r[0] else "Unknown", "value": float(r[1] or 0)} for r in ps_result]
-
-        return jsonify({
-            "kpis": {
-                "spend": float(total_spend),
-                "suppliers": total_suppliers,
-                "buyers": total_buyers,
-                "po_count": po_count,
-                "pr_count": pr_count
-            },
-            "category_data": category_data,
-            "trend_data": trend_data,
-            "region_data": region_data,
-            "supplier_data": supplier_data,
-            "pareto_data": pareto_data,
-            "payment_term_data": payment_term_data,
-            "po_status_data": po_status_data
-        })
+        # 'region' is accepted for compatibility but not mapped onto SpendRecord yet;
+        # operating_unit is the primary regional filter.
+        try:
+            filters = read_spend_filters(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # PO / buyer counts are HyperLogLog estimates unless exact=true
+        exact = request.args.get('exact', '').lower() in ('1', 'true')
+        return jsonify(build_spend_dashboard(filters, current_app._get_current_object(), exact=exact))
     except Exception as e:
         print(f"Dashboard Error: {e}")
         import traceback
@@ -245,44 +65,24 @@ def solve_spend_dashboard():
         return jsonify({"error": str(e)}), 500
 
 @spend_bp.route('/api/spend-analysis/enriched-insights')
+@cached_endpoint('enriched-insights', ['enriched_description', 'operating_unit', 'year', 'fiscal_year'])
 def enriched_spend_insights():
     try:
-        enriched_desc = request.args.get('enriched_description')
-        operating_unit = request.args.get('operating_unit')
-        year = request.args.get('year')
-        
-        query = db.session.query(
-            MaterialData.enriched_description,
-            func.sum(SpendRecord.amount).label('total_spend'),
-            func.count(SpendRecord.id).label('transaction_count')
-        ).join(
-            SpendRecord, 
-            db.or_(
-                db.and_(MaterialData.cas_number == SpendRecord.cas_number, MaterialData.cas_number != None, SpendRecord.cas_number != "NOT FOUND"),
-                MaterialData.enriched_description == SpendRecord.enriched_description,
-                db.and_(MaterialData.enriched_description.like(SpendRecord.enriched_description + '%'), SpendRecord.enriched_description != None)
-            )
-        )
-
-        if enriched_desc and enriched_desc != 'All':
-            query = query.filter(SpendRecord.enriched_description == enriched_desc)
-        if operating_unit and operating_unit != 'All':
-            query = query.filter(SpendRecord.operating_unit == operating_unit)
-        if year and year != 'All':
-            query = query.filter(SpendRecord.year == year)
-
-        results = query.group_by(
-            MaterialData.enriched_description
-        ).order_by(
-            func.sum(SpendRecord.amount).desc()
-        ).limit(20).all()
+        try:
+            filters = read_spend_filters(request.args, ['enriched_description', 'operating_unit', 'year', 'fiscal_year'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        cube = get_spend_cube()
+        # Only spend lines linked to a material (spend_material_link), grouped by the material's description
+        mask = cube.mask(cube_filters(filters)) & (cube.codes['match_type'] >= 0)
+        results = cube.group_by(['material_description'], mask, top=20)
         
         data = [
             {
-                "name": str(r[0] or "Unmapped/Unknown"),
-                "value": float(r[1] or 0),
-                "count": r[2]
-            } for r in results
+                "name": str(r.material_description or "Unmapped/Unknown"),
+                "value": float(r.amount or 0),
+                "count": int(r.count)
+            } for r in results.itertuples(index=False)
         ]
         
         return jsonify(data)
@@ -293,312 +93,195 @@ def enriched_spend_insights():
 @spend_bp.route('/api/spend-analysis/table')
 def spend_table_view():
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 50))
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
         sort_by = request.args.get('sort_by', 'amount')
         sort_order = request.args.get('sort_order', 'desc')
+        cursor = request.args.get('cursor')
         search = request.args.get('search', '')
-        enriched_desc = request.args.get('enriched_description')
-        operating_unit = request.args.get('operating_unit')
-        year = request.args.get('year')
-
-        # Build query with join to potentially get enriched description
-        query = db.session.query(
-            SpendRecord,
-            MaterialData.enriched_description
-        ).outerjoin(
-            MaterialData, 
-            db.or_(
-                db.and_(MaterialData.cas_number == SpendRecord.cas_number, MaterialData.cas_number != None, SpendRecord.cas_number != "NOT FOUND"),
-                MaterialData.enriched_description == SpendRecord.enriched_description,
-                db.and_(MaterialData.enriched_description.like(SpendRecord.enriched_description + '%'), SpendRecord.enriched_description != None)
-            )
+        sort_error = validate_sort(sort_by, search)
+        if sort_error:
+            return jsonify({"error": sort_error}), 400
+        try:
+            filters = read_spend_filters(request.args, ['enriched_description', 'operating_unit', 'year', 'fiscal_year'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Spend rows with the enriched description of their linked material
+        query, count_query, sort_col = filter_table_query(
+            table_query(SpendRecord, MaterialData.enriched_description), filters, search, sort_by
         )
-        
-        if search:
-            query = query.filter(db.or_(
-                SpendRecord.vendor_name.ilike(f'%{search}%'),
-                SpendRecord.item_description.ilike(f'%{search}%'),
-                SpendRecord.po_number.ilike(f'%{search}%'),
-                MaterialData.enriched_description.ilike(f'%{search}%')
-            ))
-
-        if enriched_desc and enriched_desc != 'All':
-            query = query.filter(SpendRecord.enriched_description == enriched_desc)
-        if operating_unit and operating_unit != 'All':
-            query = query.filter(SpendRecord.operating_unit == operating_unit)
-        if year and year != 'All':
-            query = query.filter(SpendRecord.year == year)
-
-        if sort_by == 'enriched_description':
-            sort_col = MaterialData.enriched_description
-        else:
-            sort_col = getattr(SpendRecord, sort_by)
-
-        if sort_order == 'desc':
-            query = query.order_by(sort_col.desc())
-        else:
-            query = query.order_by(sort_col.asc())
 
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        try:
+            rows, next_cursor, prev_cursor = fetch_page(
+                query, sort_by, sort_order != 'desc', per_page, cursor=cursor, page=page, sort_col=sort_col
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        total, total_is_estimate = table_total(count_query or query, filters, search, direct_only=sort_col is not None)
         
         records = []
-        for row, enriched in pagination.items:
-            d = row.to_dict()
+        for row in rows:
+            record, enriched = row[0], row[1]
+            d = record.to_dict()
             d['enriched_description'] = enriched or "Not Enriched"
             records.append(d)
 
         return jsonify({
             "records": records,
-            "total": pagination.total,
-            "pages": pagination.pages,
-            "current_page": page
+            "total": total,
+            "total_is_estimate": total_is_estimate,
+            "pages": (total + per_page - 1) // per_page,
+            "current_page": page,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor
         })
     except Exception as e:
         print(f"Table View Error: {e}")
         return jsonify({"error": str(e)}), 500
 
-@spend_bp.route('/api/spend-analysis/suppliers-map')
-def spend_map_view():
+@spend_bp.route('/api/spend-analysis/export')
+def export_spend():
+    """Stream the table's filtered, searched and sorted rows as ?format=csv|xlsx|parquet"""
     try:
-        enriched_desc = request.args.get('enriched_description')
-        operating_unit = request.args.get('operating_unit')
-        year = request.args.get('year')
-        
-        query = db.session.query(
-            SpendRecord.vendor_name,
-            SpendRecord.operating_unit,
-            SpendRecord.supplier_site,
-            func.sum(SpendRecord.amount),
-            func.count(SpendRecord.id)
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": f"Unsupported format '{fmt}'. Allowed: {', '.join(EXPORT_FORMATS)}"}), 400
+        if not format_available(fmt):
+            return jsonify({"error": "Parquet export requires pyarrow"}), 400
+        sort_by = request.args.get('sort_by', 'amount')
+        ascending = request.args.get('sort_order', 'desc') != 'desc'
+        search = request.args.get('search', '')
+        sort_error = validate_sort(sort_by, search)
+        if sort_error:
+            return jsonify({"error": sort_error}), 400
+        try:
+            filters = read_spend_filters(request.args, ['enriched_description', 'operating_unit', 'year', 'fiscal_year'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query, _, sort_col = filter_table_query(table_query(*export_entities()), filters, search, sort_by)
+        col = SORT_COLUMNS[sort_by] if sort_col is None else sort_col
+        if ascending:
+            query = query.order_by(col.asc(), SpendRecord.id.asc())
+        else:
+            query = query.order_by(col.desc(), SpendRecord.id.desc())
+
+        return Response(
+            stream_with_context(EXPORT_WRITERS[fmt](query)),
+            mimetype=EXPORT_FORMATS[fmt][0],
+            headers={"Content-Disposition": f'attachment; filename="{export_filename(fmt)}"'}
         )
-        
-        if enriched_desc and enriched_desc != 'All':
-            query = query.filter(SpendRecord.enriched_description == enriched_desc)
-        if operating_unit and operating_unit != 'All':
-            query = query.filter(SpendRecord.operating_unit == operating_unit)
-        if year and year != 'All':
-            query = query.filter(SpendRecord.year == year)
-            
-        results = query.group_by(SpendRecord.vendor_name, SpendRecord.operating_unit, SpendRecord.supplier_site).order_by(func.sum(SpendRecord.amount).desc()).all()
-        
-        def geocode(site, unit):
-            if site and site.lower() in CITY_COORDS:
-                return [CITY_COORDS[site.lower()]['lat'], CITY_COORDS[site.lower()]['lng']]
-            if unit and unit.lower() in CITY_COORDS:
-                return [CITY_COORDS[unit.lower()]['lat'], CITY_COORDS[unit.lower()]['lng']]
-            return [20.5937, 78.9629] # Default India center
-            
-        suppliers = []
-        for r in results:
-            coords = geocode(r[2], r[1])
-            amt = float(r[3] or 0)
-            
-            # Determine spend category for marker styling
-            spend_cat = 'low'
-            if amt > 50000000: spend_cat = 'very_high'
-            elif amt > 10000000: spend_cat = 'high'
-            elif amt > 1000000: spend_cat = 'medium'
+    except Exception as e:
+        print(f"Export Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-            suppliers.append({
-                "vendor_name": r[0],
-                "supplier_site": r[2] or "Unknown",
-                "operating_unit": r[1] or "Unknown",
-                "latitude": coords[0],
-                "longitude": coords[1],
-                "total_spend": amt,
-                "transaction_count": r[4],
-                "spend_category": spend_cat
-            })
-            
+@spend_bp.route('/api/spend-analysis/snapshots', methods=['GET', 'POST'])
+def spend_snapshots():
+    """GET: Parquet snapshot manifests, newest first; POST: snapshot the spend and material tables"""
+    try:
+        if not snapshot_available():
+            return jsonify({"error": "Snapshots require pyarrow"}), 400
+        if request.method == 'POST':
+            return jsonify(write_snapshot())
+        return jsonify(list_snapshots())
+    except Exception as e:
+        print(f"Snapshot Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def parse_bbox(value):
+    """'south,west,north,east' -> float tuple; raises ValueError when malformed"""
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must be 'south,west,north,east'")
+    south, west, north, east = parts
+    if not (-90 <= south <= north <= 90) or not all(-180 <= v <= 180 for v in (west, east)):
+        raise ValueError("bbox out of range")
+    return south, west, north, east
+
+@spend_bp.route('/api/spend-analysis/suppliers-map')
+@cached_endpoint('suppliers-map', ['enriched_description', 'operating_unit', 'year', 'fiscal_year', 'zoom', 'bbox'],
+                 unpopular=['bbox'])
+def spend_map_view():
+    try:
+        try:
+            zoom = request.args.get('zoom')
+            zoom = None if zoom in (None, '') else int(zoom)
+            bbox = request.args.get('bbox')
+            bbox = parse_bbox(bbox) if bbox else None
+        except ValueError as e:
+            return jsonify({"error": f"Invalid zoom or bbox: {e}"}), 400
+        if zoom is not None and not 0 <= zoom <= MAX_MAP_ZOOM:
+            return jsonify({"error": f"zoom must be between 0 and {MAX_MAP_ZOOM}"}), 400
+
+        try:
+            filters = read_spend_filters(request.args, ['enriched_description', 'operating_unit', 'year', 'fiscal_year'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        cube = get_spend_cube()
+        # Markers and per-zoom clusters are precomputed per filter set and data version
+        index = get_map_index(cube, cube_filters(filters))
+
+        if zoom is None:
+            # One marker per (vendor, OU, site), optionally limited to the viewport
+            return jsonify({"suppliers": index.suppliers(bbox), "summary": index.summary})
+
+        clusters = index.clusters(zoom, bbox)
         return jsonify({
-            "suppliers": suppliers,
-            "summary": {
-                "total_suppliers": len(set(r[0] for r in results)),
-                "total_sites": len(set(r[2] for r in results)),
-                "total_spend": sum(r[3] for r in results if r[3])
-            }
+            "clusters": clusters,
+            "zoom": zoom,
+            "bbox": list(bbox) if bbox else None,
+            "summary": dict(index.summary,
+                            visible_markers=sum(c.get("count", 1) for c in clusters),
+                            visible_spend=sum(c["total_spend"] for c in clusters))
         })
     except Exception as e:
         print(f"Map View Error: {e}")
         return jsonify({"error": str(e)}), 500
 
 @spend_bp.route('/api/spend-analysis/enriched-descriptions')
+@cached_endpoint('enriched-descriptions')
 def get_enriched_descriptions():
     try:
         # Source from SpendRecord and only show items that match our new standardized format (_cas_)
-        descs = db.session.query(SpendRecord.enriched_description).filter(
-            SpendRecord.enriched_description.like('%_cas_%')
-        ).distinct().all()
-        return jsonify(sorted([d[0] for d in descs if d[0]]))
+        # (same semantics as SQL LIKE '%_cas_%': 'cas' with at least one character either side)
+        descs = get_spend_cube().distinct_values('enriched_description')
+        return jsonify(sorted([d for d in descs if d and CAS_FORMAT_PATTERN.search(d)]))
     except Exception as e:
         print(f"Error fetching enriched descriptions: {e}")
         return jsonify({"error": str(e)}), 500
 
 @spend_bp.route('/api/spend-analysis/operating-units')
+@cached_endpoint('operating-units')
 def get_operating_units():
     try:
-        units = db.session.query(SpendRecord.operating_unit).distinct().all()
-        return jsonify(sorted([u[0] for u in units if u[0]]))
+        units = get_spend_cube().distinct_values('operating_unit')
+        return jsonify(sorted([u for u in units if u]))
     except Exception as e:
         print(f"Error fetching operating units: {e}")
         return jsonify({"error": str(e)}), 500
 
 @spend_bp.route('/api/spend-analysis/risk-analysis')
+@cached_endpoint('risk-analysis', ['operating_unit', 'year', 'severity', 'risk_type', 'search', 'page', 'per_page'],
+                 versions=(SPEND, RISK_CONFIG))
 def get_risk_analysis():
     try:
         operating_unit = request.args.get('operating_unit', 'All')
         selected_year = request.args.get('year', 'All')
-        
-        query = SpendRecord.query
-        if operating_unit != 'All':
-            query = query.filter(SpendRecord.operating_unit == operating_unit)
-        if selected_year != 'All':
-            query = query.filter(SpendRecord.year == selected_year)
-            
-        records = query.all()
-        
-        # Group by material (enriched_description)
-        material_risks = {}
-        
-        # Fetch configuration from database
-        pref_sensitive = UserPreference.query.filter_by(key='sensitive_countries').first()
-        pref_high_risk = UserPreference.query.filter_by(key='high_risk_countries').first()
-        pref_concentration = UserPreference.query.filter_by(key='concentration_threshold').first()
-        pref_disaster = UserPreference.query.filter_by(key='natural_disaster_countries').first()
-        
-        SENSITIVE_COUNTRIES = json.loads(pref_sensitive.value) if pref_sensitive else ['Russia', 'Iran', 'Ukraine', 'Israel', 'China', 'Indonesia']
-        HIGH_RISK_COUNTRIES = json.loads(pref_high_risk.value) if pref_high_risk else ['Russia', 'Iran', 'Ukraine', 'Israel']
-        CONCENTRATION_THRESHOLD = int(pref_concentration.value) if pref_concentration else 75
-        DISASTER_COUNTRIES = json.loads(pref_disaster.value) if pref_disaster else []
-        
-        def get_country(site):
-            if not site: return "Unknown"
-            site_key = site.lower().strip()
-            if site_key in CITY_COORDS:
-                name = CITY_COORDS[site_key]['name']
-                if ',' in name:
-                    return name.split(',')[-1].strip()
-                return name
-            return "Unknown"
-
-        for r in records:
-            mat = r.enriched_description
-            # Filter out placeholder data
-            if not mat or str(mat).lower() in ['other', 'unknown', 'nan', 'none']: 
-                continue
-                
-            mat_key = (mat, r.item_code or "N/A")
-            if mat_key not in material_risks:
-                material_risks[mat_key] = {
-                    "material": mat,
-                    "item_code": r.item_code or "N/A",
-                    "suppliers": set(),
-                    "countries": {},
-                    "sites": {},  # Track supplier sites
-                    "total_spend": 0,
-                    "risks": []
-                }
-            
-            material_risks[mat_key]["suppliers"].add(r.supplier_number)
-            country = get_country(r.supplier_site)
-            site = r.supplier_site or "Unknown"
-            material_risks[mat_key]["countries"][country] = material_risks[mat_key]["countries"].get(country, 0) + (r.amount or 0)
-            material_risks[mat_key]["sites"][site] = material_risks[mat_key]["sites"].get(site, 0) + (r.amount or 0)
-            material_risks[mat_key]["total_spend"] += (r.amount or 0)
-                
-        results = []
-        for mat_key, m_data in material_risks.items():
-            risks = []
-            max_severity = "Low"
-            
-            # 1. Single Source Risk
-            if len(m_data["suppliers"]) == 1:
-                risks.append({
-                    "type": "Single Source",
-                    "severity": "High",
-                    "description": "Only one vendor globally for this material."
-                })
-                max_severity = "High"
-                
-            # 2. Geo Political Risk
-            geo_risk_countries = [c for c in m_data["countries"].keys() if c != "Unknown" and any(sc in c for sc in SENSITIVE_COUNTRIES)]
-            if geo_risk_countries:
-                severity = "Medium"
-                if any(hc in str(geo_risk_countries) for hc in HIGH_RISK_COUNTRIES):
-                    severity = "High"
-                risks.append({
-                    "type": "Geo Political",
-                    "severity": severity,
-                    "description": f"Sourcing from sensitive regions: {', '.join(geo_risk_countries)}"
-                })
-                if severity == "High": max_severity = "High"
-                elif max_severity != "High": max_severity = "Medium"
-                
-            # 3. Country Risk
-            # Check if single source is from sensitive country
-            if len(m_data["suppliers"]) == 1:
-                supplier_countries = [c for c in m_data["countries"].keys() if c != "Unknown"]
-                if supplier_countries and any(any(sc in country for sc in SENSITIVE_COUNTRIES) for country in supplier_countries):
-                    risks.append({
-                        "type": "Country Risk",
-                        "severity": "Medium",
-                        "description": f"Single source from sensitive country: {', '.join(supplier_countries)}"
-                    })
-                    if max_severity != "High": max_severity = "Medium"
-            
-            # Check if >X% of vendors are from sensitive countries
-            total_suppliers = len(m_data["suppliers"])
-            if total_suppliers > 1:
-                for country, spend in m_data["countries"].items():
-                    if country != "Unknown" and m_data["total_spend"] > 0:
-                        concentration = (spend / m_data["total_spend"]) * 100
-                        if concentration > CONCENTRATION_THRESHOLD and any(sc in country for sc in SENSITIVE_COUNTRIES):
-                            risks.append({
-                                "type": "Country Risk",
-                                "severity": "Medium",
-                                "description": f"Over {CONCENTRATION_THRESHOLD}% of spend from sensitive country: {country}"
-                            })
-                            if max_severity != "High": max_severity = "Medium"
-                            break
-            
-            # 4. Natural Disaster Risk (case-insensitive matching)
-            disaster_countries = [c for c in m_data["countries"].keys() if c != "Unknown" and any(dc.lower() in c.lower() for dc in DISASTER_COUNTRIES)]
-            if disaster_countries:
-                risks.append({
-                    "type": "Natural Disaster",
-                    "severity": "High",
-                    "description": f"Sourcing from disaster-affected regions: {', '.join(disaster_countries)}"
-                })
-                max_severity = "High"
-
-            if risks:
-                # Find dominant site (highest spend) excluding "Unknown" if possible
-                valid_sites = {s: spend for s, spend in m_data["sites"].items() if s and s != "Unknown"}
-                dominant_site = max(valid_sites, key=valid_sites.get) if valid_sites else "Unknown"
-
-                results.append({
-                    "material": m_data["material"],
-                    "item_code": m_data["item_code"],
-                    "total_spend": m_data["total_spend"],
-                    "supplier_count": len(m_data["suppliers"]),
-                    "risks": risks,
-                    "max_severity": max_severity,
-                    "dominant_site": dominant_site
-                })
-                
-        # Sort by spend and severity
-        results.sort(key=lambda x: (x["max_severity"] == "High", x["max_severity"] == "Medium", x["total_spend"]), reverse=True)
-        
-        return jsonify({
-            "material_risks": results[:100], # Limit to top 100 risky materials
-            "summary": {
-                "high_risk_count": len([r for r in results if r["max_severity"] == "High"]),
-                "medium_risk_count": len([r for r in results if r["max_severity"] == "Medium"]),
-                "low_risk_count": len([r for r in results if r["max_severity"] == "Low"]),
-                "total_risky_materials": len(results)
-            }
-        })
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', RISK_DEFAULT_PER_PAGE, type=int), 1), RISK_MAX_PER_PAGE)
+        severity = request.args.get('severity')
+        if severity and severity not in SEVERITY_RANK:
+            return jsonify({"error": f"Invalid severity: {severity}"}), 400
+        # Indexed read of material_risk (risk_table.py); computed live while it is being rebuilt
+        return jsonify(read_material_risks(
+            operating_unit, selected_year,
+            severity=severity,
+            risk_type=request.args.get('risk_type') or None,
+            search=request.args.get('search', '').strip() or None,
+            page=page, per_page=per_page,
+            app=current_app._get_current_object()
+        ))
     except Exception as e:
         print(f"Risk Analysis Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -629,29 +312,76 @@ def manage_risk_config():
                 pref.value = json.dumps(val) if isinstance(val, list) else str(val)
             
             db.session.commit()
+            # Invalidates cached risk-analysis results; material_risk is rebuilt in the background
+            bump_data_version(RISK_CONFIG)
+            schedule_material_risk_rebuild(current_app._get_current_object())
             return jsonify({"status": "success"})
             
         # GET default logic
-        pref_sensitive = UserPreference.query.filter_by(key='sensitive_countries').first()
-        pref_high_risk = UserPreference.query.filter_by(key='high_risk_countries').first()
-        pref_concentration = UserPreference.query.filter_by(key='concentration_threshold').first()
-        pref_disaster = UserPreference.query.filter_by(key='natural_disaster_countries').first()
-        
-        return jsonify({
-            "sensitive_countries": json.loads(pref_sensitive.value) if pref_sensitive else ['Russia', 'Iran', 'Ukraine', 'Israel', 'China', 'Indonesia'],
-            "high_risk_countries": json.loads(pref_high_risk.value) if pref_high_risk else ['Russia', 'Iran', 'Ukraine', 'Israel'],
-            "concentration_threshold": int(pref_concentration.value) if pref_concentration else 75,
-            "natural_disaster_countries": json.loads(pref_disaster.value) if pref_disaster else []
-        })
+        return jsonify(load_risk_config())
     except Exception as e:
         print(f"Error managing risk config: {e}")
         return jsonify({"error": str(e)}), 500
 
 @spend_bp.route('/api/spend-analysis/years')
+@cached_endpoint('years')
 def get_years():
     try:
-        years = db.session.query(SpendRecord.year).distinct().all()
-        return jsonify(sorted([str(y[0]) for y in years if y[0]], reverse=True))
+        years = get_spend_cube().distinct_values('year')
+        return jsonify(sorted([str(y) for y in years if y], reverse=True))
     except Exception as e:
         print(f"Error fetching years: {e}")
         return jsonify({"error": str(e)}), 500
+
+@spend_bp.route('/api/spend-analysis/fiscal-years')
+@cached_endpoint('fiscal-years')
+def get_fiscal_years():
+    try:
+        years = get_spend_cube().distinct_values('fiscal_year')
+        return jsonify(sorted([int(y) for y in years if y], reverse=True))
+    except Exception as e:
+        print(f"Error fetching fiscal years: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@spend_bp.route('/api/spend-analysis/cube-stats')
+def get_spend_cube_stats():
+    try:
+        cube = get_spend_cube()
+        stats = cube.memory_usage()
+        stats['built_at'] = cube.built_at
+        return jsonify(stats)
+    except Exception as e:
+        print(f"Error fetching cube stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@spend_bp.route('/api/spend-analysis/rollup-stats')
+def get_spend_rollup_stats():
+    """Rollup grains, group counts and whether they reflect the current spend data"""
+    try:
+        return jsonify(rollup_stats())
+    except Exception as e:
+        print(f"Error fetching rollup stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@spend_bp.route('/api/spend-analysis/site-locations')
+def get_site_locations():
+    """Geocoded supplier sites; ?unresolved=1 lists the ones needing a place or alias"""
+    try:
+        query = SiteLocation.query
+        if request.args.get('unresolved') == '1':
+            query = query.filter(SiteLocation.method == 'none')
+        rows = query.order_by(SiteLocation.confidence, SiteLocation.site).all()
+        return jsonify([r.to_dict() for r in rows])
+    except Exception as e:
+        print(f"Error fetching site locations: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@spend_bp.route('/api/spend-analysis/cache-stats')
+def get_spend_cache_stats():
+    try:
+        stats = spend_result_cache.stats()
+        stats['data_version'] = get_data_version(SPEND)
+        return jsonify(stats)
+    except Exception as e:
+        print(f"Error fetching cache stats: {e}")
+        return jsonify({"error": str(e)}), 500
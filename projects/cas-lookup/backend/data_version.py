@@ -0,0 +1,54 @@
+"""
+Data Version Counters
+=====================
+Persisted, monotonically increasing counters per data domain. Writers bump
+them after committing a change; readers (spend cube, result cache) compare
+against the version their cached state was built from. Because the counter
+lives in the database, changes made by other gunicorn workers or CLI scripts
+(load_spend_data.py) are picked up too.
+"""
+
+from datetime import datetime
+from sqlalchemy import text
+from models import db
+
+SPEND = 'spend'
+RISK_CONFIG = 'risk_config'
+
+
+def get_data_version(name=SPEND, default=0):
+    """Current version of a domain (default if it was never bumped); a single primary-key lookup"""
+    row = db.session.execute(text("SELECT version FROM data_version WHERE name = :n"), {"n": name}).first()
+    return row[0] if row else default
+
+
+def get_data_versions(names, default=0):
+    return tuple(get_data_version(n, default) for n in names)
+
+
+def bump_data_version(name=SPEND):
+    """Increment a domain's version and commit; returns the new version"""
+    # One upsert that returns the value it wrote: a separate read after the commit could
+    # see another writer's bump (threads, background enrichment, other processes)
+    version = db.session.execute(
+        text("INSERT INTO data_version (name, version, updated_at) VALUES (:n, 1, :t) "
+             "ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at "
+             "RETURNING version"),
+        {"n": name, "t": datetime.utcnow()}
+    ).scalar()
+    db.session.commit()
+    return version
+
+
+def set_data_version(name, version):
+    """Record an explicit version (e.g. the source version a derived table was built from); caller commits"""
+    now = datetime.utcnow()
+    updated = db.session.execute(
+        text("UPDATE data_version SET version = :v, updated_at = :t WHERE name = :n"),
+        {"n": name, "v": version, "t": now}
+    ).rowcount
+    if not updated:
+        db.session.execute(
+            text("INSERT INTO data_version (name, version, updated_at) VALUES (:n, :v, :t)"),
+            {"n": name, "v": version, "t": now}
+        )
@@ -0,0 +1,233 @@
+"""
+Versioned Schema Migrations
+===========================
+db.create_all() only creates missing tables; it never adds columns or
+indexes to tables that already exist. Every schema change after the initial
+create_all() is therefore recorded here as a numbered, idempotent step, and
+applied steps are tracked in the schema_migration table.
+
+Add a step by appending (version, description, function) to MIGRATIONS.
+Each function receives an open SQLAlchemy connection inside a transaction
+and must only reference columns/indexes that exist at its own version.
+
+Run automatically at app startup, or manually:
+    python db_migrations.py
+
+Each step runs under SQLite's write lock (BEGIN IMMEDIATE) and re-checks the
+version inside that transaction, so gunicorn workers booting together apply
+every step exactly once; the others wait for it (MIGRATION_LOCK_TIMEOUT).
+"""
+
+import os
+import time
+from datetime import datetime
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import OperationalError
+
+# Seconds a process waits for another one applying migrations (backfills can take minutes)
+MIGRATION_LOCK_TIMEOUT = float(os.environ.get('MIGRATION_LOCK_TIMEOUT', 1800))
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def _add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN only when the column is missing"""
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _create_indexes(conn, model, *names):
+    """Create indexes declared in a model's __table_args__ (by name) if they do not exist yet"""
+    declared = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        declared[name].create(bind=conn, checkfirst=True)
+
+
+# ==========================================
+# MIGRATION STEPS
+# ==========================================
+
+def _legacy_columns(conn):
+    # Previously try/except ALTER TABLE hacks in app.py and update_schema.py
+    _add_column(conn, 'enrichment_rule', 'purity_rules', "TEXT DEFAULT '[]'")
+    _add_column(conn, 'enrichment_rule', 'hierarchy', "TEXT DEFAULT '[\"Region\", \"Identifier\", \"Factory\"]'")
+    _add_column(conn, 'spend_record', 'enriched_description', "VARCHAR(500)")
+    _add_column(conn, 'spend_record', 'cas_number', "VARCHAR(100)")
+    _add_column(conn, 'spend_record', 'item_category', "VARCHAR(100)")
+
+
+def _secondary_indexes(conn):
+    from models import SpendRecord, MaterialData, MaterialParameter
+    _create_indexes(conn, SpendRecord,
+                    'ix_spend_record_operating_unit_year', 'ix_spend_record_year',
+                    'ix_spend_record_vendor_name', 'ix_spend_record_enriched_description',
+                    'ix_spend_record_item_description', 'ix_spend_record_po_number',
+                    'ix_spend_record_cas_number')
+    _create_indexes(conn, MaterialData,
+                    'ix_material_data_sub_category', 'ix_material_data_item_description',
+                    'ix_material_data_cas_number', 'ix_material_data_enriched_description')
+    _create_indexes(conn, MaterialParameter, 'ix_material_parameter_material_id_name')
+    conn.execute(text("ANALYZE"))
+
+
+def _typed_period_columns(conn):
+    from models import SpendRecord
+    from spend_periods import backfill_period_columns
+    _add_column(conn, 'spend_record', 'po_date_d', "DATE")
+    _add_column(conn, 'spend_record', 'period_month', "INTEGER")
+    _add_column(conn, 'spend_record', 'fiscal_year', "INTEGER")
+    backfill_period_columns(conn)
+    _create_indexes(conn, SpendRecord, 'ix_spend_record_period_month', 'ix_spend_record_fiscal_year_operating_unit')
+
+
+def _keyset_sort_indexes(conn):
+    from models import SpendRecord
+    _create_indexes(conn, SpendRecord,
+                    'ix_spend_record_amount_id', 'ix_spend_record_quantity_id',
+                    'ix_spend_record_po_date_d_id', 'ix_spend_record_operating_unit_id')
+    conn.execute(text("ANALYZE spend_record"))
+
+
+def _full_text_search(conn):
+    from spend_search import create_search_indexes
+    create_search_indexes(conn)
+
+
+def _rollup_sketches(conn):
+    _add_column(conn, 'spend_rollup', 'po_sketch', "BLOB")
+    _add_column(conn, 'spend_rollup', 'buyer_sketch', "BLOB")
+    # Existing rollup rows have no sketches: mark them stale so they are rebuilt
+    conn.execute(text("DELETE FROM data_version WHERE name = 'spend_rollup.spend'"))
+
+
+def _enrichment_priority(conn):
+    _add_column(conn, 'enrichment_job', 'priority', "VARCHAR(20) NOT NULL DEFAULT 'spend'")
+    for column in ('spend_total', 'spend_enriched_at_start', 'job_spend', 'done_spend', 'enriched_spend'):
+        _add_column(conn, 'enrichment_job', column, "FLOAT NOT NULL DEFAULT 0.0")
+    _add_column(conn, 'enrichment_work_item', 'priority', "FLOAT NOT NULL DEFAULT 0.0")
+    _add_column(conn, 'enrichment_work_item', 'spend', "FLOAT NOT NULL DEFAULT 0.0")
+
+
+def _enrichment_clusters(conn):
+    _add_column(conn, 'enrichment_job', 'llm_items', "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, 'enrichment_work_item', 'cluster_of', "VARCHAR(500)")
+    _add_column(conn, 'enrichment_work_item', 'match_type', "VARCHAR(20) NOT NULL DEFAULT 'llm'")
+    _add_column(conn, 'enrichment_work_item', 'similarity', "FLOAT")
+
+
+def _enrichment_live_stats(conn):
+    _add_column(conn, 'enrichment_job', 'live_stats', "TEXT")
+
+
+def _spend_line_fingerprints(conn):
+    from models import SpendRecord
+    from spend_ingest import backfill_fingerprints
+    _add_column(conn, 'spend_record', 'line_number', "VARCHAR(50)")
+    _add_column(conn, 'spend_record', 'shipment_number', "VARCHAR(50)")
+    _add_column(conn, 'spend_record', 'line_key', "VARCHAR(300)")
+    _add_column(conn, 'spend_record', 'content_hash', "INTEGER")
+    backfill_fingerprints(conn)
+    _create_indexes(conn, SpendRecord, 'ix_spend_record_line_key')
+
+
+MIGRATIONS = [
+    (1, "enrichment_rule / spend_record columns added after initial release", _legacy_columns),
+    (2, "secondary indexes on spend_record, material_data, material_parameter", _secondary_indexes),
+    (3, "typed po_date_d / period_month / fiscal_year columns on spend_record", _typed_period_columns),
+    (4, "(sort column, id) indexes for spend table keyset pagination", _keyset_sort_indexes),
+    (5, "FTS5 search indexes (spend_fts, material_fts) with sync triggers", _full_text_search),
+    (6, "distinct-count sketch columns on spend_rollup", _rollup_sketches),
+    (7, "spend priority and coverage columns on enrichment_job / enrichment_work_item", _enrichment_priority),
+    (8, "near-duplicate cluster columns on enrichment_job / enrichment_work_item", _enrichment_clusters),
+    (9, "runner statistics column on enrichment_job", _enrichment_live_stats),
+    (10, "PO-line fingerprint columns on spend_record for delta ingestion", _spend_line_fingerprints),
+]
+
+
+# ==========================================
+# RUNNER
+# ==========================================
+
+def current_version(conn):
+    row = conn.execute(text("SELECT MAX(version) FROM schema_migration")).first()
+    return row[0] or 0
+
+
+def _is_busy(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def _apply_step(engine, version, name, step):
+    """Apply one step under the write lock; False when another process applied it first"""
+    with engine.begin() as conn:
+        # Lock before reading the version: a read transaction that later upgrades
+        # to a write fails with 'database is locked' instead of waiting
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        if current_version(conn) >= version:
+            return False
+        step(conn)
+        conn.execute(
+            text("INSERT INTO schema_migration (version, name, applied_at) VALUES (:v, :n, :t)"),
+            {"v": version, "n": name, "t": datetime.utcnow()}
+        )
+    return True
+
+
+def run_migrations(engine):
+    """Apply all pending migrations in order; safe to call from several processes at once"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migration (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at DATETIME NOT NULL
+            )
+        """))
+
+    applied = []
+    deadline = time.time() + MIGRATION_LOCK_TIMEOUT
+    for version, name, step in MIGRATIONS:
+        with engine.connect() as conn:
+            if current_version(conn) >= version:
+                continue
+        waiting = False
+        while True:
+            try:
+                done = _apply_step(engine, version, name, step)
+                break
+            except OperationalError as e:
+                # Another worker holds the write lock while it migrates: wait, then re-check
+                if not _is_busy(e) or time.time() > deadline:
+                    raise
+                if not waiting:
+                    print(f"⏳ Migration {version} is being applied by another process, waiting...")
+                    waiting = True
+                time.sleep(1)
+        if done:
+            applied.append(version)
+            print(f"🛠️ Applied migration {version}: {name}")
+    return applied
+
+
+def migration_status(engine):
+    """Applied and pending migration versions (for diagnostics)"""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table('schema_migration'):
+            done = set()
+        else:
+            done = {r[0] for r in conn.execute(text("SELECT version FROM schema_migration"))}
+    return {
+        "current_version": max(done) if done else 0,
+        "applied": sorted(done),
+        "pending": [v for v, _, _ in MIGRATIONS if v not in done]
+    }
+
+
+if __name__ == '__main__':
+    from app import app, db
+    with app.app_context():
+        applied = run_migrations(db.engine)
+        print(f"✅ Schema up to date (applied now: {applied or 'none'})")
@@ -0,0 +1,147 @@
+"""
+Description Clustering
+======================
+Groups near-duplicate spend descriptions before LLM enrichment, so one
+Bedrock call answers for all spellings of the same material
+("GLYCERINE IP 99.5% 250KG DRUM", "GLYCERIN 99.5 IP BULK", "AB - GLYCERINE").
+
+    key        hyper_clean_chemical() split at hyphens, without numbers and
+               grade, pack and unit words, British spellings made American,
+               tokens sorted ("GLYCERINE", "PEG" for PEG-40)
+    numbers    identity numbers kept apart from the key: integers that are no
+               percentage or pack size (POLYSORBATE 20 vs 80, PEG-40 vs PEG-60);
+               descriptions only cluster when these are equal
+    blocks     key tokens by their first BLOCK_PREFIX characters (plus the
+               numbers); only representatives sharing a block are compared
+
+Descriptions are taken in the given order (highest priority first). Each
+joins the first representative with the same key and numbers ('normalized')
+or, failing that, the most similar one in its blocks scoring at least
+CLUSTER_THRESHOLD ('fuzzy'); otherwise it becomes a representative itself.
+Members never chain: they are compared against representatives only.
+
+Members take over the representative's enriched description and CAS number
+without an LLM call, so fuzzy matching only accepts known spelling variants:
+the tokens the keys do not share must pair up as the same word up to a
+trailing E (GLYCERIN / GLYCERINE, CAFFEIN / CAFFEINE); British spellings
+(SULPHATE / SULFATE) are already equal in the key. Any other near match -
+METHYLPARABEN / ETHYLPARABEN, TRIMETHYLAMINE / TRIETHYLAMINE, BENZOYL /
+BENZYL CHLORIDE - is a different chemical as often as a typo and gets its own
+LLM call. The reported similarity ratio comes from rapidfuzz, or difflib when
+rapidfuzz is not installed.
+"""
+
+import os
+import re
+import difflib
+from chemical_utils import hyper_clean_chemical
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+CLUSTER_THRESHOLD = float(os.environ.get('ENRICHMENT_CLUSTER_THRESHOLD', 90))
+# Blocks with more representatives than this (generic tokens like ACID) are not used for candidates
+CLUSTER_MAX_BLOCK = int(os.environ.get('ENRICHMENT_CLUSTER_MAX_BLOCK', 500))
+BLOCK_PREFIX = 3
+
+GRADE_WORDS = {'IP', 'NF', 'ACS', 'AR', 'LR', 'GR', 'PH', 'EUR', 'REAGENT', 'FOOD', 'COSMETIC'}
+PACK_WORDS = {'BAG', 'BAGS', 'SACK', 'SACKS', 'PAIL', 'PAILS', 'TOTE', 'IBC', 'CAN', 'CANS', 'BOX', 'CTN',
+              'CARTON', 'DRUMS', 'BOTTLE', 'JAR', 'CASE', 'PACK'}
+UNITS = r'(?:KG|KGS|G|GM|GR|MG|L|LT|LTR|ML|LB|LBS|GAL|MT|TON|TONS|OZ)'
+# Pack sizes as left by hyper_clean_chemical (1X20KG -> X20KG)
+_PACK_SIZE = re.compile(rf'^(?:\d+(?:\.\d+)?)?X?\d+(?:\.\d+)?{UNITS}?$')
+# Integers not part of a decimal, a percentage, a pack count (1X20KG) or a quantity with a unit
+_IDENTITY_NUMBER = re.compile(rf'(?<![\d.])(\d+)(?![\d.]|\s*%|\s*X\s*\d|\s*{UNITS}\b)')
+# Vendor / line prefixes and parentheses, as stripped by hyper_clean_chemical
+_PREFIX = re.compile(r'^[A-Z0-9]{1,3}\s*-\s*([A-Z]\s*-)?')
+_PARENTHESES = re.compile(r'\(.*?\)')
+SPELLINGS = (('SULPH', 'SULF'), ('ALUMINIUM', 'ALUMINUM'), ('CAESIUM', 'CESIUM'))
+
+
+def _key_tokens(raw_desc):
+    return [t for word in hyper_clean_chemical(raw_desc).split() for t in word.split('-')
+            if re.search('[A-Z]', t) and t not in GRADE_WORDS and t not in PACK_WORDS
+            and not re.fullmatch(UNITS, t) and not _PACK_SIZE.match(t)]
+
+
+def normalize_description(raw_desc):
+    """(key, numbers) of a description; the key is '' when nothing chemical is left"""
+    if not isinstance(raw_desc, str):
+        return '', ()
+    # hyper_clean_chemical takes a leading short name for a vendor prefix (PEG-20 ...): retry without the hyphen
+    tokens = _key_tokens(raw_desc) or _key_tokens(raw_desc.replace('-', ' ', 1))
+    stripped = _PARENTHESES.sub('', _PREFIX.sub('', raw_desc.strip().upper()))
+    numbers = tuple(sorted({int(n) for n in _IDENTITY_NUMBER.findall(stripped)}))
+    for british, american in SPELLINGS:
+        tokens = [t.replace(british, american) for t in tokens]
+    return ' '.join(sorted(tokens)), numbers
+
+
+def _ratio(a, b):
+    if fuzz is not None:
+        return fuzz.ratio(a, b)
+    return 100.0 * difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def _spelling_stem(token):
+    """A key token without a trailing E: equal stems are known spelling variants"""
+    return token[:-1] if token.endswith('E') else token
+
+
+def similarity(a, b):
+    """
+    0-100 similarity of two keys over the tokens they do not share; 0 unless
+    every such token pairs with a spelling variant of itself
+    """
+    if a == b:
+        return 100.0
+    tokens_a, tokens_b = a.split(), b.split()
+    only_a = sorted(set(tokens_a) - set(tokens_b), key=_spelling_stem)
+    only_b = sorted(set(tokens_b) - set(tokens_a), key=_spelling_stem)
+    if not only_a or len(only_a) != len(only_b):
+        return 0.0
+    if any(_spelling_stem(x) != _spelling_stem(y) for x, y in zip(only_a, only_b)):
+        return 0.0
+    return _ratio(' '.join(only_a), ' '.join(only_b))
+
+
+def _best_match(key, candidates, threshold):
+    """(representative key, score) of the most similar candidate key scoring >= threshold, or None"""
+    best = None
+    for candidate in candidates:
+        score = similarity(key, candidate)
+        if score >= threshold and (best is None or score > best[1]):
+            best = (candidate, score)
+    return best
+
+
+def cluster_descriptions(descriptions, threshold=None):
+    """
+    Cluster distinct descriptions, highest priority first. Returns
+    {member: (representative, 'normalized' | 'fuzzy', similarity)} for the
+    descriptions that do not need an LLM call of their own.
+    """
+    threshold = CLUSTER_THRESHOLD if threshold is None else threshold
+    representatives = {}  # (key, numbers) -> representative description
+    blocks = {}           # (token prefix, numbers) -> [representative keys]
+    members = {}
+    for raw_desc in descriptions:
+        key, numbers = normalize_description(raw_desc)
+        if not key:
+            continue
+        representative = representatives.get((key, numbers))
+        if representative is not None:
+            members[raw_desc] = (representative, 'normalized', 100.0)
+            continue
+        block_keys = {(token[:BLOCK_PREFIX], numbers) for token in key.split()}
+        candidates = {k for b in block_keys if len(blocks.get(b, ())) <= CLUSTER_MAX_BLOCK for k in blocks.get(b, ())}
+        match = _best_match(key, candidates, threshold)
+        if match is not None:
+            members[raw_desc] = (representatives[(match[0], numbers)], 'fuzzy', round(match[1], 1))
+            continue
+        representatives[(key, numbers)] = raw_desc
+        for b in block_keys:
+            blocks.setdefault(b, []).append(key)
+    return members
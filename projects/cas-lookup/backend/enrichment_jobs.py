@@ -0,0 +1,399 @@
+"""
+Enrichment Job Store
+====================
+Spend enrichment runs persisted in enrichment_job / enrichment_work_item, so
+every gunicorn worker sees the same progress, only one run can be active at a
+time and a run survives restarts.
+
+    enrichment_job        one row per run: status, counters, options and a lease
+    enrichment_work_item  one row per distinct raw description, 'pending' until
+                          its outcome (enriched / incomplete / not_found) is written
+
+Exactly one process executes a running job: the lease holder. It renews the
+lease (LEASE_SECONDS) while it works; the outcome of every batch is written in
+the same transaction as the spend_record / material_data updates, together
+with the job counters. If the holder dies, the lease expires and the next
+status read (or app start) in any process claims the job and continues with
+the pending items only, so no description is sent to the LLM twice (except
+those in flight when the process died).
+
+Pause and cancel are status changes the runner picks up within one write
+interval; resume sets the job running again and claims it in the requesting
+process.
+
+Work items are sent in priority order, highest first: the score the job was
+created with (PRIORITY_SCORES, default the spend behind the description), so
+the descriptions carrying most of the spend are enriched first. The runner
+publishes what it enriched (after_spend_enrichment) every
+ENRICHMENT_PUBLISH_INTERVAL seconds and when it stops, and the job tracks the
+spend covered so far (EnrichmentJob.coverage).
+
+Near-duplicate descriptions are clustered when the job is created
+(description_clusters.py): only the representative of a cluster is sent to
+the LLM, and its outcome is written to the members in the same transaction,
+each member flagged with how it matched (match_type, similarity). A
+representative carries the priority of its whole cluster.
+
+With every batch the runner also stores live statistics on the job
+(live_stats): throughput over the last THROUGHPUT_WINDOW seconds, LLM
+latency per provider and a sample of the latest results, which the progress
+stream (GET .../enrich-jobs/<id>/events) pushes to the dashboards.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from models import db, EnrichmentJob, EnrichmentWorkItem
+from spend_enrichment import run_enrichment, apply_enrichment_batch, LatencyStats
+from spend_sync import after_spend_enrichment
+from description_clusters import cluster_descriptions
+
+LEASE_SECONDS = int(os.environ.get('ENRICHMENT_LEASE_SECONDS', 60))
+PUBLISH_INTERVAL = float(os.environ.get('ENRICHMENT_PUBLISH_INTERVAL', 300))
+THROUGHPUT_WINDOW = 60
+RECENT_RESULTS = 10
+
+ACTIVE_STATUSES = ('running', 'paused')
+
+# Identifies this process as a lease holder
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# Work item priority per description (higher first); :recent_since is the period_month a year before the latest
+PRIORITY_SCORES = {
+    'spend': "TOTAL(amount)",
+    'lines': "COUNT(*)",
+    'recent_spend': "TOTAL(CASE WHEN period_month > :recent_since THEN amount END)",
+}
+DEFAULT_PRIORITY = 'spend'
+
+# Descriptions still missing the standardized Name_cas_Number format
+UNENRICHED = "(enriched_description IS NULL OR enriched_description = '' OR enriched_description NOT LIKE '%_cas_%')"
+
+
+class EnrichmentJobConflict(Exception):
+    """Another enrichment job is already running or paused"""
+
+    def __init__(self, job):
+        super().__init__(f"Enrichment job {job.id} is already {job.status}")
+        self.job = job
+
+
+def _lease_expiry():
+    return datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+
+
+def active_job():
+    return EnrichmentJob.query.filter(EnrichmentJob.active == 1).first()
+
+
+def latest_job():
+    return EnrichmentJob.query.order_by(EnrichmentJob.id.desc()).first()
+
+
+def enrichment_candidates(priority=DEFAULT_PRIORITY):
+    """
+    Unenriched descriptions as [(raw_description, priority, spend)], highest
+    priority first, and the spend (all, already enriched) for coverage.
+    """
+    latest = db.session.execute(text("SELECT MAX(period_month) FROM spend_record")).scalar() or 0
+    params = {"recent_since": latest - 100}
+    candidates = db.session.execute(text(f"""
+        SELECT item_description, {PRIORITY_SCORES[priority]} AS priority, TOTAL(amount)
+        FROM spend_record
+        WHERE {UNENRICHED} AND item_description IS NOT NULL AND item_description != ''
+        GROUP BY item_description
+        ORDER BY priority DESC
+    """), params).fetchall()
+    spend_total, spend_enriched = db.session.execute(text(
+        f"SELECT TOTAL(amount), TOTAL(CASE WHEN NOT {UNENRICHED} THEN amount END) FROM spend_record"
+    )).one()
+    return [tuple(c) for c in candidates], spend_total, spend_enriched
+
+
+def create_job(candidates, options=None, priority=DEFAULT_PRIORITY, spend_total=0.0, spend_enriched=0.0, cluster=True):
+    """
+    Insert a running job leased by this process with one work item per
+    distinct description; candidates are descriptions or (description, priority, spend),
+    highest priority first. cluster: group near-duplicates behind one LLM call.
+    """
+    items = {}
+    for candidate in candidates:
+        raw_desc, score, spend = candidate if isinstance(candidate, tuple) else (candidate, 0.0, 0.0)
+        if raw_desc:
+            items[raw_desc] = (score or 0.0, spend or 0.0)
+    members = cluster_descriptions(items) if cluster else {}
+    scores = {raw_desc: score for raw_desc, (score, _) in items.items()}
+    for member, (representative, _, _) in members.items():
+        scores[representative] += items[member][0]
+    job = EnrichmentJob(status='running', active=1, total=len(items), options=json.dumps(options or {}),
+                        priority=priority, spend_total=spend_total, spend_enriched_at_start=spend_enriched,
+                        job_spend=sum(spend for _, spend in items.values()), llm_items=len(items) - len(members),
+                        lease_owner=PROCESS_ID, lease_expires_at=_lease_expiry(), heartbeat_at=datetime.utcnow())
+    db.session.add(job)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        raise EnrichmentJobConflict(active_job())
+    db.session.execute(
+        EnrichmentWorkItem.__table__.insert(),
+        [{"job_id": job.id, "raw_description": d, "status": 'pending', "priority": scores[d], "spend": spend,
+          "cluster_of": members[d][0] if d in members else None,
+          "match_type": members[d][1] if d in members else 'llm',
+          "similarity": members[d][2] if d in members else None, "updated_at": datetime.utcnow()}
+         for d, (_, spend) in items.items()]
+    )
+    db.session.commit()
+    return job
+
+
+def claim_job(job_id):
+    """Take the lease of a running job that has no live holder; True if this process now holds it"""
+    now = datetime.utcnow()
+    claimed = db.session.execute(text("""
+        UPDATE enrichment_job
+        SET full_sync = CASE WHEN lease_owner IS NOT NULL THEN 1 ELSE full_sync END,
+            lease_owner = :owner, lease_expires_at = :expires, heartbeat_at = :now
+        WHERE id = :id AND status = 'running' AND (lease_owner IS NULL OR lease_expires_at < :now)
+    """), {"id": job_id, "owner": PROCESS_ID, "expires": _lease_expiry(), "now": now}).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def set_job_status(job_id, status):
+    """pause / resume / cancel transitions; returns the job or None if the transition is not allowed"""
+    allowed = {'paused': ('running',), 'running': ('paused',), 'cancelled': ACTIVE_STATUSES}[status]
+    values = {"status": status}
+    if status == 'cancelled':
+        values.update(active=None, finished_at=datetime.utcnow())
+    updated = EnrichmentJob.query.filter(EnrichmentJob.id == job_id, EnrichmentJob.status.in_(allowed)) \
+        .update(values, synchronize_session=False)
+    db.session.commit()
+    return db.session.get(EnrichmentJob, job_id) if updated else None
+
+
+# ==========================================
+# RUNNER
+# ==========================================
+
+def _item_status(found, result):
+    if result is not None:
+        return 'enriched'
+    return 'incomplete' if found else 'not_found'
+
+
+class _LiveStats:
+    """Statistics of one run, serialized to enrichment_job.live_stats with each batch"""
+
+    def __init__(self):
+        self.latency = LatencyStats()
+        self.written = deque()  # (monotonic time, items written so far)
+        self.items = 0
+        self.recent = deque(maxlen=RECENT_RESULTS)
+        self.started = time.monotonic()
+
+    def add(self, outcomes, statuses):
+        now = time.monotonic()
+        self.items += len(outcomes)
+        self.written.append((now, self.items))
+        while len(self.written) > 2 and self.written[0][0] < now - THROUGHPUT_WINDOW:
+            self.written.popleft()
+        for (raw_desc, _, result), status in list(zip(outcomes, statuses))[-RECENT_RESULTS:]:
+            self.recent.append({"raw_description": raw_desc, "status": status,
+                                "enriched_description": result[0] if result else None,
+                                "cas_number": result[1] if result else None})
+
+    def throughput(self):
+        """Items per second over the window (since the run started while the window is filling)"""
+        now = time.monotonic()
+        if now - self.started < THROUGHPUT_WINDOW or not self.written:
+            since, before = self.started, 0
+        else:
+            since, before = self.written[0]
+        return round((self.items - before) / (now - since), 2) if now > since else 0.0
+
+    def to_json(self):
+        return json.dumps({
+            "throughput": self.throughput(),
+            "latency": self.latency.snapshot(),
+            "recent": list(self.recent),
+            "run_items": self.items,
+            "updated_at": datetime.utcnow().isoformat()
+        })
+
+
+def _apply_job_batch(job_id, items, clusters, live):
+    """
+    apply_batch for run_enrichment: enrichment, work item outcomes, job
+    counters and live statistics in one transaction; each representative's
+    outcome also goes to its cluster members. items: {raw_description: (item id, spend)},
+    clusters: {representative: [pending members]}
+    """
+    def apply(outcomes):
+        outcomes = outcomes + [(member, found, result) for raw_desc, found, result in outcomes
+                               for member in clusters.get(raw_desc, ())]
+        statuses = [_item_status(found, result) for _, found, result in outcomes]
+        live.add(outcomes, statuses)
+        now = datetime.utcnow()
+        affected = apply_enrichment_batch(outcomes, commit=False)
+        db.session.execute(
+            text("UPDATE enrichment_work_item SET status = :s, enriched_description = :e, cas_number = :c, "
+                 "inci_name = :i, updated_at = :t WHERE id = :id"),
+            [{"id": items[raw_desc][0], "s": status, "t": now,
+              "e": result[0] if result else None, "c": result[1] if result else None,
+              "i": result[2] if result else None}
+             for (raw_desc, _, result), status in zip(outcomes, statuses)]
+        )
+        owned = db.session.execute(text("""
+            UPDATE enrichment_job
+            SET current = current + :n, processed = processed + :p, errors = errors + :e,
+                done_spend = done_spend + :done, enriched_spend = enriched_spend + :enriched,
+                live_stats = :live, heartbeat_at = :now, lease_expires_at = :expires
+            WHERE id = :id AND lease_owner = :owner
+        """), {"id": job_id, "owner": PROCESS_ID, "now": now, "expires": _lease_expiry(), "n": len(outcomes),
+               "p": sum(1 for _, found, _ in outcomes if found),
+               "e": sum(1 for _, found, _ in outcomes if not found),
+               "done": sum(items[raw_desc][1] for raw_desc, _, _ in outcomes),
+               "enriched": sum(items[raw_desc][1] for raw_desc, _, result in outcomes if result is not None),
+               "live": live.to_json()}).rowcount
+        if not owned:
+            # The lease was taken over: leave the batch to the new holder
+            raise RuntimeError(f"lease on enrichment job {job_id} lost")
+        db.session.commit()
+        return affected
+    return apply
+
+
+def _should_stop(job_id, publisher):
+    """Renew the lease and publish when due; stop when the job is no longer running or another process took it over"""
+    def check():
+        now = datetime.utcnow()
+        renewed = db.session.execute(text("""
+            UPDATE enrichment_job SET heartbeat_at = :now, lease_expires_at = :expires
+            WHERE id = :id AND lease_owner = :owner AND status = 'running'
+        """), {"id": job_id, "owner": PROCESS_ID, "now": now, "expires": _lease_expiry()}).rowcount
+        db.session.commit()
+        if renewed and publisher.due():
+            publisher.publish()
+        return renewed == 0
+    return check
+
+
+class _Publisher:
+    """Enriched descriptions written but not yet synced to the spend views (after_spend_enrichment)"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.unpublished = set()
+        self.published_at = time.monotonic()
+        self.publications = 0
+
+    def add(self, affected):
+        self.unpublished.update(affected)
+        return affected
+
+    def due(self):
+        return bool(self.unpublished) and time.monotonic() - self.published_at >= self.interval
+
+    def publish(self, materials=None, final=False):
+        """Sync the unpublished descriptions (or everything when materials is None on the final call)"""
+        if not final:
+            materials = self.unpublished
+        self.unpublished, self.published_at = set(), time.monotonic()
+        try:
+            after_spend_enrichment(materials=materials)
+            self.publications += 1
+        except Exception as e:
+            db.session.rollback()
+            print(f"Post-enrichment sync failed: {e}")
+
+
+def _finish_run(job_id, error=None):
+    """Release the lease; complete the job when it is still running and nothing is pending"""
+    pending = db.session.execute(text(
+        "SELECT COUNT(*) FROM enrichment_work_item WHERE job_id = :id AND status = 'pending'"
+    ), {"id": job_id}).scalar()
+    now = datetime.utcnow()
+    if error is not None:
+        done = "status = 'failed', active = NULL, finished_at = :now, last_error = :error,"
+    elif not pending:
+        done = "status = CASE WHEN status = 'running' THEN 'done' ELSE status END, " \
+               "active = CASE WHEN status = 'running' THEN NULL ELSE active END, " \
+               "finished_at = CASE WHEN status = 'running' THEN :now ELSE finished_at END,"
+    else:
+        done = ""
+    db.session.execute(text(f"""
+        UPDATE enrichment_job SET {done} lease_owner = NULL, lease_expires_at = NULL
+        WHERE id = :id AND lease_owner = :owner
+    """), {"id": job_id, "owner": PROCESS_ID, "now": now, "error": error})
+    db.session.commit()
+
+
+def run_job(app, job_id, cleaner_factory=None):
+    """Work through the pending items of a job this process holds the lease of"""
+    with app.app_context():
+        job = db.session.get(EnrichmentJob, job_id)
+        options = json.loads(job.options) if job.options else {}
+        publisher = _Publisher(PUBLISH_INTERVAL)
+        try:
+            if cleaner_factory is None:
+                from llm_helper import BedrockCleaner as cleaner_factory
+            cleaner = cleaner_factory()
+            # Highest priority first, so the spend dashboards fill up with the bulk of the spend early
+            rows = db.session.execute(text(
+                "SELECT raw_description, id, spend, cluster_of FROM enrichment_work_item "
+                "WHERE job_id = :id AND status = 'pending' ORDER BY priority DESC, id"
+            ), {"id": job_id}).fetchall()
+            items = {raw_desc: (item_id, spend) for raw_desc, item_id, spend, _ in rows}
+            # Members follow their representative; one whose representative is no longer pending asks itself
+            clusters, representatives = {}, []
+            for raw_desc, _, _, cluster_of in rows:
+                if cluster_of in items:
+                    clusters.setdefault(cluster_of, []).append(raw_desc)
+                else:
+                    representatives.append(raw_desc)
+            live = _LiveStats()
+            apply_batch = _apply_job_batch(job_id, items, clusters, live)
+            progress = {"current": 0, "processed": 0, "errors": 0}
+            run_enrichment(cleaner, representatives, progress,
+                           workers=options.get('workers'), rate=options.get('rate'),
+                           apply_batch=lambda outcomes: publisher.add(apply_batch(outcomes)),
+                           should_stop=_should_stop(job_id, publisher), latency=live.latency)
+            _finish_run(job_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Enrichment job {job_id} failed: {e}")
+            _finish_run(job_id, error=str(e))
+
+        # Re-link spend to materials and republish the spend cube
+        job = db.session.get(EnrichmentJob, job_id)
+        db.session.refresh(job)
+        publisher.publish(materials=None if job.full_sync else publisher.unpublished, final=True)
+
+
+def start_job(app, job_id, cleaner_factory=None):
+    """Run a job this process holds the lease of in a background thread"""
+    thread = threading.Thread(target=run_job, args=(app, job_id, cleaner_factory), daemon=True)
+    thread.start()
+    return thread
+
+
+def resume_orphaned_job(app, cleaner_factory=None):
+    """Claim and continue the running job whose lease holder is gone; returns its id or None"""
+    job = EnrichmentJob.query.filter(
+        EnrichmentJob.status == 'running',
+        db.or_(EnrichmentJob.lease_owner.is_(None), EnrichmentJob.lease_expires_at < datetime.utcnow())
+    ).first()
+    if job is None or not claim_job(job.id):
+        return None
+    print(f"🔁 Resuming enrichment job {job.id} in process {PROCESS_ID}")
+    start_job(app, job.id, cleaner_factory)
+    return job.id
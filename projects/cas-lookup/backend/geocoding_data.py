@@ -94,4 +94,54 @@ CITY_COORDS = {
     'taiwan': {'lat': 23.6978, 'lng': 120.9605, 'name': 'Taiwan'},
     'israel': {'lat': 31.0461, 'lng': 34.8516, 'name': 'Israel'},
     'france': {'lat': 46.2276, 'lng': 2.2137, 'name': 'France'},
+    'india': {'lat': 20.5937, 'lng': 78.9629, 'name': 'India'},
+    'brazil': {'lat': -14.235, 'lng': -51.9253, 'name': 'Brazil'},
+    'hong kong': {'lat': 22.3193, 'lng': 114.1694, 'name': 'Hong Kong'},
+    'beijing': {'lat': 39.9042, 'lng': 116.4074, 'name': 'Beijing, China'},
+    'shanghai': {'lat': 31.2304, 'lng': 121.4737, 'name': 'Shanghai, China'},
+    'hangzhou': {'lat': 30.2741, 'lng': 120.1551, 'name': 'Hangzhou, China'},
+    'changzhou': {'lat': 31.8112, 'lng': 119.9741, 'name': 'Changzhou, China'},
+    'houston': {'lat': 29.7604, 'lng': -95.3698, 'name': 'Houston, USA'},
+    'chicago': {'lat': 41.8781, 'lng': -87.6298, 'name': 'Chicago, USA'},
+    'bangkok': {'lat': 13.7563, 'lng': 100.5018, 'name': 'Bangkok, Thailand'},
+    'korea': {'lat': 35.9078, 'lng': 127.7669, 'name': 'South Korea'},
+    'belgium': {'lat': 50.5039, 'lng': 4.4699, 'name': 'Belgium'},
+    'italy': {'lat': 41.8719, 'lng': 12.5674, 'name': 'Italy'},
+    'canada': {'lat': 56.1304, 'lng': -106.3468, 'name': 'Canada'},
+    'indonesia': {'lat': -0.7893, 'lng': 113.9213, 'name': 'Indonesia'},
+    'istanbul': {'lat': 41.0082, 'lng': 28.9784, 'name': 'Istanbul, Turkey'},
+    'frankfurt': {'lat': 50.1109, 'lng': 8.6821, 'name': 'Frankfurt, Germany'},
+    'jebel ali': {'lat': 25.0118, 'lng': 55.0612, 'name': 'Jebel Ali, UAE'},
+    'gandhinagar': {'lat': 23.2156, 'lng': 72.6369, 'name': 'Gandhinagar, India'},
+    'bhavnagar': {'lat': 21.7645, 'lng': 72.1519, 'name': 'Bhavnagar, India'},
+    'kochi': {'lat': 9.9312, 'lng': 76.2673, 'name': 'Kochi, India'},
+    'goa': {'lat': 15.2993, 'lng': 74.124, 'name': 'Goa, India'},
+    'ghaziabad': {'lat': 28.6692, 'lng': 77.4538, 'name': 'Ghaziabad, India'},
+    'gurgaon': {'lat': 28.4595, 'lng': 77.0266, 'name': 'Gurgaon, India'},
 }
+
+# Alternative spellings / names -> CITY_COORDS key (used by site_geocoding.py)
+PLACE_ALIASES = {
+    'ahmedbad': 'ahmedabad',
+    'amdavad': 'ahmedabad',
+    'gujrat': 'gujarat',
+    'kachchh': 'kutch',
+    'navi mumbai': 'navimumbai',
+    'gurugram': 'gurgaon',
+    'cochin': 'kochi',
+    'itajai': 'itaja',
+    'sao bernardo do campo': 'sao bernardo do',
+    'sao caetano do sul': 'sao caetano do',
+    'santana de parnaiba': 'santana de parn',
+    'hongkong': 'hong kong',
+    'honkong': 'hong kong',
+    'south korea': 'korea',
+    'seoul korea': 'seoul',
+    'united arab emirates': 'uae',
+    'united states': 'usa',
+    'holland': 'netherlands',
+}
+
+# Tokens of supplier site codes that carry no place information
+# ('SURAT-C9-194Q', 'Daman-TDS', 'GANDHIDHAM(NON)')
+SITE_NOISE_TOKENS = {'q', 'tds', 'non', 'unit', 'plant', 'site', 'sko', 'ltd', 'pvt', 'gidc', 'midc'}
@@ -10,6 +10,7 @@ class BedrockCleaner:
                 region_name=region_name
             )
             self.model_id = "meta.llama3-70b-instruct-v1:0" 
+            self.provider = f"bedrock:{self.model_id}"
             self.available = True
         except Exception as e:
             print(f"Bedrock Client Init Error: {e}")
@@ -2,12 +2,15 @@
 Spend Data Management Script
 =============================
 This script loads spend data from the Purchase History Excel file into the database.
-It handles all 25 columns and ensures robust data ingestion.
+Columns are mapped by header name and cleaned vectorized (see spend_ingest.py).
+Re-runs apply only the delta (new / changed / removed PO lines) and keep
+enrichment results; --replace reloads everything. Workbooks are streamed
+(see spend_workbook.py); a directory of extracts and --all-sheets load
+several sheets as one extract, read in parallel.
 """
 
 import os
 import sys
-import pandas as pd
 # Fix path if run directly
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
@@ -15,6 +18,8 @@ if current_dir not in sys.path:
 
 from app import app, db
 from models import SpendRecord
+from spend_sync import after_spend_ingest
+from spend_ingest import ingest_spend_file
 
 def clear_spend_data():
     """Clear all existing spend records from the database"""
@@ -23,106 +28,33 @@ def clear_spend_data():
             count = SpendRecord.query.count()
             db.session.query(SpendRecord).delete()
             db.session.commit()
+            after_spend_ingest()
             print(f"✅ Cleared {count} existing spend records")
     except Exception as e:
         print(f"❌ Error clearing data: {e}")
         db.session.rollback()
 
-def load_spend_data():
-    """Load spend data from Excel file into database"""
+def load_spend_data(xlsx_path=None, replace=False, all_sheets=False, workers=None):
+    """Load spend data from Excel file(s) into database: only the delta by default, everything with replace=True"""
     print("🚀 Starting Spend Data Ingestion from Excel...")
     
     try:
         with app.app_context():
-            # Check if data already exists
-            existing_count = SpendRecord.query.count()
-            if existing_count > 0:
-                print(f"⚠️  Database already contains {existing_count} spend records. Clearing and reloading...")
-                clear_spend_data()
-            
-            # Load Excel file
-            xlsx_path = os.path.join(current_dir, 'Purchase History.xlsx')
+            xlsx_path = xlsx_path or os.path.join(current_dir, 'Purchase History.xlsx')
             if not os.path.exists(xlsx_path):
-                print(f"❌ Purchase History.xlsx not found at: {xlsx_path}")
+                print(f"❌ Spend extract not found at: {xlsx_path}")
                 return
             
-            # Read Excel with no header (we'll map manually)
-            print("📊 Reading Excel file...")
-            df = pd.read_excel(xlsx_path, sheet_name='Sheet1', header=None, engine='openpyxl')
-            
-            print(f"📊 Processing {len(df)} rows...")
-            
-            # Helper function to safely parse float values
-            def parse_float(val):
-                try:
-                    if pd.isna(val): return 0.0
-                    return float(str(val).replace(',', '').strip())
-                except:
-                    return 0.0
-            
-            # Helper function to safely get string values
-            def parse_str(val):
-                if pd.isna(val): return None
-                return str(val).strip()
-            
-            records = []
-            skipped = 0
-            
-            for idx, row in df.iterrows():
-                # Skip header row or empty rows
-                if idx == 0 or (pd.isna(row[9]) and pd.isna(row[12])):
-                    skipped += 1
-                    continue
-                
-                try:
-                    # Amount is base_price_inr (Index 20)
-                    base_price_inr = parse_float(row[20])
-                    
-                    record = SpendRecord(
-                        operating_unit=parse_str(row[0]),
-                        po_number=parse_str(row[1]),
-                        po_date=parse_str(row[2]),
-                        month=parse_str(row[3]),
-                        year=parse_str(row[4]),
-                        po_type=parse_str(row[5]),
-                        po_status=parse_str(row[6]),
-                        buyer_name=parse_str(row[7]),
-                        supplier_number=parse_str(row[8]),
-                        vendor_name=parse_str(row[9]) or "Unknown",
-                        supplier_site=parse_str(row[10]),
-                        item_code=parse_str(row[11]),
-                        item_description=parse_str(row[12]) or "Unknown",
-                        quantity=parse_float(row[13]),
-                        uom=parse_str(row[14]),
-                        currency=parse_str(row[15]),
-                        exchange_rate=parse_float(row[16]),
-                        price=parse_float(row[17]),
-                        payment_term=parse_str(row[18]),
-                        base_price_fc=parse_float(row[19]),
-                        base_price_inr=base_price_inr,
-                        amount=base_price_inr, # Compatibility alias
-                        freight_terms=parse_str(row[21]) if len(row) > 21 else None,
-                        ship_via=parse_str(row[22]) if len(row) > 22 else None,
-                        fob_dsp=parse_str(row[23]) if len(row) > 23 else None,
-                        is_contract=False
-                    )
-                    records.append(record)
-                    
-                    if len(records) % 1000 == 0:
-                        print(f"  Processed {len(records)} records...")
-                        
-                except Exception as e:
-                    print(f"⚠️  Error processing row {idx}: {e}")
-                    skipped += 1
-                    continue
+            existing_count = SpendRecord.query.count()
+            if existing_count > 0 and replace:
+                print(f"⚠️  Database already contains {existing_count} spend records. Replacing them...")
+            elif existing_count > 0:
+                print(f"🔄 Database contains {existing_count} spend records. Applying the delta (enrichment is kept)...")
             
-            if records:
-                print(f"💾 Saving {len(records)} records to database...")
-                db.session.bulk_save_objects(records)
-                db.session.commit()
-                print(f"✅ Successfully ingested {len(records)} spend records.")
-                
-                # Verify
+            # Header-mapped, vectorized cleaning and batched writes in one transaction (see spend_ingest.py)
+            summary = ingest_spend_file(xlsx_path, mode='replace' if replace else 'delta',
+                                        sheet_name=None if all_sheets else 0, workers=workers)
+            if summary["inserted"] or summary.get("unchanged") or summary.get("updated"):
                 total_spend = db.session.query(db.func.sum(SpendRecord.amount)).scalar() or 0
                 print(f"📈 Total Spend in DB: ₹{total_spend:,.2f}")
             else:
@@ -137,12 +69,16 @@ def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--clear', action='store_true')
+    parser.add_argument('--replace', action='store_true', help="Reload everything (drops enrichment results)")
+    parser.add_argument('--all-sheets', action='store_true', help="Read every sheet of each workbook")
+    parser.add_argument('--workers', type=int, help="Processes reading sheets in parallel (default: CPU count)")
+    parser.add_argument('path', nargs='?', help="Purchase History extract (.xlsx / .csv) or a directory of them")
     args = parser.parse_args()
     
     if args.clear:
         clear_spend_data()
     else:
-        load_spend_data()
+        load_spend_data(args.path, replace=args.replace, all_sheets=args.all_sheets, workers=args.workers)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,242 @@
+"""
+Supplier Map Clustering
+=======================
+Server-side marker clustering for /api/spend-analysis/suppliers-map, so the
+map receives what the viewport can show instead of one marker per
+(vendor, operating unit, site).
+
+Markers are projected to Web Mercator and bucketed into a square grid of
+CELLS_PER_TILE x CELLS_PER_TILE cells per map tile, i.e. a cluster spans about
+64 px on screen at every zoom level. Above MAX_CLUSTER_ZOOM only markers at
+identical coordinates are merged (sites geocode to city centres, so many
+suppliers share a point).
+
+A MapIndex holds the markers of one filter combination with the cluster
+summaries of every zoom level precomputed (count, spend, transactions, top
+vendors, bounds). Indexes are cached per filter tuple and spend data version;
+a request is then a bounding-box selection over one level's arrays.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from site_geocoding import site_locations, geocode_site, DEFAULT_COORDS
+
+# Grid cells per map tile edge (256 px tiles -> 64 px cells)
+CELLS_PER_TILE = 4
+MAX_CLUSTER_ZOOM = 16
+MAX_ZOOM = 22
+TOP_VENDORS = 5
+INDEX_CACHE_SIZE = 32
+
+# Web Mercator latitude limit
+MAX_LATITUDE = 85.05112878
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def spend_category(amount):
+    """Marker styling bucket for a spend amount"""
+    if amount > 50000000:
+        return 'very_high'
+    if amount > 10000000:
+        return 'high'
+    if amount > 1000000:
+        return 'medium'
+    return 'low'
+
+
+def supplier_points(cube, mask):
+    """
+    One row per (vendor, operating unit, site) in mask, highest spend first:
+    vendor_name, operating_unit, supplier_site, latitude, longitude,
+    location_confidence, total_spend, transaction_count.
+    Sites resolve through site_location, then the operating unit, then DEFAULT_COORDS.
+    """
+    groups = cube.group_by(['vendor_name', 'operating_unit', 'supplier_site'], mask)
+    points = pd.DataFrame({
+        "vendor_name": groups['vendor_name'],
+        "operating_unit": groups['operating_unit'],
+        "supplier_site": groups['supplier_site'],
+        "total_spend": pd.to_numeric(groups['amount'], errors='coerce').fillna(0.0).astype(float),
+        "transaction_count": groups['count'].astype(np.int64),
+    })
+    # One lookup per distinct site / operating unit
+    locations = site_locations(points['supplier_site'].dropna().unique())
+    coords = {}
+    for site in points['supplier_site'].dropna().unique():
+        loc = locations.get(site)
+        if loc and loc['latitude'] is not None:
+            coords[site] = (loc['latitude'], loc['longitude'], loc['confidence'])
+    unit_coords = {}
+    for unit in points['operating_unit'].dropna().unique():
+        loc = geocode_site(unit)
+        if loc['latitude'] is not None:
+            unit_coords[unit] = (loc['latitude'], loc['longitude'], 0.0)
+    fallback = (DEFAULT_COORDS[0], DEFAULT_COORDS[1], 0.0)
+    resolved = [coords.get(site) or unit_coords.get(unit) or fallback
+                for site, unit in zip(points['supplier_site'], points['operating_unit'])]
+    resolved = np.array(resolved, dtype=float).reshape(-1, 3)
+    points['latitude'], points['longitude'], points['location_confidence'] = resolved.T
+    return points
+
+
+def _mercator(lat, lng):
+    """Normalized Web Mercator coordinates in [0, 1) (y grows southwards, as map tiles do)"""
+    x = (lng + 180.0) / 360.0
+    phi = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    y = (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / np.pi) / 2.0
+    return np.clip(x, 0.0, np.nextafter(1.0, 0.0)), np.clip(y, 0.0, np.nextafter(1.0, 0.0))
+
+
+def in_bbox(lat, lng, bbox):
+    """Boolean mask of coordinates inside (south, west, north, east); west > east crosses the antimeridian"""
+    south, west, north, east = bbox
+    inside = (lat >= south) & (lat <= north)
+    if west <= east:
+        return inside & (lng >= west) & (lng <= east)
+    return inside & ((lng >= west) | (lng <= east))
+
+
+class MapIndex:
+    """Markers of one filter combination with per-zoom cluster summaries"""
+
+    def __init__(self, points):
+        self.points = points.reset_index(drop=True)
+        self.lat = self.points['latitude'].to_numpy(dtype=float)
+        self.lng = self.points['longitude'].to_numpy(dtype=float)
+        self.spend = self.points['total_spend'].to_numpy(dtype=float)
+        self.transactions = self.points['transaction_count'].to_numpy(dtype=np.int64)
+        self.vendor_codes, vendors = pd.factorize(self.points['vendor_name'], use_na_sentinel=False)
+        self.vendors = [None if pd.isna(v) else v for v in vendors]
+        self.columns = {c: self.points[c].tolist() for c in self.points.columns}
+        self.x, self.y = _mercator(self.lat, self.lng)
+        self.summary = {
+            "total_suppliers": int(self.points['vendor_name'].nunique()),
+            "total_sites": int(self.points['supplier_site'].nunique(dropna=False)),
+            "total_spend": float(self.spend.sum())
+        }
+        self.levels = []
+        if len(self.points):
+            # Identical coordinates share a key at the exact level
+            _, coord_key = np.unique(np.stack([self.lat, self.lng], axis=1), axis=0, return_inverse=True)
+            self.coord_key = coord_key.reshape(-1).astype(np.int64)
+            self.levels = [self._cluster_level(zoom) for zoom in range(MAX_CLUSTER_ZOOM + 2)]
+
+    def _cell_keys(self, zoom):
+        if zoom > MAX_CLUSTER_ZOOM:
+            return self.coord_key
+        cells = (1 << zoom) * CELLS_PER_TILE
+        return (self.y * cells).astype(np.int64) * cells + (self.x * cells).astype(np.int64)
+
+    def _cluster_level(self, zoom):
+        """Cluster arrays of one zoom level, sorted by spend desc"""
+        keys, inverse = np.unique(self._cell_keys(zoom), return_inverse=True)
+        n = len(keys)
+        count = np.bincount(inverse, minlength=n)
+        # members grouped by cluster: per-cluster first member and bounds via reduceat
+        members = np.argsort(inverse, kind='stable')
+        starts = np.searchsorted(inverse[members], np.arange(n))
+        bounds = [np.minimum.reduceat(self.lat[members], starts), np.minimum.reduceat(self.lng[members], starts),
+                  np.maximum.reduceat(self.lat[members], starts), np.maximum.reduceat(self.lng[members], starts)]
+        # spend per (cluster, vendor), best vendors first within each cluster
+        n_vendor = max(len(self.vendors), 1)
+        pair_keys, pair_inverse = np.unique(inverse * n_vendor + self.vendor_codes, return_inverse=True)
+        pair_spend = np.bincount(pair_inverse, weights=self.spend, minlength=len(pair_keys))
+        pair_cluster, pair_vendor = pair_keys // n_vendor, pair_keys % n_vendor
+        order = np.lexsort((pair_vendor, -pair_spend, pair_cluster))
+        pair_cluster, pair_vendor, pair_spend = pair_cluster[order], pair_vendor[order], pair_spend[order]
+        pair_starts = np.searchsorted(pair_cluster, np.arange(n))
+        rank = np.arange(len(pair_cluster)) - pair_starts[pair_cluster]
+        top = rank < TOP_VENDORS
+        level = {
+            "count": count,
+            "latitude": np.bincount(inverse, weights=self.lat, minlength=n) / np.maximum(count, 1),
+            "longitude": np.bincount(inverse, weights=self.lng, minlength=n) / np.maximum(count, 1),
+            "total_spend": np.bincount(inverse, weights=self.spend, minlength=n),
+            "transaction_count": np.bincount(inverse, weights=self.transactions, minlength=n).astype(np.int64),
+            "vendor_count": np.bincount(pair_cluster, minlength=n),
+            "first_member": members[starts],
+            "bounds": np.stack(bounds, axis=1),
+            "keys": keys,
+            "top_cluster": pair_cluster[top],
+            "top_vendor": pair_vendor[top],
+            "top_spend": pair_spend[top],
+            "top_starts": np.searchsorted(pair_cluster[top], np.arange(n + 1)),
+        }
+        level["order"] = np.lexsort((keys, -level["total_spend"]))
+        return level
+
+    def point(self, i):
+        """Supplier marker dict of point i (the legacy suppliers-map shape)"""
+        col = self.columns
+        amount = col['total_spend'][i]
+        return {
+            "vendor_name": col['vendor_name'][i],
+            "supplier_site": col['supplier_site'][i] or "Unknown",
+            "operating_unit": col['operating_unit'][i] or "Unknown",
+            "latitude": col['latitude'][i],
+            "longitude": col['longitude'][i],
+            "location_confidence": col['location_confidence'][i],
+            "total_spend": amount,
+            "transaction_count": col['transaction_count'][i],
+            "spend_category": spend_category(amount)
+        }
+
+    def suppliers(self, bbox=None):
+        """Every marker (inside bbox), highest spend first"""
+        rows = np.arange(len(self.points)) if bbox is None else np.flatnonzero(in_bbox(self.lat, self.lng, bbox))
+        return [self.point(i) for i in rows.tolist()]
+
+    def clusters(self, zoom, bbox=None):
+        """Clusters of a zoom level whose centre lies inside bbox; single markers come back as points"""
+        if not self.levels:
+            return []
+        level_zoom = min(zoom, MAX_CLUSTER_ZOOM + 1)
+        level = self.levels[level_zoom]
+        order = level["order"]
+        if bbox is not None:
+            order = order[in_bbox(level["latitude"][order], level["longitude"][order], bbox)]
+        features = []
+        for c in order.tolist():
+            if level["count"][c] == 1:
+                features.append(dict(self.point(int(level["first_member"][c])), type="point"))
+                continue
+            top = range(level["top_starts"][c], level["top_starts"][c + 1])
+            amount = float(level["total_spend"][c])
+            south, west, north, east = (float(v) for v in level["bounds"][c])
+            features.append({
+                "type": "cluster",
+                "id": f"{level_zoom}/{int(level['keys'][c])}",
+                "latitude": round(float(level["latitude"][c]), 6),
+                "longitude": round(float(level["longitude"][c]), 6),
+                "count": int(level["count"][c]),
+                "vendor_count": int(level["vendor_count"][c]),
+                "total_spend": amount,
+                "transaction_count": int(level["transaction_count"][c]),
+                "spend_category": spend_category(amount),
+                "top_vendor": self.vendors[level["top_vendor"][top.start]],
+                "top_vendors": [{"vendor_name": self.vendors[level["top_vendor"][t]],
+                                 "total_spend": float(level["top_spend"][t])} for t in top],
+                "bounds": [south, west, north, east]
+            })
+        return features
+
+
+def get_map_index(cube, filters):
+    """MapIndex for a cube filter dict, cached per filter tuple and cube data version"""
+    key = (tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in filters.items())),
+           cube.data_version)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = MapIndex(supplier_points(cube, cube.mask(filters)))
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
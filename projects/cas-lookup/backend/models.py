@@ -6,6 +6,12 @@ db = SQLAlchemy()
 
 class MaterialData(db.Model):
     __tablename__ = 'material_data'
+    __table_args__ = (
+        db.Index('ix_material_data_sub_category', 'sub_category'),
+        db.Index('ix_material_data_item_description', 'item_description'),
+        db.Index('ix_material_data_cas_number', 'cas_number'),
+        db.Index('ix_material_data_enriched_description', 'enriched_description'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -71,6 +77,9 @@ class MaterialData(db.Model):
 
 class MaterialParameter(db.Model):
     __tablename__ = 'material_parameter'
+    __table_args__ = (
+        db.Index('ix_material_parameter_material_id_name', 'material_id', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     material_id = db.Column(db.Integer, db.ForeignKey('material_data.id'), nullable=False)
@@ -146,6 +155,25 @@ class ClusterOverride(db.Model):
 
 class SpendRecord(db.Model):
     __tablename__ = 'spend_record'
+    __table_args__ = (
+        # Filter / group-by columns of the spend endpoints (see query_plans.py)
+        db.Index('ix_spend_record_operating_unit_year', 'operating_unit', 'year'),
+        db.Index('ix_spend_record_year', 'year'),
+        db.Index('ix_spend_record_vendor_name', 'vendor_name'),
+        db.Index('ix_spend_record_enriched_description', 'enriched_description'),
+        db.Index('ix_spend_record_item_description', 'item_description'),
+        db.Index('ix_spend_record_po_number', 'po_number'),
+        db.Index('ix_spend_record_cas_number', 'cas_number'),
+        db.Index('ix_spend_record_period_month', 'period_month'),
+        db.Index('ix_spend_record_fiscal_year_operating_unit', 'fiscal_year', 'operating_unit'),
+        # Keyset pagination sort keys of the spend table view: (sort column, id)
+        db.Index('ix_spend_record_amount_id', 'amount', 'id'),
+        db.Index('ix_spend_record_quantity_id', 'quantity', 'id'),
+        db.Index('ix_spend_record_po_date_d_id', 'po_date_d', 'id'),
+        db.Index('ix_spend_record_operating_unit_id', 'operating_unit', 'id'),
+        # PO-line identity for delta ingestion (see spend_ingest.py)
+        db.Index('ix_spend_record_line_key', 'line_key'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -175,6 +203,17 @@ class SpendRecord(db.Model):
     freight_terms = db.Column(db.String(100))            # Col 21: FREIGHT_TERMS_DSP
     ship_via = db.Column(db.String(100))                 # Col 22: SHIP_VIA_LOOKUP_CODE
     fob_dsp = db.Column(db.String(100))                  # Col 23: FOB_DSP
+    line_number = db.Column(db.String(50))               # LINE_NUMBER (newer extracts)
+    shipment_number = db.Column(db.String(50))           # SHIPMENT_NUMBER (newer extracts)
+    
+    # PO-line fingerprint for delta ingestion (see spend_ingest.py)
+    line_key = db.Column(db.String(300))                 # po_number|line|shipment|occurrence
+    content_hash = db.Column(db.Integer)                 # 64-bit hash of the source values
+    
+    # Typed periods derived from po_date at ingestion (see spend_periods.py)
+    po_date_d = db.Column(db.Date)
+    period_month = db.Column(db.Integer)                 # yyyymm
+    fiscal_year = db.Column(db.Integer)                  # FY label (year the fiscal year ends in)
     
     # Metadata
     enriched_description = db.Column(db.String(500))     # NEW: LLM standardized name
@@ -189,6 +228,9 @@ class SpendRecord(db.Model):
             'operating_unit': self.operating_unit,
             'po_number': self.po_number,
             'po_date': self.po_date,
+            'po_date_d': self.po_date_d.isoformat() if self.po_date_d else None,
+            'period_month': self.period_month,
+            'fiscal_year': self.fiscal_year,
             'month': self.month,
             'year': self.year,
             'po_type': self.po_type,
@@ -214,10 +256,54 @@ class SpendRecord(db.Model):
             'freight_terms': self.freight_terms,
             'ship_via': self.ship_via,
             'fob_dsp': self.fob_dsp,
+            'line_number': self.line_number,
+            'shipment_number': self.shipment_number,
             'is_contract': self.is_contract,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class SpendTombstone(db.Model):
+    __tablename__ = 'spend_tombstone'
+    
+    # PO lines that disappeared from the ERP extract in a delta load; a line coming back takes its enrichment again
+    line_key = db.Column(db.String(300), primary_key=True)
+    spend_id = db.Column(db.Integer)                     # id the line had in spend_record
+    po_number = db.Column(db.String(100))
+    vendor_name = db.Column(db.String(255))
+    item_description = db.Column(db.String(500))
+    amount = db.Column(db.Float)
+    enriched_description = db.Column(db.String(500))
+    cas_number = db.Column(db.String(100))
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'line_key': self.line_key,
+            'spend_id': self.spend_id,
+            'po_number': self.po_number,
+            'vendor_name': self.vendor_name,
+            'item_description': self.item_description,
+            'amount': self.amount,
+            'enriched_description': self.enriched_description,
+            'cas_number': self.cas_number,
+            'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None
+        }
+
+class SpendMaterialLink(db.Model):
+    __tablename__ = 'spend_material_link'
+    
+    # One row per linked spend line (see spend_links.py for the matching precedence)
+    spend_id = db.Column(db.Integer, db.ForeignKey('spend_record.id'), primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('material_data.id'), nullable=False, index=True)
+    match_type = db.Column(db.String(20), nullable=False)  # 'cas', 'description' or 'prefix'
+    
+    def to_dict(self):
+        return {
+            'spend_id': self.spend_id,
+            'material_id': self.material_id,
+            'match_type': self.match_type
+        }
+
 class UserPreference(db.Model):
     __tablename__ = 'user_preference'
     
@@ -232,3 +318,211 @@ class UserPreference(db.Model):
             'value': self.value,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+class SpendRollup(db.Model):
+    __tablename__ = 'spend_rollup'
+    __table_args__ = (
+        # Incremental refresh after enrichment deletes / re-inserts the groups of some materials
+        db.Index('ix_spend_rollup_rollup_enriched', 'rollup', 'enriched_description'),
+    )
+    
+    # Pre-aggregated spend per rollup grain (see spend_rollup.py); columns outside a grain stay NULL
+    id = db.Column(db.Integer, primary_key=True)
+    rollup = db.Column(db.String(50), nullable=False)
+    period_month = db.Column(db.Integer)
+    year = db.Column(db.String(10))
+    fiscal_year = db.Column(db.Integer)
+    operating_unit = db.Column(db.String(100))
+    vendor_name = db.Column(db.String(255))
+    item_category = db.Column(db.String(100))
+    item_description = db.Column(db.String(500))
+    enriched_description = db.Column(db.String(500))
+    payment_term = db.Column(db.String(100))
+    po_status = db.Column(db.String(50))
+    amount = db.Column(db.Float, default=0.0)
+    quantity = db.Column(db.Float, default=0.0)
+    line_count = db.Column(db.Integer, default=0)
+    # HyperLogLog sketches of the group's PO numbers / buyers (spend_sketch.py)
+    po_sketch = db.Column(db.LargeBinary)
+    buyer_sketch = db.Column(db.LargeBinary)
+
+class MaterialRisk(db.Model):
+    __tablename__ = 'material_risk'
+    __table_args__ = (
+        db.UniqueConstraint('scope_operating_unit', 'scope_year', 'material', 'item_code', name='uq_material_risk_scope_material'),
+        # Paginated risk-analysis reads: scope, then severity / spend order
+        db.Index('ix_material_risk_scope_rank', 'scope_operating_unit', 'scope_year', 'severity_rank', 'total_spend'),
+        db.Index('ix_material_risk_material', 'material'),
+    )
+    
+    # Persisted risk-analysis rows per dashboard scope (see risk_table.py); 'All' = unfiltered
+    id = db.Column(db.Integer, primary_key=True)
+    scope_operating_unit = db.Column(db.String(100), nullable=False, default='All')
+    scope_year = db.Column(db.String(10), nullable=False, default='All')
+    material = db.Column(db.String(255), nullable=False)
+    item_code = db.Column(db.String(100), nullable=False)
+    total_spend = db.Column(db.Float, default=0.0)
+    supplier_count = db.Column(db.Integer, default=0)
+    country_spend = db.Column(db.Text)  # JSON [[country, spend], ...] in first-seen order
+    dominant_site = db.Column(db.String(255))
+    risks = db.Column(db.Text)  # JSON list of {type, severity, description}
+    risk_types = db.Column(db.String(255))  # '|Single Source|Geo Political|' for type filters
+    max_severity = db.Column(db.String(10), nullable=False)
+    severity_rank = db.Column(db.Integer, nullable=False)  # 2 High, 1 Medium, 0 Low
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        country_spend = json.loads(self.country_spend) if self.country_spend else []
+        return {
+            'material': self.material,
+            'item_code': self.item_code,
+            'total_spend': self.total_spend,
+            'supplier_count': self.supplier_count,
+            'risks': json.loads(self.risks) if self.risks else [],
+            'max_severity': self.max_severity,
+            'dominant_site': self.dominant_site,
+            'country_shares': {
+                country: (spend / self.total_spend if self.total_spend else 0.0)
+                for country, spend in country_spend
+            }
+        }
+
+class SiteLocation(db.Model):
+    __tablename__ = 'site_location'
+    __table_args__ = (
+        db.Index('ix_site_location_country', 'country'),
+    )
+    
+    # Geocoded supplier_site values (see site_geocoding.py); method 'none' = not resolved
+    site = db.Column(db.String(255), primary_key=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    place = db.Column(db.String(255))
+    country = db.Column(db.String(100), nullable=False, default='Unknown')
+    confidence = db.Column(db.Float, nullable=False, default=0.0)
+    method = db.Column(db.String(20), nullable=False, default='none')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'site': self.site,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'place': self.place,
+            'country': self.country,
+            'confidence': self.confidence,
+            'method': self.method,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    
+    # Monotonic counters bumped whenever a data domain changes ('spend', 'risk_config', ...);
+    # in-process caches compare against them to detect changes made by other workers/scripts
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class EnrichmentJob(db.Model):
+    __tablename__ = 'enrichment_job'
+    
+    # Spend enrichment runs (see enrichment_jobs.py); the process holding the lease runs the job
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running | paused | cancelled | done | failed
+    # 1 while running or paused, NULL afterwards: the unique index admits one active job across processes
+    active = db.Column(db.Integer, unique=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    current = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    options = db.Column(db.Text)  # JSON {workers, rate}
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    # Set when a job is taken over after its runner died: its earlier writes were never synced
+    full_sync = db.Column(db.Boolean, nullable=False, default=False)
+    priority = db.Column(db.String(20), nullable=False, default='spend')  # work item order (PRIORITY_SCORES)
+    # Spend coverage: all spend, spend already enriched at creation, spend of the job's items,
+    # of its finished items and of its enriched items
+    spend_total = db.Column(db.Float, nullable=False, default=0.0)
+    spend_enriched_at_start = db.Column(db.Float, nullable=False, default=0.0)
+    job_spend = db.Column(db.Float, nullable=False, default=0.0)
+    done_spend = db.Column(db.Float, nullable=False, default=0.0)
+    enriched_spend = db.Column(db.Float, nullable=False, default=0.0)
+    llm_items = db.Column(db.Integer, nullable=False, default=0)  # cluster representatives sent to the LLM
+    # JSON written by the runner with each batch: throughput, LLM latency per provider, recent results
+    live_stats = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'current': self.current,
+            'processed': self.processed,
+            'errors': self.errors,
+            'options': json.loads(self.options) if self.options else {},
+            'lease_owner': self.lease_owner,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_run': self.finished_at.isoformat() if self.finished_at else None,
+            'priority': self.priority,
+            'llm_items': self.llm_items,
+            'coverage': self.coverage(),
+            'live': self.live()
+        }
+    
+    def live(self):
+        """Runner statistics of the current (or last) run, with the ETA at its throughput"""
+        live = json.loads(self.live_stats) if self.live_stats else {}
+        throughput = live.get('throughput') or 0.0
+        remaining = (self.total or 0) - (self.current or 0)
+        live['eta_seconds'] = round(remaining / throughput) if self.status == 'running' and throughput > 0 else None
+        return live
+    
+    def coverage(self):
+        """Percentages of spend enriched (overall, at job start) and of the job done (spend, items)"""
+        def pct(part, whole):
+            return round(100.0 * part / whole, 2) if whole else 0.0
+        spend_total = self.spend_total or 0.0
+        at_start = self.spend_enriched_at_start or 0.0
+        return {
+            'spend_enriched_pct': pct(at_start + (self.enriched_spend or 0.0), spend_total),
+            'spend_enriched_at_start_pct': pct(at_start, spend_total),
+            'job_spend_done_pct': pct(self.done_spend or 0.0, self.job_spend or 0.0),
+            'items_done_pct': pct(self.current or 0, self.total or 0)
+        }
+
+class EnrichmentWorkItem(db.Model):
+    __tablename__ = 'enrichment_work_item'
+    __table_args__ = (
+        db.Index('ix_enrichment_work_item_job_status', 'job_id', 'status'),
+    )
+    
+    # One distinct raw description of an enrichment job; status 'pending' until its outcome is written
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('enrichment_job.id'), nullable=False)
+    raw_description = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending | enriched | incomplete | not_found
+    priority = db.Column(db.Float, nullable=False, default=0.0)  # higher first
+    spend = db.Column(db.Float, nullable=False, default=0.0)  # spend of the description's lines at job creation
+    # Near-duplicate of another item (description_clusters.py): takes over its representative's outcome
+    cluster_of = db.Column(db.String(500))
+    match_type = db.Column(db.String(20), nullable=False, default='llm')  # llm | normalized | fuzzy
+    similarity = db.Column(db.Float)  # 0-100 for members, NULL for representatives
+    enriched_description = db.Column(db.String(500))
+    cas_number = db.Column(db.String(100))
+    inci_name = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
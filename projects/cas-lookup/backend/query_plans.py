@@ -0,0 +1,128 @@
+"""
+Query Plan Diagnostics
+======================
+Runs EXPLAIN QUERY PLAN over the hot queries of the spend and material
+endpoints and flags any that fall back to a full table scan.
+
+Usage:
+    python query_plans.py            # print a report
+    GET /api/diagnostics/query-plans # same data as JSON
+"""
+
+from sqlalchemy import text
+from spend_enrichment import (ENRICHMENT_STAGE_DDL, STAGED_SPEND_UPDATE, STAGED_MATERIAL_UPDATE,
+                              STAGED_OLD_DESCRIPTIONS)
+
+# (name, SQL, params, full_scan_expected)
+HOT_QUERIES = [
+    ("spend: filter by operating unit + year",
+     "SELECT SUM(amount) FROM spend_record WHERE operating_unit = :ou AND year = :year",
+     {"ou": "X", "year": "2024"}, False),
+    ("spend: filter by year",
+     "SELECT SUM(amount) FROM spend_record WHERE year = :year",
+     {"year": "2024"}, False),
+    ("spend: filter by vendor",
+     "SELECT SUM(amount) FROM spend_record WHERE vendor_name = :v",
+     {"v": "X"}, False),
+    ("spend: filter by enriched description",
+     "SELECT SUM(amount) FROM spend_record WHERE enriched_description = :d",
+     {"d": "X"}, False),
+    ("spend: PO lookup",
+     "SELECT * FROM spend_record WHERE po_number = :po",
+     {"po": "X"}, False),
+    ("spend: CAS lookup",
+     "SELECT id FROM spend_record WHERE cas_number = :cas",
+     {"cas": "X"}, False),
+    ("enrichment: staged update of spend lines",
+     STAGED_SPEND_UPDATE, {}, False),
+    ("enrichment: staged update of materials",
+     STAGED_MATERIAL_UPDATE, {}, False),
+    ("enrichment: enriched descriptions replaced by a staged batch",
+     STAGED_OLD_DESCRIPTIONS, {}, False),
+    ("material: filter by sub-category",
+     "SELECT * FROM material_data WHERE sub_category = :s",
+     {"s": "X"}, False),
+    ("material: CAS lookup",
+     "SELECT id FROM material_data WHERE cas_number = :cas",
+     {"cas": "X"}, False),
+    ("material: parameters of a material",
+     "SELECT name, value FROM material_parameter WHERE material_id = :m",
+     {"m": 1}, False),
+    ("table: spend lines with linked material",
+     """SELECT s.id, m.enriched_description FROM spend_record s
+        LEFT JOIN spend_material_link l ON l.spend_id = s.id
+        LEFT JOIN material_data m ON m.id = l.material_id
+        WHERE s.operating_unit = :ou AND s.year = :year""",
+     {"ou": "X", "year": "2024"}, False),
+    ("table: keyset page by amount",
+     """SELECT id FROM spend_record WHERE (amount, id) < (:v, :id)
+        ORDER BY amount DESC, id DESC LIMIT 51""",
+     {"v": 1.0, "id": 1}, False),
+    ("table: keyset page by PO date",
+     """SELECT id FROM spend_record WHERE (po_date_d, id) > (:v, :id)
+        ORDER BY po_date_d, id LIMIT 51""",
+     {"v": "2024-01-01", "id": 1}, False),
+    ("search: spend full-text prefix match",
+     "SELECT rowid, bm25(spend_fts) FROM spend_fts WHERE spend_fts MATCH :q",
+     {"q": '"acet"*'}, False),
+    ("risk: material_risk page for a scope",
+     """SELECT * FROM material_risk WHERE scope_operating_unit = :ou AND scope_year = :year
+        ORDER BY severity_rank DESC, total_spend DESC, id LIMIT 100""",
+     {"ou": "All", "year": "All"}, False),
+    ("risk: material_risk rows of a material",
+     "DELETE FROM material_risk WHERE material IN (:m)",
+     {"m": "X"}, False),
+    ("rollup: groups of a material (refresh after enrichment)",
+     "DELETE FROM spend_rollup WHERE rollup = :r AND enriched_description IN (:m)",
+     {"r": "month_ou_vendor_item", "m": "X"}, False),
+    ("rollup: spend lines of a material (refresh after enrichment)",
+     "SELECT period_month, vendor_name, TOTAL(amount) FROM spend_record WHERE enriched_description IN (:m) GROUP BY period_month, vendor_name",
+     {"m": "X"}, False),
+    ("cube: full spend load",
+     "SELECT operating_unit, year, vendor_name, amount FROM spend_record",
+     {}, True),
+]
+
+
+def _is_full_scan(detail):
+    """'SCAN <table>' without an index is a full table scan ('SCAN ... USING INDEX' is not)"""
+    detail = detail.upper()
+    return (detail.startswith('SCAN ') and 'USING' not in detail and 'SUBQUERY' not in detail
+            and 'VIRTUAL TABLE' not in detail)
+
+
+def explain_hot_queries(session):
+    """EXPLAIN QUERY PLAN each hot query; returns one report dict per query"""
+    report = []
+    # The staged enrichment statements read the connection's temporary stage table
+    session.execute(text(ENRICHMENT_STAGE_DDL))
+    for name, sql, params, scan_expected in HOT_QUERIES:
+        try:
+            rows = session.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+            plan = [r[-1] for r in rows]
+            scans = [d for d in plan if _is_full_scan(d)]
+            report.append({
+                "name": name,
+                "plan": plan,
+                "full_scans": scans,
+                "full_scan_expected": scan_expected,
+                "flagged": bool(scans) and not scan_expected
+            })
+        except Exception as e:
+            report.append({"name": name, "error": str(e), "flagged": True})
+    return report
+
+
+if __name__ == '__main__':
+    from app import app, db
+    with app.app_context():
+        report = explain_hot_queries(db.session)
+        for entry in report:
+            status = "⚠️  FULL SCAN" if entry["flagged"] else "✅"
+            print(f"{status}  {entry['name']}")
+            for line in entry.get("plan", []):
+                print(f"      {line}")
+            if "error" in entry:
+                print(f"      error: {entry['error']}")
+        flagged = sum(1 for e in report if e["flagged"])
+        print(f"\n{flagged} of {len(report)} hot queries flagged")
@@ -0,0 +1,145 @@
+"""
+Spend Analytics Result Cache
+============================
+Memory-bounded LRU cache of serialized JSON responses, keyed by
+(endpoint, normalized filter tuple, data versions).
+
+Entries become unreachable as soon as a data version they were built from is
+bumped (see data_version.py), so invalidation is implicit and also works
+across gunicorn workers. In-process writers additionally clear the cache to
+free memory and may pre-warm the most requested filter combinations.
+"""
+
+import os
+import threading
+from collections import OrderedDict, Counter
+from functools import wraps
+from flask import request, current_app, Response
+from data_version import get_data_versions, SPEND
+
+DEFAULT_MAX_BYTES = int(os.environ.get('SPEND_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('SPEND_CACHE_MAX_ENTRIES', 2048))
+PREWARM_TOP_N = int(os.environ.get('SPEND_CACHE_PREWARM_TOP_N', 20))
+# Distinct filter combinations counted for pre-warming; the least requested half is dropped beyond it
+DEFAULT_MAX_POPULAR = int(os.environ.get('SPEND_CACHE_MAX_POPULAR', 1024))
+# Pre-warm requests carry this header so they do not count as popularity
+PREWARM_HEADER = 'X-Spend-Cache-Prewarm'
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES, max_popular=DEFAULT_MAX_POPULAR):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_popular = max_popular
+        self._entries = OrderedDict()   # key -> bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (path, query items) -> request count, used to pick pre-warm candidates
+        self.popular = Counter()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def count_request(self, key):
+        with self._lock:
+            self.popular[key] += 1
+            if len(self.popular) > self.max_popular:
+                self.popular = Counter(dict(self.popular.most_common(self.max_popular // 2)))
+
+    def most_popular(self, n):
+        with self._lock:
+            return [key for key, _ in self.popular.most_common(n)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions
+            }
+
+
+spend_result_cache = ResultCache()
+
+
+def normalized_filters(args, names):
+    """Sorted (name, value) tuple of the filters an endpoint reads; 'All' and empty are dropped"""
+    return tuple(sorted((n, args.get(n)) for n in names if args.get(n) and args.get(n) != 'All'))
+
+
+def cached_endpoint(name, filter_names=(), versions=(SPEND,), cache=spend_result_cache, unpopular=()):
+    """
+    Cache a JSON GET endpoint's 200 responses per normalized filter tuple and
+    data version. Filters in `unpopular` (e.g. a map viewport) are part of the
+    cache key but not of the popularity key used for pre-warming.
+    """
+    popular_names = [n for n in filter_names if n not in unpopular]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            filters = normalized_filters(request.args, filter_names)
+            key = (name, filters, get_data_versions(versions))
+            if not request.headers.get(PREWARM_HEADER):
+                cache.count_request((request.path, normalized_filters(request.args, popular_names)))
+            body = cache.get(key)
+            if body is not None:
+                return Response(body, mimetype='application/json')
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and response.mimetype == 'application/json':
+                cache.put(key, response.get_data())
+            return response
+        return wrapper
+    return decorator
+
+
+def prewarm_spend_cache(app, top_n=PREWARM_TOP_N, cache=spend_result_cache):
+    """Re-request the most popular filter combinations in a background thread"""
+    candidates = cache.most_popular(top_n)
+    if not candidates:
+        return
+
+    def _run():
+        with app.test_client() as client:
+            for path, filters in candidates:
+                try:
+                    client.get(path, query_string=dict(filters), headers={PREWARM_HEADER: '1'})
+                except Exception as e:
+                    print(f"⚠️ Cache pre-warm failed for {path} {filters}: {e}")
+
+    threading.Thread(target=_run, daemon=True).start()
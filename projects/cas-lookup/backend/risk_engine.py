@@ -0,0 +1,229 @@
+"""
+Supplier Risk Engine
+====================
+Computes the material risk report of /api/spend-analysis/risk-analysis from
+the in-memory spend cube instead of loading every SpendRecord as an ORM
+object and looping in Python.
+
+    1. Dictionary-encoded cube columns are filtered with one boolean mask.
+    2. Per-label work (placeholder materials, "N/A" item codes, site -> country
+       via the site_location table) runs once per distinct label, never once per row.
+    3. Spend per material, per (material, country) and per (material, site)
+       is summed with np.bincount in row order, so totals match the
+       row-by-row accumulation of the original implementation bit for bit.
+    4. Risk rules are boolean predicates over the aggregated arrays; only
+       materials that end up with risks are turned into JSON dicts.
+
+Ordering follows the original implementation: materials and countries
+appear in order of their first spend line (lowest id).
+"""
+
+import json
+import numpy as np
+from models import UserPreference
+from site_geocoding import site_locations, geocode_site
+
+RISK_CONFIG_DEFAULTS = {
+    'sensitive_countries': ['Russia', 'Iran', 'Ukraine', 'Israel', 'China', 'Indonesia'],
+    'high_risk_countries': ['Russia', 'Iran', 'Ukraine', 'Israel'],
+    'concentration_threshold': 75,
+    'natural_disaster_countries': [],
+}
+
+# enriched_description values that are not real materials
+PLACEHOLDER_MATERIALS = {'other', 'unknown', 'nan', 'none'}
+
+RISK_RESULT_LIMIT = 100
+
+
+def load_risk_config():
+    """Risk configuration from UserPreference (one query), falling back to the defaults"""
+    config = {k: (list(v) if isinstance(v, list) else v) for k, v in RISK_CONFIG_DEFAULTS.items()}
+    prefs = UserPreference.query.filter(UserPreference.key.in_(list(RISK_CONFIG_DEFAULTS))).all()
+    for pref in prefs:
+        config[pref.key] = int(pref.value) if pref.key == 'concentration_threshold' else json.loads(pref.value)
+    return config
+
+
+def _per_label(cube, dim, fn):
+    """fn applied once per distinct label; indexed by cube code + 1 (slot 0 = NULL)"""
+    return [fn(None)] + [fn(v) for v in cube.labels[dim]]
+
+
+def _encode(values):
+    """Factorize a short list of hashable values -> (codes array, uniques list)"""
+    index = {}
+    codes = np.array([index.setdefault(v, len(index)) for v in values], dtype=np.int64)
+    return codes, list(index)
+
+
+def _distinct(keys):
+    """Sorted distinct int64 keys (a plain sort is much faster than np.unique's hash path here)"""
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+
+def _group(keys, weights):
+    """Group rows by int64 key: (unique keys, first row of each group, per-group weight sums)"""
+    uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return uniq, first, np.bincount(inverse, weights=weights, minlength=len(uniq))
+
+
+def site_countries():
+    """{supplier_site: country} from the persisted site_location table"""
+    return {site: loc['country'] for site, loc in site_locations().items()}
+
+
+def compute_material_risks(cube, mask, config, limit=RISK_RESULT_LIMIT, detail=False, countries=None):
+    """
+    Risk report for the rows in mask: the first `limit` (all if None)
+    (material, item_code) pairs with at least one risk, sorted High first,
+    then Medium, then by spend (ties by first appearance), plus severity
+    counts over every risky material. detail=True adds each material's
+    spend per country ("country_spend": [[country, spend], ...]).
+    countries maps supplier_site -> country (default: site_location).
+    """
+    if countries is None:
+        countries = site_countries()
+
+    def country_of(site):
+        if not site:
+            return "Unknown"
+        return countries[site] if site in countries else geocode_site(site)['country']
+
+    # ---- per-label lookups (once per distinct value) ----
+    valid_material = np.array(_per_label(
+        cube, 'enriched_description', lambda v: bool(v) and str(v).lower() not in PLACEHOLDER_MATERIALS
+    ))
+    item_codes, item_labels = _encode(_per_label(cube, 'item_code', lambda v: v or "N/A"))
+    site_codes, site_labels = _encode(_per_label(cube, 'supplier_site', lambda v: v or "Unknown"))
+    country_codes, country_labels = _encode(_per_label(cube, 'supplier_site', country_of))
+
+    # ---- row selection ----
+    rows = np.flatnonzero(mask) if mask is not None else np.arange(cube.row_count)
+    material = cube.codes['enriched_description'][rows].astype(np.int64) + 1
+    rows = rows[valid_material[material]]
+    if len(rows) == 0:
+        return {"material_risks": [], "summary": {"high_risk_count": 0, "medium_risk_count": 0,
+                                                  "low_risk_count": 0, "total_risky_materials": 0}}
+    material = cube.codes['enriched_description'][rows].astype(np.int64) + 1
+    item = item_codes[cube.codes['item_code'][rows] + 1]
+    site_raw = cube.codes['supplier_site'][rows] + 1
+    site = site_codes[site_raw]
+    country = country_codes[site_raw]
+    supplier = cube.codes['supplier_number'][rows].astype(np.int64) + 1
+    amount = cube.measures['amount'][rows]
+
+    # ---- (material, item_code) groups, in order of first appearance ----
+    mat_keys, mat_first, mat_inverse = np.unique(material * len(item_labels) + item, return_index=True, return_inverse=True)
+    n_mat = len(mat_keys)
+    total = np.bincount(mat_inverse, weights=amount, minlength=n_mat)
+
+    n_sup = len(cube.labels['supplier_number']) + 1
+    pairs = _distinct(mat_inverse * n_sup + supplier)
+    supplier_count = np.bincount(pairs // n_sup, minlength=n_mat)
+
+    n_country = len(country_labels)
+    c_keys, c_first, c_spend = _group(mat_inverse * n_country + country, amount)
+    c_mat, c_country = c_keys // n_country, c_keys % n_country
+    # countries of each material in first-appearance order
+    c_order = np.lexsort((c_first, c_mat))
+    c_mat, c_country, c_spend = c_mat[c_order], c_country[c_order], c_spend[c_order]
+
+    n_site = len(site_labels)
+    s_keys, s_first, s_spend = _group(mat_inverse * n_site + site, amount)
+    s_mat, s_site = s_keys // n_site, s_keys % n_site
+
+    # ---- per-country predicates (once per distinct country) ----
+    sensitive, high_risk, disaster_list = config['sensitive_countries'], config['high_risk_countries'], config['natural_disaster_countries']
+    known = np.array([c != "Unknown" for c in country_labels])
+    is_sensitive = known & np.array([any(sc in c for sc in sensitive) for c in country_labels], dtype=bool)
+    is_high = np.array([any(hc in c for hc in high_risk) for c in country_labels], dtype=bool)
+    is_disaster = known & np.array([any(dc.lower() in c.lower() for dc in disaster_list) for c in country_labels], dtype=bool)
+
+    # ---- vectorized rules ----
+    def any_per_material(flags):
+        return np.bincount(c_mat[flags], minlength=n_mat) > 0
+
+    single_source = supplier_count == 1
+    geo = any_per_material(is_sensitive[c_country])
+    geo_high = any_per_material(is_sensitive[c_country] & is_high[c_country])
+    share = np.divide(c_spend * 100, total[c_mat], out=np.zeros_like(c_spend), where=total[c_mat] > 0)
+    concentrated = is_sensitive[c_country] & (total[c_mat] > 0) & (share > config['concentration_threshold'])
+    concentration = (supplier_count > 1) & any_per_material(concentrated)
+    disaster = any_per_material(is_disaster[c_country])
+
+    has_risk = single_source | geo | concentration | disaster
+    high = single_source | geo_high | disaster
+    medium = ~high & (geo | concentration)
+
+    # ---- report rows: summary over all risky materials, dicts only for the returned ones ----
+    risky = np.flatnonzero(has_risk)
+    summary = {
+        "high_risk_count": int(high[risky].sum()),
+        "medium_risk_count": int(medium[risky].sum()),
+        "low_risk_count": int((~high[risky] & ~medium[risky]).sum()),
+        "total_risky_materials": len(risky)
+    }
+    order = risky[np.lexsort((mat_first[risky], -total[risky], ~medium[risky], ~high[risky]))]
+    if limit is not None:
+        order = order[:limit]
+    selected = np.zeros(n_mat, dtype=bool)
+    selected[order] = True
+
+    # Country lists per material in first-appearance order
+    country_rows = {}
+    for i in np.flatnonzero(selected[c_mat]).tolist():
+        country_rows.setdefault(int(c_mat[i]), []).append(i)
+    # First concentrated sensitive country per material
+    first_concentrated = {}
+    keep = selected[c_mat] & concentrated
+    for m, c in zip(c_mat[keep].tolist(), c_country[keep].tolist()):
+        first_concentrated.setdefault(m, c)
+    # Dominant site: highest spend, ties by first appearance, 'Unknown' excluded
+    named = s_site != site_labels.index("Unknown") if "Unknown" in site_labels else True
+    keep = np.flatnonzero(selected[s_mat] & named)
+    keep = keep[np.lexsort((s_first[keep], -s_spend[keep], s_mat[keep]))]
+    best_mat, best = np.unique(s_mat[keep], return_index=True)
+    dominant = dict(zip(best_mat.tolist(), (site_labels[s] for s in s_site[keep[best]].tolist())))
+
+    threshold = config['concentration_threshold']
+    material_labels = cube.labels['enriched_description']
+    results = []
+    for m in order.tolist():
+        countries = [int(c_country[i]) for i in country_rows.get(m, [])]
+        risks = []
+        if single_source[m]:
+            risks.append({"type": "Single Source", "severity": "High",
+                          "description": "Only one vendor globally for this material."})
+        if geo[m]:
+            names = [country_labels[c] for c in countries if is_sensitive[c]]
+            risks.append({"type": "Geo Political", "severity": "High" if geo_high[m] else "Medium",
+                          "description": f"Sourcing from sensitive regions: {', '.join(names)}"})
+        if single_source[m] and geo[m]:
+            names = [country_labels[c] for c in countries if known[c]]
+            risks.append({"type": "Country Risk", "severity": "Medium",
+                          "description": f"Single source from sensitive country: {', '.join(names)}"})
+        if concentration[m]:
+            risks.append({"type": "Country Risk", "severity": "Medium",
+                          "description": f"Over {threshold}% of spend from sensitive country: {country_labels[first_concentrated[m]]}"})
+        if disaster[m]:
+            names = [country_labels[c] for c in countries if is_disaster[c]]
+            risks.append({"type": "Natural Disaster", "severity": "High",
+                          "description": f"Sourcing from disaster-affected regions: {', '.join(names)}"})
+
+        key = int(mat_keys[m])
+        row = {
+            "material": material_labels[key // len(item_labels) - 1],
+            "item_code": item_labels[key % len(item_labels)],
+            "total_spend": float(total[m]),
+            "supplier_count": int(supplier_count[m]),
+            "risks": risks,
+            "max_severity": "High" if high[m] else ("Medium" if medium[m] else "Low"),
+            "dominant_site": dominant.get(m, "Unknown")
+        }
+        if detail:
+            row["country_spend"] = [[country_labels[c_country[i]], float(c_spend[i])] for i in country_rows.get(m, [])]
+        results.append(row)
+    return {"material_risks": results, "summary": summary}
+
@@ -0,0 +1,222 @@
+"""
+Persisted Material Risk
+=======================
+material_risk holds the risk_engine.py report for every scope the risk
+dashboard can request ('All', each operating unit, each year and each
+operating unit / year pair), so /api/spend-analysis/risk-analysis is an
+indexed, paginated read.
+
+    * spend ingest / enrichment with known materials -> only those materials are recomputed
+    * risk-config change, or spend changes of unknown extent -> full rebuild in a background thread
+
+Two data_version rows record the spend and risk-config versions the table
+reflects. While they lag behind the live versions, readers compute the
+report from the spend cube instead of serving stale rows.
+"""
+
+import json
+import threading
+import time
+from sqlalchemy import delete, insert, func
+from models import db, MaterialRisk
+from spend_cube import get_spend_cube
+from risk_engine import compute_material_risks, load_risk_config
+from data_version import get_data_version, get_data_versions, set_data_version, SPEND, RISK_CONFIG
+
+ALL = 'All'
+
+# data_version rows: source versions the table was built from
+TABLE_SPEND = 'material_risk.spend'
+TABLE_RISK_CONFIG = 'material_risk.risk_config'
+
+SEVERITY_RANK = {"High": 2, "Medium": 1, "Low": 0}
+
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 500
+
+_rebuild_lock = threading.Lock()
+
+
+# ==========================================
+# BUILDING
+# ==========================================
+
+def risk_scopes(cube):
+    """(operating_unit, year) scopes present in the data, 'All' standing for no filter"""
+    pairs = cube.group_by(['operating_unit', 'year'], measures=())
+    pairs = [(ou, y) for ou, y in zip(pairs['operating_unit'], pairs['year']) if ou and y]
+    scopes = [(ALL, ALL)]
+    scopes += [(ou, ALL) for ou in sorted({ou for ou, _ in pairs})]
+    scopes += [(ALL, y) for y in sorted({y for _, y in pairs})]
+    scopes += sorted(pairs)
+    return scopes
+
+
+def _scope_rows(cube, config, materials=None):
+    """material_risk rows for every scope, optionally restricted to some materials"""
+    rows = []
+    for ou, year in risk_scopes(cube):
+        filters = {k: v for k, v in (('operating_unit', ou), ('year', year)) if v != ALL}
+        if materials is not None:
+            filters['enriched_description'] = list(materials)
+        mask = cube.mask(filters)
+        if not mask.any():
+            continue
+        report = compute_material_risks(cube, mask, config, limit=None, detail=True)
+        for r in report["material_risks"]:
+            rows.append({
+                "scope_operating_unit": ou,
+                "scope_year": year,
+                "material": r["material"],
+                "item_code": r["item_code"],
+                "total_spend": r["total_spend"],
+                "supplier_count": r["supplier_count"],
+                "country_spend": json.dumps(r["country_spend"]),
+                "dominant_site": r["dominant_site"],
+                "risks": json.dumps(r["risks"]),
+                "risk_types": '|' + '|'.join(sorted({x["type"] for x in r["risks"]})) + '|',
+                "max_severity": r["max_severity"],
+                "severity_rank": SEVERITY_RANK[r["max_severity"]],
+            })
+    return rows
+
+
+def _insert_rows(rows, batch_size=5000):
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(insert(MaterialRisk), rows[i:i + batch_size])
+
+
+def rebuild_material_risks():
+    """Recompute every scope and replace the table in one transaction (requires an app context)"""
+    started = time.time()
+    # Read the source versions first: changes during the build leave the table stale
+    spend_version, config_version = get_data_versions((SPEND, RISK_CONFIG))
+    rows = _scope_rows(get_spend_cube(), load_risk_config())
+    db.session.execute(delete(MaterialRisk))
+    _insert_rows(rows)
+    set_data_version(TABLE_SPEND, spend_version)
+    set_data_version(TABLE_RISK_CONFIG, config_version)
+    db.session.commit()
+    print(f"🛡️ material_risk rebuilt: {len(rows)} rows in {time.time() - started:.2f}s")
+    return len(rows)
+
+
+def refresh_material_risks(materials, spend_version):
+    """
+    Recompute only the given materials after the spend version was bumped to
+    spend_version. Returns False (and leaves the table stale for a full
+    rebuild) if the table was not current before this change.
+    """
+    built_spend, built_config = get_data_versions((TABLE_SPEND, TABLE_RISK_CONFIG), default=-1)
+    if built_spend != spend_version - 1 or built_config != get_data_version(RISK_CONFIG):
+        return False
+    materials = sorted({m for m in materials if m})
+    if materials:
+        rows = _scope_rows(get_spend_cube(), load_risk_config(), materials)
+        for i in range(0, len(materials), 500):
+            db.session.execute(delete(MaterialRisk).where(MaterialRisk.material.in_(materials[i:i + 500])))
+        _insert_rows(rows)
+    set_data_version(TABLE_SPEND, spend_version)
+    db.session.commit()
+    if materials:
+        print(f"🛡️ material_risk refreshed for {len(materials)} materials")
+    return True
+
+
+def risk_table_current():
+    """True if material_risk was built from the current spend and risk-config versions"""
+    return get_data_versions((TABLE_SPEND, TABLE_RISK_CONFIG), default=-1) == get_data_versions((SPEND, RISK_CONFIG))
+
+
+def schedule_material_risk_rebuild(app):
+    """Rebuild in a background thread unless one is already running in this process"""
+    if not _rebuild_lock.acquire(blocking=False):
+        return False
+
+    def _run():
+        try:
+            with app.app_context():
+                rebuild_material_risks()
+        except Exception as e:
+            print(f"⚠️ material_risk rebuild failed: {e}")
+        finally:
+            _rebuild_lock.release()
+
+    threading.Thread(target=_run, daemon=True).start()
+    return True
+
+
+# ==========================================
+# READING
+# ==========================================
+
+def _matches(row, severity, risk_type, search):
+    if severity and row["max_severity"] != severity:
+        return False
+    if risk_type and not any(r["type"] == risk_type for r in row["risks"]):
+        return False
+    if search and search.lower() not in f'{row["material"]} {row["item_code"]}'.lower():
+        return False
+    return True
+
+
+def read_material_risks(operating_unit=ALL, year=ALL, severity=None, risk_type=None, search=None,
+                        page=1, per_page=DEFAULT_PER_PAGE, app=None):
+    """
+    One page of the risk report for a scope. Served from material_risk when it
+    is current; otherwise computed from the cube (and a rebuild is scheduled).
+    The summary always covers the whole scope; filters narrow the rows.
+    """
+    offset = (page - 1) * per_page
+    if not risk_table_current():
+        if app is not None:
+            schedule_material_risk_rebuild(app)
+        cube = get_spend_cube()
+        filters = {k: v for k, v in (('operating_unit', operating_unit), ('year', year)) if v != ALL}
+        report = compute_material_risks(cube, cube.mask(filters), load_risk_config(), limit=None, detail=True)
+        rows = [r for r in report["material_risks"] if _matches(r, severity, risk_type, search)]
+        page_rows = rows[offset:offset + per_page]
+        for r in page_rows:
+            r["country_shares"] = {c: (spend / r["total_spend"] if r["total_spend"] else 0.0)
+                                   for c, spend in r.pop("country_spend")}
+        return {
+            "material_risks": page_rows,
+            "summary": report["summary"],
+            "total": len(rows),
+            "page": page,
+            "per_page": per_page,
+            "pages": (len(rows) + per_page - 1) // per_page,
+            "source": "live"
+        }
+
+    scope = MaterialRisk.query.filter(
+        MaterialRisk.scope_operating_unit == operating_unit,
+        MaterialRisk.scope_year == year
+    )
+    counts = dict(scope.with_entities(MaterialRisk.max_severity, func.count(MaterialRisk.id))
+                  .group_by(MaterialRisk.max_severity).all())
+    query = scope
+    if severity:
+        query = query.filter(MaterialRisk.max_severity == severity)
+    if risk_type:
+        query = query.filter(MaterialRisk.risk_types.contains(f'|{risk_type}|'))
+    if search:
+        query = query.filter(MaterialRisk.material.ilike(f'%{search}%') | MaterialRisk.item_code.ilike(f'%{search}%'))
+    total = query.count()
+    rows = query.order_by(
+        MaterialRisk.severity_rank.desc(), MaterialRisk.total_spend.desc(), MaterialRisk.id
+    ).offset(offset).limit(per_page).all()
+    return {
+        "material_risks": [r.to_dict() for r in rows],
+        "summary": {
+            "high_risk_count": counts.get("High", 0),
+            "medium_risk_count": counts.get("Medium", 0),
+            "low_risk_count": counts.get("Low", 0),
+            "total_risky_materials": sum(counts.values())
+        },
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": (total + per_page - 1) // per_page,
+        "source": "material_risk"
+    }
@@ -0,0 +1,225 @@
+"""
+Supplier Site Geocoding
+=======================
+Resolves free-text supplier_site codes ("SURAT-GIDC-UNIT2", "JAMNAG-HAR-194Q",
+"Gandhinagr-194Q") to a known place of geocoding_data.CITY_COORDS and persists
+the result per distinct site in site_location, so the map and risk endpoints
+look sites up instead of geocoding every row of every request.
+
+Matching, first hit wins:
+    1. exact      - the whole normalized site is a place name or alias
+    2. token      - a window of its tokens is a place name or alias ("porto alegre")
+    3. prefix     - a token of 5+ letters is a truncated place name ("jamnag") or
+                    starts with one ("mumbaisub")
+    4. trigram    - best character-trigram (Dice) similarity >= MIN_TRIGRAM_SCORE
+
+site_location is filled for new sites whenever spend is ingested (spend_sync)
+and rebuilt when GEOCODER_VERSION changes (new places, aliases or rules).
+"""
+
+import bisect
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from datetime import datetime
+from sqlalchemy import text
+from models import db
+from geocoding_data import CITY_COORDS, PLACE_ALIASES, SITE_NOISE_TOKENS
+from data_version import get_data_version, set_data_version, bump_data_version, SPEND
+
+# Bump when places, aliases or matching rules change: stored locations are recomputed
+GEOCODER_VERSION = 1
+GEOCODER_VERSION_KEY = 'site_location.geocoder'
+
+MIN_TRIGRAM_SCORE = 0.75
+MIN_PREFIX_LENGTH = 5
+MIN_PREFIX_COVERAGE = 0.75
+MAX_PREFIX_SUFFIX = 4
+METHOD_CONFIDENCE = {'exact': 1.0, 'token': 0.9, 'prefix': 0.75}
+
+# Map fallback when neither the site nor the operating unit resolves (centre of India)
+DEFAULT_COORDS = (20.5937, 78.9629)
+
+_WORD_RE = re.compile(r'[a-z]+')
+
+
+def site_tokens(site):
+    """Lower-case ASCII letter runs of a site code without noise tokens ("SURAT-C9-194Q" -> ['surat'])"""
+    ascii_site = unicodedata.normalize('NFKD', site or '').encode('ascii', 'ignore').decode().lower()
+    return [t for t in _WORD_RE.findall(ascii_site) if len(t) > 1 and t not in SITE_NOISE_TOKENS]
+
+
+def _trigrams(value):
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def place_country(name):
+    return name.split(',')[-1].strip() if ',' in name else name
+
+
+class PlaceIndex:
+    """Exact, prefix (sorted keys + bisect) and trigram lookups over place names and aliases"""
+
+    def __init__(self, places, aliases):
+        self.places = places
+        self.keys = {key: key for key in places}
+        self.keys.update({alias: key for alias, key in aliases.items() if key in places})
+        self.sorted_keys = sorted(self.keys)
+        self.trigram_index = defaultdict(set)
+        self.key_trigrams = {}
+        for key in self.keys:
+            grams = _trigrams(key)
+            self.key_trigrams[key] = grams
+            for gram in grams:
+                self.trigram_index[gram].add(key)
+
+    def _exact(self, phrase):
+        return self.keys.get(phrase) or self.keys.get(phrase.replace(' ', ''))
+
+    def _prefix(self, token):
+        """
+        Place whose first word starts with token and is at most a quarter longer
+        ("jamnag" -> jamnagar, not "santa" -> santana), or whose name starts the
+        token followed by a short suffix ("mumbaisub" -> mumbai, not
+        "indianapolis" -> india). Only unambiguous matches count.
+        """
+        candidates = set()
+        pos = bisect.bisect_left(self.sorted_keys, token)
+        while pos < len(self.sorted_keys) and self.sorted_keys[pos].startswith(token):
+            key = self.sorted_keys[pos]
+            if len(token) >= MIN_PREFIX_COVERAGE * len(key.split()[0]):
+                candidates.add(self.keys[key])
+            pos += 1
+        for size in range(max(MIN_PREFIX_LENGTH, len(token) - MAX_PREFIX_SUFFIX), len(token)):
+            key = self.keys.get(token[:size])
+            if key:
+                candidates.add(key)
+        names = {self.places[key]['name'] for key in candidates}
+        return min(candidates) if len(names) == 1 else None
+
+    def _trigram(self, phrase):
+        grams = _trigrams(phrase)
+        shared = defaultdict(int)
+        for gram in grams:
+            for key in self.trigram_index.get(gram, ()):
+                shared[key] += 1
+        best, best_score = None, 0.0
+        for key, count in shared.items():
+            score = 2.0 * count / (len(grams) + len(self.key_trigrams[key]))
+            if score > best_score or (score == best_score and best is not None and key < best):
+                best, best_score = key, score
+        return (self.keys[best] if best else None), best_score
+
+    def match(self, site):
+        """(place key, method, confidence) for a site string, or (None, 'none', 0.0)"""
+        tokens = site_tokens(site)
+        if not tokens:
+            return None, 'none', 0.0
+        # 1./2. exact phrase, longest token windows first
+        for size in range(len(tokens), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                key = self._exact(' '.join(tokens[start:start + size]))
+                if key:
+                    method = 'exact' if size == len(tokens) else 'token'
+                    return key, method, METHOD_CONFIDENCE[method]
+        # 3. truncated place names
+        for token in tokens:
+            if len(token) >= MIN_PREFIX_LENGTH:
+                key = self._prefix(token)
+                if key:
+                    return key, 'prefix', METHOD_CONFIDENCE['prefix']
+        # 4. misspellings
+        best, best_score = None, 0.0
+        for size in range(len(tokens), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                phrase = ' '.join(tokens[start:start + size])
+                if len(phrase) < 4:
+                    continue
+                key, score = self._trigram(phrase)
+                if score > best_score:
+                    best, best_score = key, score
+        if best and best_score >= MIN_TRIGRAM_SCORE:
+            return best, 'trigram', round(best_score * 0.8, 3)
+        return None, 'none', 0.0
+
+
+@lru_cache(maxsize=1)
+def place_index():
+    return PlaceIndex(CITY_COORDS, PLACE_ALIASES)
+
+
+@lru_cache(maxsize=8192)
+def geocode_site(site):
+    """site_location row values for one site string (not persisted)"""
+    key, method, confidence = place_index().match(site)
+    if key is None:
+        return {"site": site, "latitude": None, "longitude": None, "place": None,
+                "country": "Unknown", "confidence": 0.0, "method": method}
+    place = CITY_COORDS[key]
+    return {"site": site, "latitude": place['lat'], "longitude": place['lng'], "place": place['name'],
+            "country": place_country(place['name']), "confidence": confidence, "method": method}
+
+
+# ==========================================
+# PERSISTED SITE LOCATIONS
+# ==========================================
+
+def sync_site_locations(rebuild=False):
+    """Geocode supplier sites not yet in site_location (every site if rebuild); returns rows written"""
+    started = time.time()
+    try:
+        if rebuild:
+            db.session.execute(text("DELETE FROM site_location"))
+        pending = db.session.execute(text("""
+            SELECT DISTINCT s.supplier_site FROM spend_record s
+            WHERE s.supplier_site IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM site_location l WHERE l.site = s.supplier_site)
+        """)).fetchall()
+        now = datetime.utcnow()
+        rows = [dict(geocode_site(site), updated_at=now) for (site,) in pending]
+        if rows:
+            db.session.execute(text("""
+                INSERT INTO site_location (site, latitude, longitude, place, country, confidence, method, updated_at)
+                VALUES (:site, :latitude, :longitude, :place, :country, :confidence, :method, :updated_at)
+            """), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if rows:
+        resolved = sum(1 for r in rows if r["method"] != 'none')
+        print(f"📍 Geocoded {len(rows)} supplier sites ({resolved} resolved) in {time.time() - started:.2f}s")
+    return len(rows)
+
+
+def ensure_site_locations():
+    """Startup: geocode new sites, or re-geocode all of them after a geocoder change"""
+    if get_data_version(GEOCODER_VERSION_KEY) != GEOCODER_VERSION:
+        sync_site_locations(rebuild=True)
+        set_data_version(GEOCODER_VERSION_KEY, GEOCODER_VERSION)
+        db.session.commit()
+        # Countries feed the cube-derived risk data: invalidate it
+        bump_data_version(SPEND)
+    else:
+        sync_site_locations()
+
+
+def site_locations(sites=None):
+    """{site: location dict} from site_location (all sites, or the given ones); unknown sites are geocoded in memory"""
+    query = "SELECT site, latitude, longitude, place, country, confidence, method FROM site_location"
+    if sites is None:
+        rows = db.session.execute(text(query)).mappings().all()
+    else:
+        sites = [s for s in set(sites) if s]
+        rows = []
+        for i in range(0, len(sites), 500):
+            rows += db.session.execute(text(query + " WHERE site IN :sites").bindparams(
+                db.bindparam('sites', expanding=True)), {"sites": sites[i:i + 500]}).mappings().all()
+    locations = {r['site']: dict(r) for r in rows}
+    for site in (sites or ()):
+        if site not in locations:
+            locations[site] = geocode_site(site)
+    return locations
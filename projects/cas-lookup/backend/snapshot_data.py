@@ -0,0 +1,91 @@
+"""
+Snapshot Management Script
+==========================
+Parquet snapshots of spend_record, material_data and material_parameter
+(see spend_snapshot.py):
+
+    python snapshot_data.py export [--path DIR]
+    python snapshot_data.py list
+    python snapshot_data.py restore DIR [--tables spend_record ...]
+    python snapshot_data.py cube DIR [--fiscal-year 2024] [--operating-unit "OU India"]
+
+restore replaces the contents of the restored tables (enrichment included)
+with the snapshot's; cube builds the in-memory spend cube from the files
+alone and prints its top suppliers.
+"""
+
+import os
+import sys
+import time
+# Fix path if run directly
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from app import app
+from spend_snapshot import (snapshot_available, write_snapshot, list_snapshots, restore_snapshot, snapshot_cube,
+                            SNAPSHOT_TABLES, DERIVED_TABLES)
+
+
+def export_snapshot(path=None):
+    with app.app_context():
+        manifest = write_snapshot(path)
+        print(f"✅ Snapshot written to {manifest['path']}")
+
+
+def show_snapshots():
+    snapshots = list_snapshots()
+    if not snapshots:
+        print("⚠️  No snapshots found.")
+    for snapshot in snapshots:
+        rows = ', '.join(f"{info['rows']} {name}" for name, info in snapshot['tables'].items())
+        print(f"📸 {snapshot['name']} ({snapshot['created_at']}, {snapshot['bytes'] / 1024 / 1024:.1f} MB): {rows}")
+
+
+def restore(path, tables=None):
+    with app.app_context():
+        started = time.time()
+        counts = restore_snapshot(path, tables)
+        print(f"✅ Restored {sum(counts.values())} rows (derived data synced) in {time.time() - started:.1f}s")
+
+
+def load_cube(path, filters):
+    started = time.time()
+    cube = snapshot_cube(path, filters)
+    print(f"🧊 Spend cube from snapshot: {cube.row_count} rows in {time.time() - started:.2f}s, "
+          f"total spend ₹{cube.total():,.2f}")
+    for vendor, amount in cube.group_sum('vendor_name', top=10):
+        print(f"   {vendor}: ₹{amount:,.2f}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="Write a new snapshot")
+    export.add_argument('--path', help="Target directory (default: a new one under SNAPSHOT_DIR)")
+    commands.add_parser('list', help="List the snapshots under SNAPSHOT_DIR")
+    restore_cmd = commands.add_parser('restore', help="Replace table contents with a snapshot's")
+    restore_cmd.add_argument('path')
+    restore_cmd.add_argument('--tables', nargs='+', choices=[t for t in SNAPSHOT_TABLES if t not in DERIVED_TABLES])
+    cube = commands.add_parser('cube', help="Build the spend cube from a snapshot's files")
+    cube.add_argument('path')
+    cube.add_argument('--fiscal-year', type=int, nargs='+')
+    cube.add_argument('--operating-unit', nargs='+')
+    args = parser.parse_args()
+
+    if not snapshot_available():
+        print("❌ Snapshots require pyarrow")
+        sys.exit(1)
+    if args.command == 'export':
+        export_snapshot(args.path)
+    elif args.command == 'list':
+        show_snapshots()
+    elif args.command == 'restore':
+        restore(args.path, args.tables)
+    else:
+        filters = {'fiscal_year': args.fiscal_year, 'operating_unit': args.operating_unit}
+        load_cube(args.path, {k: v for k, v in filters.items() if v})
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Spend Dashboard Aggregation Engine
+==================================
+Evaluates the dashboard filter set once per source, as a boolean mask over the
+smallest pre-aggregated spend rollup that covers each widget (spend_rollup.py)
+or the in-memory spend cube, and computes every widget from those masks with
+vectorized bincounts instead of re-running the filtered query once per widget.
+"""
+
+from models import SpendRecord
+from spend_rollup import SpendQueryRouter
+from spend_sketch import HLL_STANDARD_ERROR
+from spend_periods import format_period
+
+# Request argument -> SpendRecord column used for equality filtering
+SPEND_FILTER_COLUMNS = {
+    'category': SpendRecord.item_category,
+    'supplier': SpendRecord.vendor_name,
+    'operating_unit': SpendRecord.operating_unit,
+    'enriched_description': SpendRecord.enriched_description,
+    'year': SpendRecord.year,
+    'fiscal_year': SpendRecord.fiscal_year,
+}
+
+# Filters whose request value must be converted before comparing
+SPEND_FILTER_TYPES = {
+    'fiscal_year': int,
+}
+
+# Request argument -> spend cube dimension
+SPEND_FILTER_DIMENSIONS = {
+    'category': 'item_category',
+    'supplier': 'vendor_name',
+    'operating_unit': 'operating_unit',
+    'enriched_description': 'enriched_description',
+    'year': 'year',
+    'fiscal_year': 'fiscal_year',
+}
+
+
+def read_spend_filters(args, names=None):
+    """Normalize request args into a {filter_name: value} dict, dropping 'All'/empty values"""
+    filters = {}
+    for name in (names or SPEND_FILTER_COLUMNS):
+        val = args.get(name)
+        if val and val != 'All':
+            try:
+                filters[name] = SPEND_FILTER_TYPES.get(name, str)(val)
+            except ValueError:
+                raise ValueError(f"Invalid value for '{name}': {val}")
+    return filters
+
+
+def apply_spend_filters(query, filters):
+    """Apply equality filters from read_spend_filters() to a SpendRecord query"""
+    for name, val in filters.items():
+        query = query.filter(SPEND_FILTER_COLUMNS[name] == val)
+    return query
+
+
+def cube_filters(filters):
+    """Translate read_spend_filters() output into spend cube dimension filters"""
+    return {SPEND_FILTER_DIMENSIONS[name]: val for name, val in filters.items()}
+
+
+def compute_dashboard(router):
+    """Compute every dashboard widget through a SpendQueryRouter (smallest covering rollup per widget)"""
+    total_spend = router.total(['kpis.spend', 'pareto_data'])
+    # No rollup grain keeps PO numbers or buyers: estimated from sketches, or counted on the raw lines
+    po_count = router.distinct_count(['kpis.po_count', 'kpis.pr_count'], 'po_number')
+
+    # Supplier totals are computed once and shared by the top-10 and Pareto widgets
+    supplier_totals = router.group_sum(['supplier_data', 'pareto_data'], 'vendor_name')
+
+    pareto_data = []
+    cum_spend_val = 0
+    for name, val in supplier_totals[:20]:
+        cum_spend_val += val
+        cum_pct = (cum_spend_val / total_spend) * 100 if total_spend > 0 else 0
+        pareto_data.append({
+            "name": str(name),
+            "spend": val,
+            "cumulativePercentage": round(float(cum_pct), 1)
+        })
+
+    # Trend aggregates on the typed period_month dimension (no per-row date parsing)
+    trend = sorted((k, v) for k, v in router.group_sum('trend_data', 'period_month') if k is not None)
+
+    return {
+        "kpis": {
+            "spend": total_spend,
+            "suppliers": router.distinct_count('kpis.suppliers', 'vendor_name'),
+            "buyers": router.distinct_count('kpis.buyers', 'buyer_name'),
+            "po_count": po_count,
+            # Mocks for PR counts (based on original logic)
+            "pr_count": int(po_count * 1.1)
+        },
+        "category_data": [{"name": str(k), "value": v} for k, v in router.group_sum('category_data', 'item_description', top=8)],
+        "trend_data": [{"name": format_period(k), "value": v} for k, v in trend],
+        "region_data": [{"name": str(k), "value": v} for k, v in router.group_sum('region_data', 'operating_unit')],
+        "supplier_data": [{"name": str(k), "value": v} for k, v in supplier_totals[:10]],
+        "pareto_data": pareto_data,
+        "payment_term_data": [
+            {"name": str(k) if k else "Other", "value": v} for k, v in router.group_sum('payment_term_data', 'payment_term', top=10)
+        ],
+        "po_status_data": [
+            {"name": str(k) if k else "Unknown", "value": v} for k, v in router.group_sum('po_status_data', 'po_status')
+        ]
+    }
+
+
+def build_spend_dashboard(filters, app=None, exact=False):
+    """
+    Filter once per source (one boolean mask per rollup or raw cube used), aggregate once.
+    served_by names the rollup (or raw spend_record cube) that answered each widget;
+    approximate lists the KPIs estimated from distinct-count sketches (standard
+    error HLL_STANDARD_ERROR) unless exact is set. app lets the router schedule
+    a background rollup rebuild when they are stale.
+    """
+    router = SpendQueryRouter(cube_filters(filters), app, exact=exact)
+    result = compute_dashboard(router)
+    result["served_by"] = router.served_by
+    result["approximate"] = {
+        "widgets": sorted(router.approximate),
+        "standard_error": HLL_STANDARD_ERROR if router.approximate else 0.0
+    }
+    return result
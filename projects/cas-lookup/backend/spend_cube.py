@@ -0,0 +1,256 @@
+"""
+In-Memory Spend Cube
+====================
+Columnar, read-only snapshot of SpendRecord held in NumPy arrays.
+
+Dimension columns are dictionary-encoded (int32 codes into a label array,
+-1 for NULL) and measures are float64, so filter + group-by + top-N queries
+are answered with vectorized boolean masks and np.bincount instead of SQL.
+
+The cube is built at startup and rebuilt after every ingest or enrichment
+via refresh_spend_cube(); blueprints read it through get_spend_cube(), which
+also rebuilds it when the 'spend' data version (data_version.py) moved on,
+e.g. because another worker or load_spend_data.py changed the data.
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+from models import db, SpendRecord, MaterialData, SpendMaterialLink
+from data_version import get_data_version, SPEND
+
+# Dictionary-encoded dimension columns
+CUBE_DIMENSIONS = {
+    'operating_unit': SpendRecord.operating_unit,
+    'year': SpendRecord.year,
+    'month': SpendRecord.month,
+    'vendor_name': SpendRecord.vendor_name,
+    'supplier_number': SpendRecord.supplier_number,
+    'supplier_site': SpendRecord.supplier_site,
+    'buyer_name': SpendRecord.buyer_name,
+    'payment_term': SpendRecord.payment_term,
+    'po_status': SpendRecord.po_status,
+    'po_number': SpendRecord.po_number,
+    'item_category': SpendRecord.item_category,
+    'item_code': SpendRecord.item_code,
+    'item_description': SpendRecord.item_description,
+    'enriched_description': SpendRecord.enriched_description,
+    # Typed periods (spend_periods.py); labels are ints
+    'period_month': SpendRecord.period_month,
+    'fiscal_year': SpendRecord.fiscal_year,
+    # Linked material (via spend_material_link); match_type is NULL for unlinked lines
+    'material_description': MaterialData.enriched_description.label('material_description'),
+    'match_type': SpendMaterialLink.match_type,
+}
+
+INTEGER_DIMENSIONS = {'period_month', 'fiscal_year'}
+
+# float64 measure columns
+CUBE_MEASURES = {
+    'amount': SpendRecord.amount,
+    'quantity': SpendRecord.quantity,
+}
+
+
+class SpendCube:
+    def __init__(self, codes, labels, measures, row_count):
+        self.codes = codes            # dim -> int32 array (row-aligned, -1 = NULL)
+        self.labels = labels          # dim -> object array of distinct values
+        self.measures = measures      # measure -> float64 array (row-aligned)
+        self.row_count = row_count
+        self.built_at = time.time()
+        self.data_version = None      # 'spend' data version the snapshot was built from
+        self._label_index = {}
+
+    @classmethod
+    def from_frame(cls, frame, dimensions=CUBE_DIMENSIONS, measure_names=CUBE_MEASURES):
+        """Cube over a frame's dimension and measure columns (by default those of SpendRecord)"""
+        codes, labels, measures = {}, {}, {}
+        for dim in dimensions:
+            values = frame[dim]
+            if dim in INTEGER_DIMENSIONS:
+                values = pd.array(pd.to_numeric(values, errors='coerce'), dtype='Int64')
+            dim_codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            codes[dim] = dim_codes.astype(np.int32)
+            labels[dim] = np.asarray(uniques.tolist(), dtype=object)
+        for name in measure_names:
+            measures[name] = pd.to_numeric(frame[name], errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+        return cls(codes, labels, measures, len(frame))
+
+    @classmethod
+    def load(cls):
+        """Read SpendRecord once (single SELECT) and build the cube"""
+        columns = list(CUBE_DIMENSIONS.values()) + list(CUBE_MEASURES.values())
+        result = db.session.execute(
+            db.select(*columns)
+            .outerjoin(SpendMaterialLink, SpendMaterialLink.spend_id == SpendRecord.id)
+            .outerjoin(MaterialData, MaterialData.id == SpendMaterialLink.material_id)
+            .order_by(SpendRecord.id)
+        )
+        frame = pd.DataFrame(result.fetchall(), columns=[c.key for c in columns])
+        return cls.from_frame(frame)
+
+    # ------------------------------------------------------------------
+    # Filtering
+    # ------------------------------------------------------------------
+    def code_for(self, dim, label):
+        """Code of a label in a dimension, or None if the label never occurs"""
+        index = self._label_index.get(dim)
+        if index is None:
+            index = {v: i for i, v in enumerate(self.labels[dim])}
+            self._label_index[dim] = index
+        return index.get(label)
+
+    def mask(self, filters=None):
+        """Boolean row mask for {dim: value | [values]} equality filters"""
+        result = np.ones(self.row_count, dtype=bool)
+        for dim, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            wanted = [c for c in (self.code_for(dim, v) for v in values) if c is not None]
+            if not wanted:
+                return np.zeros(self.row_count, dtype=bool)
+            col = self.codes[dim]
+            result &= (col == wanted[0]) if len(wanted) == 1 else np.isin(col, wanted)
+        return result
+
+    # ------------------------------------------------------------------
+    # Aggregation
+    # ------------------------------------------------------------------
+    def total(self, measure='amount', mask=None):
+        values = self.measures[measure]
+        return float(values[mask].sum() if mask is not None else values.sum())
+
+    def count(self, mask=None):
+        return int(mask.sum()) if mask is not None else self.row_count
+
+    def group_sum(self, dim, mask=None, measure='amount', top=None):
+        """[(label, total), ...] sorted by total desc; NULL keys form their own group (label None)"""
+        codes = self.codes[dim] if mask is None else self.codes[dim][mask]
+        if len(codes) == 0:
+            return []
+        weights = self.measures[measure] if mask is None else self.measures[measure][mask]
+        # Shift by one so NULL (-1) lands in bucket 0
+        totals = np.bincount(codes + 1, weights=weights, minlength=len(self.labels[dim]) + 1)
+        present = np.bincount(codes + 1, minlength=len(self.labels[dim]) + 1) > 0
+        buckets = np.flatnonzero(present)
+        buckets = buckets[np.argsort(-totals[buckets], kind='stable')]
+        if top:
+            buckets = buckets[:top]
+        labels = self.labels[dim]
+        return [(labels[b - 1] if b else None, float(totals[b])) for b in buckets]
+
+    def distinct_count(self, dim, mask=None):
+        """COUNT(DISTINCT dim) semantics: NULLs are not counted"""
+        codes = self.codes[dim] if mask is None else self.codes[dim][mask]
+        codes = codes[codes >= 0]
+        if len(codes) == 0:
+            return 0
+        return int(np.count_nonzero(np.bincount(codes, minlength=len(self.labels[dim]))))
+
+    def distinct_values(self, dim, mask=None):
+        """Non-NULL labels present in the (masked) rows"""
+        if mask is None:
+            return [v for v in self.labels[dim]]
+        codes = np.unique(self.codes[dim][mask])
+        return [self.labels[dim][c] for c in codes if c >= 0]
+
+    def group_by(self, dims, mask=None, measures=('amount',), top=None):
+        """
+        Multi-dimension group-by. Returns a DataFrame with one column per dim,
+        one per measure (summed) and a 'count' column, sorted by the first
+        measure desc.
+        """
+        n = self.row_count if mask is None else int(mask.sum())
+        if n == 0:
+            return pd.DataFrame(columns=list(dims) + list(measures) + ['count'])
+        shifted = [(self.codes[d] if mask is None else self.codes[d][mask]).astype(np.int64) + 1 for d in dims]
+        # Combine dimension codes pairwise, re-compacting after each step so the
+        # composite key never overflows int64 regardless of cardinalities
+        inverse = shifted[0]
+        for part, d in zip(shifted[1:], dims[1:]):
+            _, inverse = np.unique(inverse * (len(self.labels[d]) + 1) + part, return_inverse=True)
+        uniq, first_row, inverse = np.unique(inverse, return_index=True, return_inverse=True)
+        out = {}
+        for d, part in zip(dims, shifted):
+            labels = np.concatenate([np.array([None], dtype=object), self.labels[d]])
+            out[d] = pd.Series(labels[part[first_row]], dtype=object)
+        for m in measures:
+            weights = self.measures[m] if mask is None else self.measures[m][mask]
+            out[m] = np.bincount(inverse, weights=weights, minlength=len(uniq))
+        out['count'] = np.bincount(inverse, minlength=len(uniq))
+        frame = pd.DataFrame(out)
+        if measures:
+            frame = frame.sort_values(measures[0], ascending=False, kind='stable')
+        if top:
+            frame = frame.head(top)
+        return frame.reset_index(drop=True)
+
+    # ------------------------------------------------------------------
+    # Memory accounting
+    # ------------------------------------------------------------------
+    def memory_usage(self):
+        """Approximate bytes held per column (codes + label dictionaries + measures)"""
+        columns = {}
+        for dim, codes in self.codes.items():
+            label_bytes = sum(len(str(v)) + 49 for v in self.labels[dim]) + self.labels[dim].nbytes
+            columns[dim] = {
+                "codes_bytes": int(codes.nbytes),
+                "dictionary_bytes": int(label_bytes),
+                "cardinality": int(len(self.labels[dim]))
+            }
+        for name, values in self.measures.items():
+            columns[name] = {"values_bytes": int(values.nbytes)}
+        total = sum(sum(v for k, v in c.items() if k.endswith('_bytes')) for c in columns.values())
+        return {"rows": self.row_count, "total_bytes": int(total), "columns": columns}
+
+
+# ==========================================
+# CUBE SERVICE
+# ==========================================
+
+_cube = None
+_cube_lock = threading.RLock()
+
+
+def refresh_spend_cube():
+    """Rebuild the cube from the database (requires an app context) and swap it in"""
+    global _cube
+    with _cube_lock:
+        started = time.time()
+        # Read the version first: a bump during the load then triggers another rebuild
+        version = get_data_version(SPEND)
+        cube = SpendCube.load()
+        cube.data_version = version
+        _cube = cube
+        print(f"🧊 Spend cube rebuilt: {_cube.row_count} rows in {time.time() - started:.2f}s")
+        return _cube
+
+
+def refresh_loaded_spend_cube():
+    """Rebuild the cube only if this process has one (CLI scripts never load it)"""
+    if _cube is not None:
+        return refresh_spend_cube()
+    return None
+
+
+def get_spend_cube():
+    """Current cube, building it on first use and rebuilding it when the spend data version changed"""
+    cube = _cube
+    if cube is None or cube.data_version != get_data_version(SPEND):
+        with _cube_lock:
+            cube = _cube
+            if cube is None or cube.data_version != get_data_version(SPEND):
+                cube = refresh_spend_cube()
+    return cube
+
+
+def preload_spend_cube(app):
+    """Build the cube in a background thread so startup is not blocked"""
+    def _run():
+        with app.app_context():
+            try:
+                refresh_spend_cube()
+            except Exception as e:
+                print(f"⚠️ Spend cube preload failed: {e}")
+    threading.Thread(target=_run, daemon=True).start()
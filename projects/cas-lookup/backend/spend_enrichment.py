@@ -0,0 +1,279 @@
+"""
+Spend Enrichment Executor
+=========================
+Runs the LLM lookups of a spend enrichment run concurrently and applies the
+results in batched transactions.
+
+    workers (ENRICHMENT_WORKERS threads)
+        take a token from the shared TokenBucket (ENRICHMENT_RATE calls per
+        second, bursts of ENRICHMENT_BURST) and call
+        BedrockCleaner.get_chemical_details for one distinct description
+    writer (the calling thread, inside the app context)
+        the only thread touching the database and the progress counters:
+        collects finished lookups and applies them ENRICHMENT_WRITE_BATCH at a
+        time (or every ENRICHMENT_WRITE_INTERVAL seconds) in one transaction
+
+The bucket caps the request rate regardless of the worker count, so the pool
+can be sized for Bedrock latency without tripping its throttling. Because
+only the writer updates `progress`, the counters stay exact under concurrency.
+
+A batch is a list of outcomes (raw_desc, found, result): found tells whether
+the LLM identified the substance, result is enrichment_result() or None.
+The enriched outcomes of a batch are loaded into the connection's temporary
+enrichment_stage table and applied with one UPDATE ... FROM per table, driven
+by the stage rows through the item_description indexes.
+Callers persisting more than the enrichment itself (enrichment_jobs.py) pass
+their own apply_batch, and a should_stop callback the writer polls at least
+every write interval to stop a run early.
+"""
+
+import os
+import threading
+import time
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from models import db
+from chemical_utils import hyper_clean_chemical
+
+ENRICHMENT_WORKERS = int(os.environ.get('ENRICHMENT_WORKERS', 8))
+ENRICHMENT_RATE = float(os.environ.get('ENRICHMENT_RATE', 5.0))
+ENRICHMENT_BURST = int(os.environ.get('ENRICHMENT_BURST', 10))
+ENRICHMENT_WRITE_BATCH = int(os.environ.get('ENRICHMENT_WRITE_BATCH', 200))
+ENRICHMENT_WRITE_INTERVAL = float(os.environ.get('ENRICHMENT_WRITE_INTERVAL', 5.0))
+
+MAX_WORKERS = 64
+
+# Per-connection staging table of the enriched outcomes of the batch being written
+ENRICHMENT_STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS enrichment_stage (
+        raw_description VARCHAR(500) PRIMARY KEY,
+        enriched_description VARCHAR(500),
+        cas_number VARCHAR(100),
+        inci_name VARCHAR(500)
+    )
+"""
+# The IN (stage) term makes SQLite look the staged descriptions up in the item_description
+# index instead of scanning the target table against the (unanalyzed) stage
+STAGED_SPEND_UPDATE = """
+    UPDATE spend_record SET enriched_description = s.enriched_description, cas_number = s.cas_number
+    FROM enrichment_stage s
+    WHERE spend_record.item_description = s.raw_description
+      AND spend_record.item_description IN (SELECT raw_description FROM enrichment_stage)
+"""
+STAGED_MATERIAL_UPDATE = """
+    UPDATE material_data SET enriched_description = s.enriched_description, cas_number = s.cas_number,
+        inci_name = s.inci_name
+    FROM enrichment_stage s
+    WHERE material_data.item_description = s.raw_description
+      AND material_data.item_description IN (SELECT raw_description FROM enrichment_stage)
+"""
+STAGED_OLD_DESCRIPTIONS = """
+    SELECT DISTINCT r.enriched_description
+    FROM enrichment_stage s CROSS JOIN spend_record r ON r.item_description = s.raw_description
+"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = max(1, int(capacity))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class LatencyStats:
+    """Thread-safe LLM call latencies per provider over the last LATENCY_WINDOW calls"""
+
+    LATENCY_WINDOW = 200
+
+    def __init__(self):
+        self.providers = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, seconds, failed=False):
+        with self._lock:
+            stats = self.providers.setdefault(provider, {"calls": 0, "failures": 0,
+                                                         "window": deque(maxlen=self.LATENCY_WINDOW)})
+            stats["calls"] += 1
+            stats["failures"] += failed
+            stats["window"].append(seconds)
+
+    def snapshot(self):
+        """{provider: {calls, failures, mean_ms, p50_ms, p95_ms, max_ms}}"""
+        with self._lock:
+            providers = {p: (s["calls"], s["failures"], sorted(s["window"])) for p, s in self.providers.items()}
+        snapshot = {}
+        for provider, (calls, failures, window) in providers.items():
+            if not window:
+                continue
+            snapshot[provider] = {
+                "calls": calls,
+                "failures": failures,
+                "mean_ms": round(1000 * sum(window) / len(window), 1),
+                "p50_ms": round(1000 * window[len(window) // 2], 1),
+                "p95_ms": round(1000 * window[min(len(window) - 1, int(len(window) * 0.95))], 1),
+                "max_ms": round(1000 * window[-1], 1)
+            }
+        return snapshot
+
+
+def provider_name(cleaner):
+    return getattr(cleaner, 'provider', None) or type(cleaner).__name__
+
+
+def details_found(details):
+    return bool(details) and (details.get('inci') != "NOT FOUND" or details.get('cas') != "NOT FOUND")
+
+
+def enrichment_result(raw_desc, details):
+    """
+    (enriched_description, cas, inci) for an LLM answer, or None when it has no
+    usable name and CAS number. Standardized format: Name_cas_Number (e.g. Glycerin_cas_56-81-5).
+    """
+    if not details_found(details):
+        return None
+    name = details.get('inci') if details.get('inci') != "NOT FOUND" else raw_desc
+    cas = details.get('cas') if details.get('cas') != "NOT FOUND" else ""
+    name_clean = hyper_clean_chemical(name).title().replace(' ', '')
+    # We MUST have both a meaningful name and a CAS number (keeps it clean from "_cas_123" noise)
+    if not (name_clean and len(name_clean) > 2 and cas and cas != "NOT FOUND"):
+        return None
+    return f"{name_clean}_cas_{cas}", cas, name
+
+
+def apply_enrichment_batch(outcomes, commit=True):
+    """
+    Write the enriched outcomes of a batch to spend_record and material_data in
+    one transaction; returns the old and new enriched descriptions touched.
+    """
+    results = [(raw_desc,) + result for raw_desc, found, result in outcomes if result is not None]
+    if not results:
+        if commit:
+            db.session.commit()
+        return set()
+    db.session.execute(text(ENRICHMENT_STAGE_DDL))
+    db.session.execute(text("DELETE FROM enrichment_stage"))
+    db.session.execute(
+        text("INSERT OR REPLACE INTO enrichment_stage VALUES (:d, :e, :c, :i)"),
+        [{"d": d, "e": e, "c": c, "i": i} for d, e, c, i in results]
+    )
+    affected = {m for (m,) in db.session.execute(text(STAGED_OLD_DESCRIPTIONS))}
+    affected.update(r[1] for r in results)
+    db.session.execute(text(STAGED_SPEND_UPDATE))
+    db.session.execute(text(STAGED_MATERIAL_UPDATE))
+    db.session.execute(text("DELETE FROM enrichment_stage"))
+    if commit:
+        db.session.commit()
+    return affected
+
+
+def _lookup(cleaner, bucket, raw_desc, latency=None):
+    """(LLM found the substance, enrichment_result or None); the call time (not the bucket wait) goes to latency"""
+    bucket.acquire()
+    started = time.perf_counter()
+    try:
+        details = cleaner.get_chemical_details(raw_desc)
+    except Exception:
+        if latency is not None:
+            latency.record(provider_name(cleaner), time.perf_counter() - started, failed=True)
+        raise
+    if latency is not None:
+        latency.record(provider_name(cleaner), time.perf_counter() - started)
+    return details_found(details), enrichment_result(raw_desc, details)
+
+
+def run_enrichment(cleaner, descriptions, progress, workers=None, rate=None, burst=None,
+                   write_batch=None, write_interval=None, apply_batch=apply_enrichment_batch, should_stop=None,
+                   latency=None):
+    """
+    Enrich distinct raw descriptions with a worker pool; must run inside an app
+    context. progress: dict whose current / processed / errors counters are
+    updated as outcomes are written. When should_stop() returns True, lookups
+    not started yet are dropped and those in flight are still written.
+    latency: optional LatencyStats collecting the LLM call times.
+    Returns the enriched descriptions touched (old and new) for after_spend_enrichment.
+    """
+    workers = max(1, min(workers or ENRICHMENT_WORKERS, MAX_WORKERS))
+    bucket = TokenBucket(rate or ENRICHMENT_RATE, burst or ENRICHMENT_BURST)
+    write_batch = write_batch or ENRICHMENT_WRITE_BATCH
+    write_interval = write_interval or ENRICHMENT_WRITE_INTERVAL
+    affected, pending = set(), []
+    last_write = last_check = time.monotonic()
+    stopped = False
+
+    def flush():
+        nonlocal pending, last_write
+        batch, pending, last_write = pending, [], time.monotonic()
+        try:
+            affected.update(apply_batch(batch))
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Enrichment batch write failed ({len(batch)} descriptions): {e}")
+            progress["current"] += len(batch)
+            progress["errors"] += len(batch)
+            return
+        progress["current"] += len(batch)
+        progress["processed"] += sum(1 for _, found, _ in batch if found)
+        progress["errors"] += sum(1 for _, found, _ in batch if not found)
+
+    started = time.monotonic()
+    finished = queue.Queue()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='enrich') as pool:
+        futures = {}
+        for raw_desc in descriptions:
+            if not raw_desc:
+                progress["current"] += 1
+                continue
+            future = pool.submit(_lookup, cleaner, bucket, raw_desc, latency)
+            futures[future] = raw_desc
+            future.add_done_callback(finished.put)
+        while futures:
+            try:
+                future = finished.get(timeout=write_interval)
+            except queue.Empty:
+                future = None
+            if future is not None:
+                raw_desc = futures.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    found, result = future.result()
+                except Exception as e:
+                    print(f"Enrichment error for {raw_desc}: {e}")
+                    found, result = False, None
+                # Name or CAS missing (result None): nothing is written, keeping the fields empty
+                pending.append((raw_desc, found, result))
+            if len(pending) >= write_batch or (pending and time.monotonic() - last_write >= write_interval):
+                flush()
+            if should_stop and not stopped and time.monotonic() - last_check >= write_interval:
+                last_check = time.monotonic()
+                if should_stop():
+                    stopped = True
+                    # Cancelled futures still arrive through `finished` and are dropped there
+                    for queued in list(futures):
+                        queued.cancel()
+    if pending:
+        flush()
+    if stopped:
+        print(f"⏹️ Enrichment stopped early after {progress['current']} descriptions")
+    elapsed = time.monotonic() - started
+    print(f"🧪 Enrichment finished: {progress['current']} descriptions in {elapsed:.1f}s "
+          f"({progress['processed']} answered, {progress['errors']} not found, {workers} workers)")
+    return affected
@@ -0,0 +1,168 @@
+"""
+Spend Export
+============
+Streams the rows of /api/spend-analysis/table's filter set (filters, text
+search, sort) as CSV, XLSX or Parquet without materializing the result.
+
+Rows are read with a server-side cursor in EXPORT_BATCH_SIZE batches
+(yield_per) and every batch is encoded and handed to the response before the
+next one is fetched, so memory stays constant regardless of the row count:
+
+    csv      csv.writer per batch, streamed as it is written
+    xlsx     openpyxl write-only workbook (rows spill to a temp file); the zip
+             container can only be assembled at the end, so it is written to a
+             temporary file first and then streamed in chunks
+    parquet  one Arrow record batch per row group; the bytes of each row group
+             are streamed as soon as it is written (requires pyarrow)
+"""
+
+import csv
+import io
+import tempfile
+from datetime import datetime
+from openpyxl import Workbook
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, func
+from models import db, SpendRecord, MaterialData
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_BATCH_SIZE = 10000
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# One worksheet holds 1,048,576 rows including the header
+XLSX_MAX_ROWS = 1048575
+
+# Every spend_record column but the delta-ingestion fingerprint; enriched_description is the linked
+# material's, as in the table view
+EXPORT_COLUMNS = [c.name for c in SpendRecord.__table__.columns if c.name not in ('line_key', 'content_hash')]
+NOT_ENRICHED = "Not Enriched"
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def export_entities():
+    """Query entities of an export row, in EXPORT_COLUMNS order"""
+    linked = func.coalesce(MaterialData.enriched_description, NOT_ENRICHED).label('enriched_description')
+    return [linked if name == 'enriched_description' else getattr(SpendRecord, name) for name in EXPORT_COLUMNS]
+
+
+def format_available(fmt):
+    return fmt != 'parquet' or pa is not None
+
+
+def export_filename(fmt):
+    return f"spend_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt][1]}"
+
+
+def _batches(query, batch_size=EXPORT_BATCH_SIZE):
+    """Lists of rows read through a server-side cursor (Core execution: no ORM row processing)"""
+    result = db.session.connection().execute(query.statement, execution_options={"yield_per": batch_size})
+    yield from result.partitions()
+
+
+def _stream_file(handle):
+    handle.seek(0)
+    while True:
+        chunk = handle.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+# ==========================================
+# WRITERS (generators of bytes)
+# ==========================================
+
+def stream_csv(query):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the UTF-8 file with the right encoding
+    yield '\ufeff'.encode('utf-8')
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in _batches(query):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_xlsx(query):
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, sheets = None, XLSX_MAX_ROWS, 0
+    for rows in _batches(query):
+        for row in rows:
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheets += 1
+                sheet = workbook.create_sheet(f"Spend {sheets}" if sheets > 1 else "Spend")
+                sheet.append(EXPORT_COLUMNS)
+                sheet_rows = 0
+            sheet.append(tuple(row))
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet("Spend").append(EXPORT_COLUMNS)
+    with tempfile.TemporaryFile() as handle:
+        workbook.save(handle)
+        yield from _stream_file(handle)
+
+
+def arrow_type(column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object collecting what pyarrow writes, drained between row groups"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(query):
+    columns = SpendRecord.__table__.columns
+    schema = pa.schema([(name, arrow_type(columns[name])) for name in EXPORT_COLUMNS])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    for rows in _batches(query):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_WRITERS = {'csv': stream_csv, 'xlsx': stream_xlsx, 'parquet': stream_parquet}
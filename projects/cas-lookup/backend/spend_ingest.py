@@ -0,0 +1,564 @@
+"""
+Spend Ingestion
+===============
+Bulk load of Purchase History extracts (Excel / CSV) into spend_record:
+
+    map_spend_columns    source header -> spend_record column, by normalized
+                         header name and aliases; files whose headers are not
+                         recognized fall back to the legacy 24-column layout
+    clean_spend_frame    whole columns cleaned vectorized: strings stripped
+                         (Excel numbers without a trailing '.0'), amounts
+                         parsed ('1,234.50'), typed periods derived
+    insert_spend_batches core executemany in INGEST_BATCH_SIZE chunks on the
+                         caller's connection (one transaction), batch by
+                         batch as a stream delivers them
+    apply_spend_delta    incremental load of a complete extract (see below)
+
+Files are streamed batch by batch by spend_workbook (ingest_spend_file):
+append and replace loads insert each cleaned batch as it arrives, so only
+one batch is held at a time; a delta collects the complete extract first.
+ingest_spend_frame takes a frame that is already in memory.
+
+The spend_fts sync triggers are dropped while writing and the written rows
+indexed set-based. Loads that write (insert, or delete when replacing) at
+least INGEST_REINDEX_ROWS rows and leave no more old rows than they insert
+also drop the secondary indexes and recreate them afterwards: building an
+index once is far cheaper than maintaining it row by row.
+
+Delta loads identify PO lines by line_key (po_number|line|shipment|n, n
+numbering repeats of the same triple in file order) and compare a 64-bit
+content_hash of the cleaned source values: new lines are inserted, changed
+lines updated in place (enriched_description / cas_number are kept), and
+lines missing from the extract moved to spend_tombstone. A tombstoned line
+that comes back gets its enrichment again. An unchanged extract writes
+nothing, so a monthly refresh costs the size of its delta.
+"""
+
+import os
+import re
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from models import db
+from spend_periods import derive_period_columns
+from spend_search import index_rows, unindex_rows
+
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 50000))
+INGEST_REINDEX_ROWS = int(os.environ.get('INGEST_REINDEX_ROWS', 10000))
+# Fewer recognized headers than this: the file is read with the legacy positional layout
+MIN_HEADER_MATCHES = 4
+
+TEXT_COLUMNS = ['operating_unit', 'po_number', 'po_date', 'month', 'year', 'po_type', 'po_status', 'buyer_name',
+                'supplier_number', 'vendor_name', 'supplier_site', 'item_category', 'item_code', 'item_description',
+                'uom', 'currency', 'payment_term', 'freight_terms', 'ship_via', 'fob_dsp', 'line_number',
+                'shipment_number']
+NUMBER_COLUMNS = ['quantity', 'exchange_rate', 'price', 'base_price_fc', 'base_price_inr']
+
+# spend_record column -> accepted source headers (normalized: upper case, '_' between words)
+SPEND_HEADERS = {
+    'operating_unit': ('OPERATING_UNIT', 'OU', 'OU_NAME'),
+    'po_number': ('PO_NUMBER', 'PO_NUM', 'PO_NO', 'SEGMENT1'),
+    'po_date': ('PO_DATE', 'CREATION_DATE', 'ORDER_DATE'),
+    'month': ('MONTH',),
+    'year': ('YEAR',),
+    'po_type': ('PO_TYPE', 'TYPE_LOOKUP_CODE'),
+    'po_status': ('PO_STATUS', 'STATUS', 'AUTHORIZATION_STATUS'),
+    'buyer_name': ('BUYER_NAME', 'BUYER'),
+    'supplier_number': ('SUPPLIER_NUMBER', 'VENDOR_NUMBER', 'SUPPLIER_NO'),
+    'vendor_name': ('SUPPLIER_NAME', 'VENDOR_NAME', 'SUPPLIER', 'VENDOR'),
+    'supplier_site': ('SUPPLIER_SITE', 'SUPPLIER_SITE_CODE', 'VENDOR_SITE_CODE', 'VENDOR_SITE'),
+    'item_category': ('ITEM_CATEGORY', 'CATEGORY'),
+    'item_code': ('ITEM_CODE', 'ITEM_NUMBER', 'ITEM'),
+    'item_description': ('ITEM_DESCRIPTION', 'ITEM_DESC', 'DESCRIPTION'),
+    'quantity': ('QUANTITY', 'QTY'),
+    'uom': ('UOM', 'UNIT_MEAS_LOOKUP_CODE', 'UNIT_OF_MEASURE'),
+    'currency': ('CURRENCY', 'CURRENCY_CODE'),
+    'exchange_rate': ('EXCHANGE_RATE', 'RATE'),
+    'price': ('PRICE', 'UNIT_PRICE', 'UNIT_PRICE_FC'),
+    'payment_term': ('PAYMENT_TERM', 'PAYMENT_TERMS', 'TERMS'),
+    'base_price_fc': ('BASE_PRICE_FC',),
+    'base_price_inr': ('BASE_PRICE_INR', 'AMOUNT', 'AMOUNT_INR'),
+    'freight_terms': ('FREIGHT_TERMS_DSP', 'FREIGHT_TERMS'),
+    'ship_via': ('SHIP_VIA_LOOKUP_CODE', 'SHIP_VIA'),
+    'fob_dsp': ('FOB_DSP', 'FOB'),
+    'line_number': ('LINE_NUMBER', 'LINE_NUM', 'PO_LINE', 'LINE'),
+    'shipment_number': ('SHIPMENT_NUMBER', 'SHIPMENT_NUM', 'SHIPMENT'),
+}
+# Column order of the Purchase History sheet before it had recognizable headers
+LEGACY_LAYOUT = ['operating_unit', 'po_number', 'po_date', 'month', 'year', 'po_type', 'po_status', 'buyer_name',
+                 'supplier_number', 'vendor_name', 'supplier_site', 'item_code', 'item_description', 'quantity', 'uom',
+                 'currency', 'exchange_rate', 'price', 'payment_term', 'base_price_fc', 'base_price_inr',
+                 'freight_terms', 'ship_via', 'fob_dsp']
+
+# Values a delta load compares (content_hash) and rewrites on changed lines
+KEY_COLUMNS = ['po_number', 'line_number', 'shipment_number']
+FINGERPRINT_COLUMNS = TEXT_COLUMNS + NUMBER_COLUMNS
+UPDATE_COLUMNS = FINGERPRINT_COLUMNS + ['amount', 'po_date_d', 'period_month', 'fiscal_year', 'content_hash']
+INSERT_COLUMNS = UPDATE_COLUMNS + ['line_key', 'is_contract', 'created_at']
+INGEST_MODES = ('append', 'replace', 'delta')
+
+DELTA_STAGE_DDL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS spend_delta_stage (
+        id INTEGER PRIMARY KEY, {', '.join(UPDATE_COLUMNS)}
+    )
+"""
+DELTA_REMOVED_DDL = "CREATE TEMP TABLE IF NOT EXISTS spend_delta_removed (id INTEGER PRIMARY KEY)"
+STAGED_LINE_UPDATE = f"""
+    UPDATE spend_record SET {', '.join(f'{c} = s.{c}' for c in UPDATE_COLUMNS)}
+    FROM spend_delta_stage s WHERE spend_record.id = s.id
+"""
+TOMBSTONE_REMOVED = """
+    INSERT OR REPLACE INTO spend_tombstone (line_key, spend_id, po_number, vendor_name, item_description, amount,
+                                            enriched_description, cas_number, deleted_at)
+    SELECT line_key, id, po_number, vendor_name, item_description, amount, enriched_description, cas_number, :now
+    FROM spend_record WHERE id IN (SELECT id FROM spend_delta_removed)
+"""
+RESTORE_ENRICHMENT = """
+    UPDATE spend_record SET enriched_description = t.enriched_description, cas_number = t.cas_number
+    FROM spend_tombstone t
+    WHERE spend_record.id > :after AND spend_record.line_key = t.line_key
+"""
+
+_HEADER_SEPARATORS = re.compile(r'[^A-Z0-9]+')
+_INTEGRAL = r'^(-?\d+)\.0+$'
+
+
+def normalize_header(label):
+    """'Supplier Name ' -> 'SUPPLIER_NAME'"""
+    return _HEADER_SEPARATORS.sub('_', str(label).upper()).strip('_')
+
+
+_ALIASES = {alias: column for column, aliases in SPEND_HEADERS.items() for alias in aliases}
+
+
+def map_spend_columns(labels):
+    """
+    ({spend_record column: source label}, [unmapped labels]) by header name;
+    the first source column wins when several map to the same field.
+    """
+    mapping, unmapped = {}, []
+    for label in labels:
+        column = _ALIASES.get(normalize_header(label))
+        if column is None or column in mapping:
+            unmapped.append(label)
+        else:
+            mapping[column] = label
+    return mapping, unmapped
+
+
+def legacy_columns(labels):
+    """{spend_record column: source label} for the positional Purchase History layout"""
+    return {column: label for column, label in zip(LEGACY_LAYOUT, labels)}
+
+
+def _clean_text(values):
+    """Stripped strings, None when empty; each distinct raw value is cleaned once"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    cleaned = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    # Excel number cells (PO / supplier numbers, years) read as floats: 4500001234.0 -> '4500001234'
+    cleaned = cleaned.str.replace(_INTEGRAL, r'\1', regex=True).to_numpy(dtype=object)
+    cleaned[cleaned == ''] = None
+    return np.append(cleaned, None)[codes]
+
+
+def _iso_dates(dates):
+    """'yyyy-mm-dd' strings (the SQLite Date format) of datetime.date values, None when missing"""
+    codes, uniques = pd.factorize(pd.Series(dates, dtype=object), use_na_sentinel=True)
+    return np.append(np.array([d.isoformat() for d in uniques], dtype=object), None)[codes]
+
+
+def _clean_number(values):
+    """Floats, 0.0 when missing or unparseable; accepts thousands separators"""
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float).fillna(0.0).to_numpy()
+    parsed = pd.to_numeric(series, errors='coerce')
+    retry = parsed.isna() & series.notna()
+    if retry.any():
+        stripped = series[retry].astype(str).str.replace(',', '', regex=False).str.strip()
+        parsed[retry] = pd.to_numeric(stripped, errors='coerce')
+    return parsed.astype(float).fillna(0.0).to_numpy()
+
+
+def line_keys(records, seen=None):
+    """
+    'po|line|shipment|n' per row; n numbers repeats of the same (po, line,
+    shipment) in row order. seen: {'po|line|shipment': rows} of the earlier
+    batches of the same extract, updated in place.
+    """
+    base = records['po_number'].fillna('')
+    for column in KEY_COLUMNS[1:]:
+        base = base + '|' + records[column].fillna('')
+    occurrence = base.groupby(base, sort=False).cumcount() + 1
+    if seen is not None:
+        occurrence += [seen.get(key, 0) for key in base]
+        for key, count in base.value_counts(sort=False).items():
+            seen[key] = seen.get(key, 0) + count
+    return (base + '|' + occurrence.astype(str)).to_numpy(dtype=object)
+
+
+def content_hashes(records):
+    """Signed 64-bit hash per row of the cleaned source values (FINGERPRINT_COLUMNS)"""
+    values = pd.DataFrame({column: pd.Series(records[column].to_numpy(), dtype=object if column in TEXT_COLUMNS
+                                             else float) for column in FINGERPRINT_COLUMNS})
+    return pd.util.hash_pandas_object(values, index=False).to_numpy().view(np.int64)
+
+
+def clean_spend_frame(frame, columns):
+    """
+    DataFrame of spend_record values (INSERT_COLUMNS) from a source frame and
+    its column mapping. Rows with neither supplier nor item are dropped.
+    """
+    n = len(frame)
+    cleaned = {}
+    for column in TEXT_COLUMNS:
+        cleaned[column] = _clean_text(frame[columns[column]]) if column in columns else np.full(n, None, dtype=object)
+    for column in NUMBER_COLUMNS:
+        cleaned[column] = _clean_number(frame[columns[column]]) if column in columns else np.zeros(n)
+    records = pd.DataFrame({column: pd.Series(values, dtype=values.dtype) for column, values in cleaned.items()})
+    keep = records['vendor_name'].notna() | records['item_description'].notna()
+    records = records[keep.to_numpy()].reset_index(drop=True)
+
+    records['vendor_name'] = records['vendor_name'].fillna('Unknown')
+    records['item_description'] = records['item_description'].fillna('Unknown')
+    records['amount'] = records['base_price_inr']
+    # Typed periods from the raw cells (Timestamps / Excel serials parse better than their text)
+    raw_dates = frame[columns['po_date']][keep.to_numpy()] if 'po_date' in columns else records['po_date']
+    periods = derive_period_columns(raw_dates.reset_index(drop=True))
+    records['po_date_d'] = pd.Series(_iso_dates(periods['po_date_d']), dtype=object)
+    records['period_month'] = periods['period_month']
+    records['fiscal_year'] = periods['fiscal_year']
+    records['content_hash'] = content_hashes(records)
+    records['line_key'] = line_keys(records)
+    records['is_contract'] = False
+    records['created_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    return records[INSERT_COLUMNS]
+
+
+def _drop_secondary(conn, indexes=False):
+    """
+    Drop the spend_fts sync triggers (and with indexes=True the secondary
+    indexes) of spend_record; returns their DDL for _restore_secondary.
+    """
+    kinds = "('index', 'trigger')" if indexes else "('trigger')"
+    dropped = conn.execute(text(
+        f"SELECT name, type, sql FROM sqlite_master WHERE tbl_name = 'spend_record' AND type IN {kinds} "
+        "AND sql IS NOT NULL AND (type = 'index' OR name LIKE 'spend_fts_%')"
+    )).fetchall()
+    for name, kind, _ in dropped:
+        conn.execute(text(f'DROP {kind.upper()} "{name}"'))
+    return dropped
+
+
+def _restore_secondary(conn, dropped):
+    for _, _, ddl in dropped:
+        conn.execute(text(ddl))
+
+
+def _fts_exists(conn):
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spend_fts'")).first()
+
+
+def insert_spend_batches(conn, batches, replace=False):
+    """
+    Insert cleaned record batches with executemany in INGEST_BATCH_SIZE
+    chunks on an open connection as they arrive (the caller commits).
+    replace=True deletes the existing rows first. Returns the number of rows
+    inserted.
+    """
+    # DDL does not open the driver's transaction: begin it, so the trigger / index drops
+    # roll back with the rows when the stream fails halfway
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN")
+    existing = conn.execute(text("SELECT COUNT(*) FROM spend_record")).scalar()
+    kept = 0 if replace else existing
+
+    def reindex_due(inserted):
+        written = inserted + (existing if replace else 0)
+        return written >= INGEST_REINDEX_ROWS and inserted >= kept
+
+    dropped = _drop_secondary(conn)
+    # Decided as the rows arrive: indexes go as soon as the load is big enough to rebuild them
+    reindex = reindex_due(0)
+    if reindex:
+        dropped += _drop_secondary(conn, indexes=True)
+    if replace:
+        conn.execute(text("DELETE FROM spend_record"))
+    after = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM spend_record")).scalar()
+
+    statement = (f"INSERT INTO spend_record ({', '.join(INSERT_COLUMNS)}) "
+                 f"VALUES ({', '.join('?' for _ in INSERT_COLUMNS)})")
+    inserted = 0
+    for records in batches:
+        if not reindex and reindex_due(inserted + len(records)):
+            dropped += _drop_secondary(conn, indexes=True)
+            reindex = True
+        values = [records[column].to_numpy() for column in INSERT_COLUMNS]
+        for start in range(0, len(records), INGEST_BATCH_SIZE):
+            rows = list(zip(*(v[start:start + INGEST_BATCH_SIZE].tolist() for v in values)))
+            conn.exec_driver_sql(statement, rows)
+        inserted += len(records)
+
+    if _fts_exists(conn):
+        if reindex or replace:
+            conn.execute(text("INSERT INTO spend_fts(spend_fts) VALUES ('rebuild')"))
+        else:
+            index_rows(conn, 'spend_fts', "id > :after", {"after": after})
+    _restore_secondary(conn, dropped)
+    if reindex:
+        # Sampled statistics: exact ones cost a full pass over every new index
+        conn.execute(text("PRAGMA analysis_limit = 1000"))
+        conn.execute(text("ANALYZE spend_record"))
+    return inserted
+
+
+def insert_spend_rows(conn, records, replace=False):
+    """Insert cleaned records on an open connection (see insert_spend_batches)"""
+    return insert_spend_batches(conn, [records], replace=replace)
+
+
+def backfill_fingerprints(conn):
+    """line_key / content_hash for rows loaded before fingerprints existed (used by db_migrations)"""
+    missing = conn.execute(text(
+        "SELECT COUNT(*) FROM spend_record WHERE line_key IS NULL OR content_hash IS NULL")).scalar()
+    if not missing:
+        return 0
+    # Occurrence numbers run over the whole table in id (= load) order
+    stored = pd.DataFrame(conn.execute(text(f"SELECT id, {', '.join(KEY_COLUMNS)} FROM spend_record ORDER BY id"))
+                          .fetchall(), columns=['id'] + KEY_COLUMNS)
+    keys = line_keys(pd.DataFrame({column: _clean_text(stored[column]) for column in KEY_COLUMNS}))
+    key_by_id = dict(zip(stored['id'].tolist(), keys.tolist()))
+
+    updated, last_id = 0, 0
+    while True:
+        batch = conn.execute(text(
+            f"SELECT id, {', '.join(FINGERPRINT_COLUMNS)} FROM spend_record "
+            "WHERE (line_key IS NULL OR content_hash IS NULL) AND id > :last ORDER BY id LIMIT :n"
+        ), {"last": last_id, "n": INGEST_BATCH_SIZE}).fetchall()
+        if not batch:
+            break
+        stored = pd.DataFrame(batch, columns=['id'] + FINGERPRINT_COLUMNS)
+        hashes = content_hashes(pd.DataFrame({
+            column: _clean_text(stored[column]) if column in TEXT_COLUMNS else _clean_number(stored[column])
+            for column in FINGERPRINT_COLUMNS
+        }))
+        ids = stored['id'].tolist()
+        conn.exec_driver_sql("UPDATE spend_record SET line_key = ?, content_hash = ? WHERE id = ?",
+                             [(key_by_id[i], h, i) for i, h in zip(ids, hashes.tolist())])
+        updated += len(ids)
+        last_id = ids[-1]
+    print(f"🔑 Fingerprinted {updated} spend lines")
+    return updated
+
+
+def _materials(conn, where, params=None):
+    return {m for (m,) in conn.execute(text(
+        f"SELECT DISTINCT enriched_description FROM spend_record WHERE {where} AND enriched_description IS NOT NULL"
+    ), params or {})}
+
+
+def apply_spend_delta(conn, records):
+    """
+    Bring spend_record in line with cleaned records of a complete extract on
+    an open connection (the caller commits). Returns (counts, enriched
+    descriptions of the lines that changed, went away or came back).
+    """
+    backfill_fingerprints(conn)
+    existing = pd.DataFrame(conn.execute(text("SELECT id, line_key, content_hash FROM spend_record ORDER BY id"))
+                            .fetchall(), columns=['id', 'line_key', 'content_hash'])
+    # Lines appended twice share a key: the first row is matched, the others count as removed
+    current = existing.drop_duplicates('line_key')
+    position = pd.Index(current['line_key']).get_indexer(records['line_key'])
+    matched = position >= 0
+    matched_ids = current['id'].to_numpy()[position[matched]]
+    changed = np.zeros(len(records), dtype=bool)
+    changed[matched] = records['content_hash'].to_numpy()[matched] != current['content_hash'].to_numpy()[
+        position[matched]]
+    removed = np.setdiff1d(existing['id'].to_numpy(), matched_ids)
+    affected = set()
+    fts = _fts_exists(conn)
+    triggers = _drop_secondary(conn) if len(removed) or changed.any() else []
+
+    if len(removed):
+        conn.execute(text(DELTA_REMOVED_DDL))
+        conn.execute(text("DELETE FROM spend_delta_removed"))
+        conn.exec_driver_sql("INSERT INTO spend_delta_removed VALUES (?)", [(i,) for i in removed.tolist()])
+        affected |= _materials(conn, "id IN (SELECT id FROM spend_delta_removed)")
+        if fts:
+            unindex_rows(conn, 'spend_fts', "id IN (SELECT id FROM spend_delta_removed)")
+        conn.execute(text(TOMBSTONE_REMOVED), {"now": datetime.utcnow()})
+        conn.execute(text("DELETE FROM spend_material_link WHERE spend_id IN (SELECT id FROM spend_delta_removed)"))
+        conn.execute(text("DELETE FROM spend_record WHERE id IN (SELECT id FROM spend_delta_removed)"))
+        conn.execute(text("DELETE FROM spend_delta_removed"))
+
+    if changed.any():
+        conn.execute(text(DELTA_STAGE_DDL))
+        conn.execute(text("DELETE FROM spend_delta_stage"))
+        ids = current['id'].to_numpy()[position[changed]].tolist()
+        values = [records[column].to_numpy()[changed].tolist() for column in UPDATE_COLUMNS]
+        conn.exec_driver_sql(
+            f"INSERT INTO spend_delta_stage (id, {', '.join(UPDATE_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' for _ in UPDATE_COLUMNS)})", list(zip(ids, *values)))
+        affected |= _materials(conn, "id IN (SELECT id FROM spend_delta_stage)")
+        if fts:
+            unindex_rows(conn, 'spend_fts', "id IN (SELECT id FROM spend_delta_stage)")
+        conn.execute(text(STAGED_LINE_UPDATE))
+        if fts:
+            index_rows(conn, 'spend_fts', "id IN (SELECT id FROM spend_delta_stage)")
+        conn.execute(text("DELETE FROM spend_delta_stage"))
+    _restore_secondary(conn, triggers)
+
+    restored = 0
+    if not matched.all():
+        after = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM spend_record")).scalar()
+        insert_spend_rows(conn, records[~matched])
+        restored = conn.execute(text(RESTORE_ENRICHMENT), {"after": after}).rowcount
+        if restored:
+            affected |= _materials(conn, "id > :after", {"after": after})
+            conn.execute(text("DELETE FROM spend_tombstone WHERE line_key IN "
+                              "(SELECT line_key FROM spend_record WHERE id > :after)"), {"after": after})
+    counts = {
+        "inserted": int((~matched).sum()),
+        "updated": int(changed.sum()),
+        "unchanged": int(matched.sum() - changed.sum()),
+        "tombstoned": len(removed),
+        "restored": restored,
+    }
+    return counts, affected
+
+
+def read_spend_file(path, sheet_name=0):
+    """Whole source frame of an .xlsx / .csv extract; cells keep their native types (see spend_workbook to stream)"""
+    if path.lower().endswith('.csv'):
+        return pd.read_csv(path, dtype=object, keep_default_na=True)
+    return pd.read_excel(path, sheet_name=sheet_name, dtype=object, engine='openpyxl')
+
+
+def resolve_columns(labels):
+    """(columns, unmapped labels, 'headers' | 'legacy') for the labels of a source frame"""
+    columns, unmapped = map_spend_columns(labels)
+    if len(columns) >= MIN_HEADER_MATCHES:
+        return columns, unmapped, 'headers'
+    return legacy_columns(labels), list(labels[len(LEGACY_LAYOUT):]), 'legacy'
+
+
+def _check_mode(mode):
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode '{mode}' (use one of: {', '.join(INGEST_MODES)})")
+
+
+def _spend_written(counts, mode, skipped, seconds, materials):
+    """Report a committed load, then sync derived spend data"""
+    from spend_sync import after_spend_ingest
+
+    print(f"✅ Ingested spend extract ({mode}, {skipped} skipped): "
+          f"{', '.join(f'{n} {name}' for name, n in counts.items())} - write {seconds:.1f}s")
+    if mode == 'replace' or counts["inserted"] or counts.get("updated") or counts.get("tombstoned"):
+        after_spend_ingest(materials=materials)
+    return dict(counts, mode=mode, skipped=skipped, insert_seconds=round(seconds, 2))
+
+
+def write_spend_records(records, mode='append', skipped=0):
+    """
+    Write cleaned records in one transaction, then sync derived spend data.
+    mode: 'append' adds every row, 'replace' swaps the table contents,
+    'delta' treats the records as the complete current extract.
+    """
+    _check_mode(mode)
+    started = time.time()
+    try:
+        conn = db.session.connection()
+        if mode == 'delta':
+            counts, materials = apply_spend_delta(conn, records)
+        else:
+            counts = {"inserted": insert_spend_rows(conn, records, replace=mode == 'replace')}
+            # New rows carry no enrichment: material risk only changes when rows were replaced
+            materials = None if mode == 'replace' else ()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return _spend_written(counts, mode, skipped, time.time() - started, materials)
+
+
+def ingest_spend_frame(frame, mode='append'):
+    """Map, clean and write a whole source frame (see write_spend_records)"""
+    _check_mode(mode)
+    started = time.time()
+    columns, unmapped, layout = resolve_columns(frame.columns)
+    if unmapped:
+        print(f"⚠️ Ignoring unmapped spend columns: {', '.join(map(str, unmapped))}")
+    records = clean_spend_frame(frame, columns)
+    clean_seconds = time.time() - started
+    summary = write_spend_records(records, mode=mode, skipped=len(frame) - len(records))
+    summary.update({
+        "layout": layout,
+        "columns": {column: str(label) for column, label in columns.items()},
+        "unmapped": [str(label) for label in unmapped],
+        "clean_seconds": round(clean_seconds, 2),
+    })
+    return summary
+
+
+def _timed(batches, clock):
+    """Yield from batches, adding the time spent producing them to clock['seconds']"""
+    batches = iter(batches)
+    while True:
+        started = time.time()
+        batch = next(batches, None)
+        clock["seconds"] += time.time() - started
+        if batch is None:
+            return
+        yield batch
+
+
+def ingest_spend_file(path, mode='append', sheet_name=0, workers=None):
+    """
+    Stream a Purchase History extract into spend_record (see spend_workbook):
+    path may be a directory of extracts, sheet_name=None reads every sheet.
+    The sources together form one extract. Append and replace loads insert
+    every cleaned batch as it is read, in one transaction; a delta compares
+    the complete extract, so it is collected first.
+    """
+    from spend_workbook import peak_rss_mb, read_spend_sources, iter_spend_sources, spend_sources
+
+    _check_mode(mode)
+    started = time.time()
+    sources = spend_sources(path, sheet_name)
+    if mode == 'delta':
+        records, stats = read_spend_sources(sources, workers=workers)
+        read_seconds = time.time() - started
+        verb = "Read and cleaned"
+    else:
+        stats, clock = [], {"seconds": 0.0}
+        try:
+            conn = db.session.connection()
+            inserted = insert_spend_batches(conn, _timed(iter_spend_sources(sources, workers, stats), clock),
+                                            replace=mode == 'replace')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        read_seconds = clock["seconds"]
+        verb = "Streamed"
+    rows = sum(source["rows"] for source in stats)
+    engines = ', '.join(sorted({source["engine"] for source in stats}))
+    seconds = time.time() - started
+    rate = rows / seconds if seconds else 0
+    print(f"📊 {verb} {rows} rows from {len(sources)} sheet(s) of {os.path.basename(path)} "
+          f"in {seconds:.1f}s ({rate:,.0f} rows/s, {engines}, peak RSS {peak_rss_mb()} MB)")
+    if mode == 'delta':
+        summary = write_spend_records(records, mode=mode, skipped=rows - len(records))
+    else:
+        # New rows carry no enrichment: material risk only changes when rows were replaced
+        summary = _spend_written({"inserted": inserted}, mode, rows - inserted, seconds - read_seconds,
+                                 None if mode == 'replace' else ())
+    summary.update({
+        "sources": stats,
+        "read_seconds": round(read_seconds, 2),
+        "rows_per_second": round(rows / (read_seconds + summary["insert_seconds"]) if rows else 0),
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    return summary
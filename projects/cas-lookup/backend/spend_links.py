@@ -0,0 +1,189 @@
+"""
+Spend <-> Material Link Table
+=============================
+Precomputes which MaterialData row each SpendRecord maps to, replacing the
+un-indexable join
+
+    OR(cas equality, enriched_description equality,
+       material.enriched_description LIKE spend.enriched_description || '%')
+
+with a spend_material_link row per spend line that spend endpoints reach via
+an indexed equi-join.
+
+Matching precedence (first rule that matches wins, lowest material id breaks ties):
+    1. 'cas'         - same CAS number (spend CAS not 'NOT FOUND')
+    2. 'description' - identical enriched_description
+    3. 'prefix'      - material enriched_description starts with the spend one
+
+A spend line's link depends only on its own CAS / description and the
+material table, so edits of single materials recompute just the lines whose
+old or new target is an edited material (refresh_spend_material_links);
+bulk material loads rebuild everything.
+"""
+
+import bisect
+import time
+from sqlalchemy import text, bindparam
+from models import db, MaterialData
+
+
+# Restricts the rules to the spend lines in temp.tmp_link_scope (refresh_spend_material_links)
+_SCOPE = " AND s.id IN (SELECT spend_id FROM temp.tmp_link_scope)"
+
+
+def _prefix_matches(scope=''):
+    """
+    Resolve rule 3 on distinct descriptions only: sort the material descriptions
+    once and bisect each unlinked spend description into them. Case-insensitive
+    like SQLite's LIKE; the spend description is matched literally.
+    """
+    materials = db.session.query(MaterialData.enriched_description, db.func.min(MaterialData.id)).filter(
+        MaterialData.enriched_description != None, MaterialData.enriched_description != ''
+    ).group_by(MaterialData.enriched_description).all()
+    if not materials:
+        return []
+    materials = sorted((desc.lower(), mid) for desc, mid in materials)
+    keys = [m[0] for m in materials]
+
+    pending = db.session.execute(text("""
+        SELECT DISTINCT s.enriched_description FROM spend_record s
+        LEFT JOIN spend_material_link l ON l.spend_id = s.id
+        WHERE l.spend_id IS NULL AND s.enriched_description IS NOT NULL AND s.enriched_description != ''""" + scope
+    )).fetchall()
+
+    matches = []
+    for (desc,) in pending:
+        prefix = desc.lower()
+        pos = bisect.bisect_left(keys, prefix)
+        best = None
+        while pos < len(keys) and keys[pos].startswith(prefix):
+            if best is None or materials[pos][1] < best:
+                best = materials[pos][1]
+            pos += 1
+        if best is not None:
+            matches.append({"description": desc, "material_id": best})
+    return matches
+
+
+def _insert_links(scope=''):
+    """Insert the links of spend lines that have none, rule by rule (scope: an extra condition on s)"""
+    # 1. CAS equality
+    db.session.execute(text("""
+        INSERT INTO spend_material_link (spend_id, material_id, match_type)
+        SELECT s.id, m.material_id, 'cas'
+        FROM spend_record s
+        JOIN (SELECT cas_number, MIN(id) AS material_id FROM material_data
+              WHERE cas_number IS NOT NULL GROUP BY cas_number) m
+          ON m.cas_number = s.cas_number
+        WHERE s.cas_number != 'NOT FOUND'""" + scope
+    ))
+
+    # 2. Exact enriched description
+    db.session.execute(text("""
+        INSERT INTO spend_material_link (spend_id, material_id, match_type)
+        SELECT s.id, m.material_id, 'description'
+        FROM spend_record s
+        JOIN (SELECT enriched_description, MIN(id) AS material_id FROM material_data
+              WHERE enriched_description IS NOT NULL GROUP BY enriched_description) m
+          ON m.enriched_description = s.enriched_description
+        LEFT JOIN spend_material_link l ON l.spend_id = s.id
+        WHERE l.spend_id IS NULL""" + scope
+    ))
+
+    # 3. Prefix of the material's enriched description
+    matches = _prefix_matches(scope)
+    if matches:
+        db.session.execute(text("CREATE TEMP TABLE IF NOT EXISTS tmp_prefix_link (description TEXT PRIMARY KEY, material_id INTEGER)"))
+        db.session.execute(text("DELETE FROM tmp_prefix_link"))
+        db.session.execute(text("INSERT INTO tmp_prefix_link (description, material_id) VALUES (:description, :material_id)"), matches)
+        db.session.execute(text("""
+            INSERT INTO spend_material_link (spend_id, material_id, match_type)
+            SELECT s.id, p.material_id, 'prefix'
+            FROM spend_record s
+            JOIN tmp_prefix_link p ON p.description = s.enriched_description
+            LEFT JOIN spend_material_link l ON l.spend_id = s.id
+            WHERE l.spend_id IS NULL""" + scope
+        ))
+        db.session.execute(text("DROP TABLE tmp_prefix_link"))
+
+
+def rebuild_spend_material_links():
+    """Recompute every spend -> material link in one transaction (O(S) with indexed lookups)"""
+    started = time.time()
+    try:
+        db.session.execute(text("DELETE FROM spend_material_link"))
+        _insert_links()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    linked = db.session.execute(text("SELECT COUNT(*) FROM spend_material_link")).scalar()
+    print(f"🔗 Spend-material links rebuilt: {linked} linked lines in {time.time() - started:.2f}s")
+    return linked
+
+
+def _scoped_links():
+    return dict(((spend_id, (material_id, match_type)) for spend_id, material_id, match_type in db.session.execute(text(
+        "SELECT spend_id, material_id, match_type FROM spend_material_link "
+        "WHERE spend_id IN (SELECT spend_id FROM temp.tmp_link_scope)"))))
+
+
+def refresh_spend_material_links(material_ids):
+    """
+    Recompute the links of the spend lines whose old or new target is one of
+    material_ids, after those MaterialData rows were edited. Returns True when
+    spend views change: a link moved, or spend lines are linked to the
+    materials (their descriptions show through the link).
+    """
+    ids = sorted({int(i) for i in material_ids})
+    if not ids:
+        return False
+    started = time.time()
+    try:
+        materials = db.session.query(MaterialData.cas_number, MaterialData.enriched_description).filter(
+            MaterialData.id.in_(ids)).all()
+        cas_numbers = sorted({cas for cas, _ in materials if cas and cas != 'NOT FOUND'})
+        # Spend descriptions equal to, or a case-insensitive prefix of, an edited material's description
+        prefixes = {desc.lower()[:n] for _, desc in materials if desc for n in range(1, len(desc) + 1)}
+        descriptions = [desc for (desc,) in db.session.execute(text(
+            "SELECT DISTINCT enriched_description FROM spend_record "
+            "WHERE enriched_description IS NOT NULL AND enriched_description != ''")) if desc.lower() in prefixes]
+
+        db.session.execute(text("CREATE TEMP TABLE IF NOT EXISTS tmp_link_scope (spend_id INTEGER PRIMARY KEY)"))
+        db.session.execute(text("DELETE FROM tmp_link_scope"))
+        db.session.execute(text(
+            "INSERT OR IGNORE INTO tmp_link_scope SELECT spend_id FROM spend_material_link WHERE material_id IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {"ids": ids})
+        if cas_numbers:
+            db.session.execute(text(
+                "INSERT OR IGNORE INTO tmp_link_scope SELECT id FROM spend_record WHERE cas_number IN :cas"
+            ).bindparams(bindparam('cas', expanding=True)), {"cas": cas_numbers})
+        if descriptions:
+            db.session.execute(text(
+                "INSERT OR IGNORE INTO tmp_link_scope SELECT id FROM spend_record WHERE enriched_description IN :descs"
+            ).bindparams(bindparam('descs', expanding=True)), {"descs": descriptions})
+
+        before = _scoped_links()
+        db.session.execute(text(
+            "DELETE FROM spend_material_link WHERE spend_id IN (SELECT spend_id FROM temp.tmp_link_scope)"))
+        _insert_links(_SCOPE)
+        after = _scoped_links()
+        db.session.execute(text("DROP TABLE tmp_link_scope"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    moved = sum(1 for spend_id in before.keys() | after.keys() if before.get(spend_id) != after.get(spend_id))
+    print(f"🔗 Spend-material links refreshed for {len(ids)} materials: {moved} lines re-linked, "
+          f"{len(after)} of {len(before.keys() | after.keys())} checked linked in {time.time() - started:.2f}s")
+    return moved > 0 or any(material_id in ids for material_id, _ in after.values())
+
+
+def ensure_spend_material_links():
+    """Build the link table on databases that predate it (no-op once populated)"""
+    has_links = db.session.execute(text("SELECT 1 FROM spend_material_link LIMIT 1")).first()
+    has_spend = db.session.execute(text("SELECT 1 FROM spend_record LIMIT 1")).first()
+    if has_spend and not has_links:
+        rebuild_spend_material_links()
@@ -0,0 +1,120 @@
+"""
+Spend Date / Period Normalization
+=================================
+SpendRecord.po_date, month and year arrive from Excel as free-form strings
+(ISO timestamps, dd/mm/yyyy text, or raw Excel serial numbers). This module
+parses them once, vectorized, into typed columns that can be indexed and
+aggregated in SQL or the spend cube:
+
+    po_date_d     DATE     parsed PO date
+    period_month  INTEGER  yyyymm (e.g. 202404)
+    fiscal_year   INTEGER  fiscal year, labelled by the calendar year it ends in
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Fiscal year runs April -> March (FY2025 = Apr 2024 .. Mar 2025)
+FISCAL_YEAR_START_MONTH = 4
+
+# Excel serial day numbers (1900 date system) accepted as dates: 1982 .. 2173
+EXCEL_SERIAL_RANGE = (30000, 100000)
+EXCEL_EPOCH = '1899-12-30'
+
+
+def _parse_distinct(values):
+    """Parse an array of distinct raw po_date values into datetime64 (NaT when unparseable)"""
+    raw = pd.Series(values, dtype=object)
+    parsed = pd.Series(pd.NaT, index=raw.index, dtype='datetime64[ns]')
+
+    # Native datetimes (pd.read_excel usually yields Timestamps)
+    is_dt = raw.map(lambda v: isinstance(v, (pd.Timestamp, np.datetime64)) or hasattr(v, 'year'))
+    if is_dt.any():
+        parsed[is_dt] = pd.to_datetime(raw[is_dt], errors='coerce')
+
+    text_vals = raw[~is_dt].astype(str).str.strip()
+
+    # Excel serial numbers, as numbers or digit strings ("45123" / "45123.0")
+    numeric = pd.to_numeric(text_vals, errors='coerce')
+    is_serial = numeric.between(*EXCEL_SERIAL_RANGE)
+    if is_serial.any():
+        parsed[is_serial[is_serial].index] = pd.to_datetime(
+            numeric[is_serial].astype(int), unit='D', origin=EXCEL_EPOCH
+        )
+
+    # ISO strings first (unambiguous), then day-first text for the remainder
+    rest = text_vals[~is_serial & numeric.isna()]
+    if not rest.empty:
+        iso = pd.to_datetime(rest, format='ISO8601', errors='coerce')
+        parsed[iso.index] = iso
+        leftover = rest[iso.isna()]
+        if not leftover.empty:
+            parsed[leftover.index] = pd.to_datetime(leftover, format='mixed', dayfirst=True, errors='coerce')
+    return parsed.to_numpy()
+
+
+def parse_po_dates(po_dates):
+    """Vectorized po_date parsing; each distinct raw value is parsed only once"""
+    series = pd.Series(po_dates, dtype=object)
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+    parsed_uniques = _parse_distinct(np.asarray(uniques, dtype=object))
+    result = np.full(len(series), np.datetime64('NaT'), dtype='datetime64[ns]')
+    valid = codes >= 0
+    result[valid] = parsed_uniques[codes[valid]]
+    return pd.Series(result, index=series.index)
+
+
+def derive_period_columns(po_dates):
+    """DataFrame with po_date_d (datetime.date or None), period_month and fiscal_year (int or None)"""
+    dates = parse_po_dates(po_dates)
+    valid = dates.notna()
+    years = dates.dt.year
+    months = dates.dt.month
+    period = (years * 100 + months).astype('Int64')
+    if FISCAL_YEAR_START_MONTH > 1:
+        fiscal = (years + (months >= FISCAL_YEAR_START_MONTH).astype(int)).astype('Int64')
+    else:
+        fiscal = years.astype('Int64')
+    frame = pd.DataFrame({
+        'po_date_d': pd.Series(dates.dt.date, dtype=object).where(valid, None),
+        'period_month': pd.Series(period.tolist(), index=dates.index, dtype=object).where(valid, None),
+        'fiscal_year': pd.Series(fiscal.tolist(), index=dates.index, dtype=object).where(valid, None),
+    })
+    return frame
+
+
+def format_period(period_month):
+    """202404 -> '2024-04'"""
+    period_month = int(period_month)
+    return f"{period_month // 100:04d}-{period_month % 100:02d}"
+
+
+def backfill_period_columns(conn, batch_size=50000):
+    """Populate the typed period columns for rows that have a po_date but no po_date_d yet"""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text("""
+            SELECT id, po_date FROM spend_record
+            WHERE id > :last AND po_date IS NOT NULL AND po_date_d IS NULL
+            ORDER BY id LIMIT :n
+        """), {"last": last_id, "n": batch_size}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ids = [r[0] for r in rows]
+        periods = derive_period_columns([r[1] for r in rows])
+        params = [
+            {"id": i, "d": d.isoformat() if d else None, "p": int(p) if p is not None else None, "f": int(f) if f is not None else None}
+            for i, d, p, f in zip(ids, periods['po_date_d'], periods['period_month'], periods['fiscal_year'])
+            if d is not None
+        ]
+        if params:
+            conn.execute(text(
+                "UPDATE spend_record SET po_date_d = :d, period_month = :p, fiscal_year = :f WHERE id = :id"
+            ), params)
+        updated += len(params)
+    return updated
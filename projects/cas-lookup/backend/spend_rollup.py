@@ -0,0 +1,293 @@
+"""
+Spend Rollups
+=============
+Pre-aggregated spend at a few fixed grains, persisted in spend_rollup (one
+row per group, `rollup` naming the grain) and loaded into small in-memory
+cubes, so dashboard widgets aggregate thousands of groups instead of every
+PO line.
+
+    month_ou_vendor_item   period_month, operating_unit, vendor, item, enriched_description,
+                           payment_term, po_status (+ year, fiscal_year, item_category)
+    month_ou_vendor        period_month, operating_unit, vendor
+    month_ou_terms         period_month, operating_unit, payment_term, po_status
+    month_ou               period_month, operating_unit
+
+year / fiscal_year are carried in every grain so they can be filtered on.
+Each group stores TOTAL(amount), TOTAL(quantity), its line count and
+HyperLogLog sketches of its PO numbers and buyers (spend_sketch.py).
+
+Maintenance (spend_sync):
+    * ingest                          -> full rebuild, in SQL (coarse grains from the finest one)
+    * enrichment with known materials -> only the groups of those enriched_description
+                                         values; grains without that column are unaffected
+A data_version row records the spend version the rollups reflect; while it
+lags behind, the router answers from the raw spend cube and a rebuild is
+scheduled in the background.
+
+SpendQueryRouter answers each aggregate from the smallest rollup whose grain
+covers the filtered and grouped dimensions, falls back to the raw spend cube
+(RAW) otherwise, and records which source served each widget. Distinct
+counts of a grain dimension are exact; PO and buyer counts are estimated from
+the merged sketches of the selected groups (approximate; exact=True counts
+them on the raw spend cube instead).
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from models import db, SpendRollup
+from spend_cube import SpendCube, get_spend_cube
+from spend_sketch import decode, estimate
+from data_version import get_data_version, set_data_version, SPEND
+
+ROLLUP_MEASURES = ('amount', 'quantity', 'line_count')
+
+_PERIODS = ['period_month', 'year', 'fiscal_year']
+
+# Grain dimensions per rollup, finest first
+ROLLUPS = {
+    'month_ou_vendor_item': _PERIODS + ['operating_unit', 'vendor_name', 'item_category', 'item_description',
+                                        'enriched_description', 'payment_term', 'po_status'],
+    'month_ou_vendor': _PERIODS + ['operating_unit', 'vendor_name'],
+    'month_ou_terms': _PERIODS + ['operating_unit', 'payment_term', 'po_status'],
+    'month_ou': _PERIODS + ['operating_unit'],
+}
+FINEST_ROLLUP = 'month_ou_vendor_item'
+
+# Spend dimension -> spend_rollup column holding its distinct-count sketch
+ROLLUP_SKETCHES = {
+    'po_number': 'po_sketch',
+    'buyer_name': 'buyer_sketch',
+}
+
+# Source name reported when the raw spend cube answered
+RAW = 'spend_record'
+
+# data_version row: spend version the rollups were built from
+TABLE_SPEND = 'spend_rollup.spend'
+
+_rollup_cubes = None          # (spend version, {rollup: SpendCube})
+_cube_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+
+# ==========================================
+# BUILDING
+# ==========================================
+
+def _material_condition(materials, params):
+    """SQL condition matching enriched_description in materials (None matches NULL)"""
+    values = sorted(m for m in materials if m is not None)
+    clauses = []
+    if values:
+        names = [f"m{i}" for i in range(len(values))]
+        params.update(zip(names, values))
+        clauses.append(f"enriched_description IN ({', '.join(':' + n for n in names)})")
+    if None in materials:
+        clauses.append("enriched_description IS NULL")
+    return '(' + ' OR '.join(clauses) + ')' if clauses else '0'
+
+
+def _insert_rollup(name, materials=None):
+    """INSERT ... SELECT the groups of one rollup (only those of some materials, if given)"""
+    dims = ', '.join(ROLLUPS[name])
+    sketches = ', '.join(ROLLUP_SKETCHES.values())
+    params = {"rollup": name}
+    if name == FINEST_ROLLUP:
+        source, where = "spend_record", "1"
+        measures = ', '.join(["TOTAL(amount), TOTAL(quantity), COUNT(*)"]
+                             + [f"hll_sketch({dim})" for dim in ROLLUP_SKETCHES])
+    else:
+        # Coarser grains re-aggregate the finest one instead of scanning spend_record again
+        source, where = "spend_rollup", "rollup = :finest"
+        measures = ', '.join(["TOTAL(amount), TOTAL(quantity), SUM(line_count)"]
+                             + [f"hll_merge({column})" for column in ROLLUP_SKETCHES.values()])
+        params["finest"] = FINEST_ROLLUP
+    if materials is not None:
+        where += " AND " + _material_condition(materials, params)
+    db.session.execute(text(f"""
+        INSERT INTO spend_rollup (rollup, {dims}, amount, quantity, line_count, {sketches})
+        SELECT :rollup, {dims}, {measures} FROM {source} WHERE {where} GROUP BY {dims}
+    """), params)
+
+
+def rebuild_spend_rollups(spend_version=None):
+    """Recompute every rollup from spend_record in one transaction (requires an app context)"""
+    started = time.time()
+    # Read the source version first: changes during the build leave the rollups stale
+    version = get_data_version(SPEND) if spend_version is None else spend_version
+    db.session.execute(text("DELETE FROM spend_rollup"))
+    for name in ROLLUPS:
+        _insert_rollup(name)
+    set_data_version(TABLE_SPEND, version)
+    db.session.commit()
+    rows = db.session.execute(text("SELECT COUNT(*) FROM spend_rollup")).scalar()
+    print(f"📦 Spend rollups rebuilt: {rows} rows in {time.time() - started:.2f}s")
+    return rows
+
+
+def refresh_spend_rollups(materials, spend_version):
+    """
+    Recompute the groups of the given enriched_description values after the
+    spend version was bumped to spend_version. Rebuilds everything instead if
+    the rollups were not current before this change.
+    """
+    if get_data_version(TABLE_SPEND, default=-1) != spend_version - 1:
+        return rebuild_spend_rollups(spend_version)
+    materials = set(materials)
+    if materials:
+        for name, dims in ROLLUPS.items():
+            if 'enriched_description' not in dims:
+                continue
+            params = {"rollup": name}
+            db.session.execute(text(
+                f"DELETE FROM spend_rollup WHERE rollup = :rollup AND {_material_condition(materials, params)}"
+            ), params)
+            _insert_rollup(name, materials)
+    set_data_version(TABLE_SPEND, spend_version)
+    db.session.commit()
+    if materials:
+        print(f"📦 Spend rollups refreshed for {len(materials)} materials")
+    return len(materials)
+
+
+def schedule_rollup_rebuild(app):
+    """Rebuild in a background thread unless one is already running in this process"""
+    if not _rebuild_lock.acquire(blocking=False):
+        return False
+
+    def _run():
+        try:
+            with app.app_context():
+                rebuild_spend_rollups()
+        except Exception as e:
+            print(f"⚠️ Spend rollup rebuild failed: {e}")
+        finally:
+            _rebuild_lock.release()
+
+    threading.Thread(target=_run, daemon=True).start()
+    return True
+
+
+# ==========================================
+# IN-MEMORY ROLLUP CUBES
+# ==========================================
+
+def rollups_current():
+    return get_data_version(TABLE_SPEND, default=-1) == get_data_version(SPEND)
+
+
+def get_rollup_cubes():
+    """{rollup: SpendCube} of the persisted rollups, or None while they lag behind the spend data"""
+    global _rollup_cubes
+    version = get_data_version(SPEND)
+    if get_data_version(TABLE_SPEND, default=-1) != version:
+        return None
+    cached = _rollup_cubes
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _cube_lock:
+        cached = _rollup_cubes
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        started = time.time()
+        columns = (['rollup'] + list(ROLLUPS[FINEST_ROLLUP]) + list(ROLLUP_MEASURES)
+                   + list(ROLLUP_SKETCHES.values()))
+        rows = db.session.execute(db.select(*[getattr(SpendRollup, c) for c in columns])).fetchall()
+        frame = pd.DataFrame(rows, columns=columns)
+        cubes = {}
+        for name, dims in ROLLUPS.items():
+            groups = frame[frame['rollup'] == name]
+            cube = SpendCube.from_frame(groups, dimensions=dims, measure_names=ROLLUP_MEASURES)
+            cube.data_version = version
+            # dim -> (entries per group, all sketch entries concatenated in group order)
+            cube.sketches = {dim: _load_sketches(groups[column].tolist()) for dim, column in ROLLUP_SKETCHES.items()}
+            cubes[name] = cube
+        _rollup_cubes = (version, cubes)
+        print(f"📦 Spend rollup cubes loaded: {len(frame)} groups in {time.time() - started:.2f}s")
+        return cubes
+
+
+def _load_sketches(blobs):
+    lengths = np.fromiter((len(b) // 4 if b else 0 for b in blobs), dtype=np.int64, count=len(blobs))
+    return lengths, decode(b''.join(b for b in blobs if b))
+
+
+def sketch_distinct_count(cube, dim, mask=None):
+    """Estimated distinct values of a sketched dimension over the rollup groups in mask"""
+    lengths, entries = cube.sketches[dim]
+    if mask is not None:
+        entries = entries[np.repeat(mask, lengths)]
+    return estimate(entries)
+
+
+def rollup_stats():
+    """Rollup grains, group counts and freshness (diagnostics endpoint)"""
+    counts = dict(db.session.execute(text("SELECT rollup, COUNT(*) FROM spend_rollup GROUP BY rollup")).fetchall())
+    return {
+        "rollups": [{"name": name, "dimensions": dims, "groups": counts.get(name, 0)} for name, dims in ROLLUPS.items()],
+        "built_from_version": get_data_version(TABLE_SPEND, default=-1),
+        "spend_version": get_data_version(SPEND),
+        "current": rollups_current()
+    }
+
+
+# ==========================================
+# QUERY ROUTER
+# ==========================================
+
+class SpendQueryRouter:
+    """
+    Aggregates for one cube filter set, each from the smallest rollup whose
+    grain covers the filtered and grouped dimensions (the raw spend cube
+    otherwise). served_by maps widget name -> source name; approximate holds
+    the widgets answered from distinct-count sketches.
+    """
+
+    def __init__(self, filters, app=None, exact=False):
+        self.filters = filters
+        self.exact = exact
+        self.rollups = get_rollup_cubes()
+        if self.rollups is None and app is not None:
+            schedule_rollup_rebuild(app)
+        self.served_by = {}
+        self.approximate = set()
+        self._sources = {}
+
+    def covering_rollup(self, dims):
+        """Name of the smallest rollup containing every dim, or None"""
+        if self.rollups is None:
+            return None
+        needed = set(dims) | set(self.filters)
+        candidates = [name for name, grain in ROLLUPS.items() if needed <= set(grain)]
+        return min(candidates, key=lambda name: self.rollups[name].row_count, default=None)
+
+    def source(self, widgets, dims=()):
+        """(cube, mask) answering a query over dims; records the source for each widget name"""
+        name = self.covering_rollup(dims) or RAW
+        for widget in ([widgets] if isinstance(widgets, str) else widgets):
+            self.served_by[widget] = name
+        if name not in self._sources:
+            cube = get_spend_cube() if name == RAW else self.rollups[name]
+            self._sources[name] = (cube, cube.mask(self.filters))
+        return self._sources[name]
+
+    def total(self, widgets, measure='amount'):
+        cube, mask = self.source(widgets)
+        return cube.total(measure, mask)
+
+    def group_sum(self, widgets, dim, measure='amount', top=None):
+        cube, mask = self.source(widgets, [dim])
+        return cube.group_sum(dim, mask, measure=measure, top=top)
+
+    def distinct_count(self, widgets, dim):
+        if (not self.exact and dim in ROLLUP_SKETCHES and self.covering_rollup([dim]) is None
+                and self.covering_rollup(()) is not None):
+            cube, mask = self.source(widgets)
+            self.approximate.update([widgets] if isinstance(widgets, str) else widgets)
+            return sketch_distinct_count(cube, dim, mask)
+        # A rollup group exists only if it has at least one line: distinct groups = distinct values
+        cube, mask = self.source(widgets, [dim])
+        return cube.distinct_count(dim, mask)
@@ -0,0 +1,175 @@
+"""
+Full-Text Search (SQLite FTS5)
+==============================
+External-content FTS5 indexes over the text fields the spend table and the
+material spend-analysis endpoints search:
+
+    spend_fts     spend_record.vendor_name, item_description, po_number, enriched_description
+    material_fts  material_data.final_search_term, enriched_description, item_description
+
+Triggers keep both indexes in sync with every INSERT / UPDATE / DELETE, so
+enrichment and material edits need no extra calls. Bulk spend ingestion
+drops the spend_fts triggers and indexes its rows set-based (index_rows /
+unindex_rows), which is several times faster than row-by-row triggers. Search terms are
+turned into token-prefix queries ("acet anhy" matches "Acetic Anhydride") and
+results are ranked with bm25(). When the SQLite build lacks FTS5 the indexes
+are not created and callers fall back to ILIKE scans.
+"""
+
+import re
+from sqlalchemy import text, select, union, Integer, Float
+from models import db, SpendMaterialLink
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+# Extra prefix indexes make 2-4 character search-as-you-type prefixes cheap
+FTS_PREFIXES = "2 3 4"
+
+FTS_INDEXES = {
+    'spend_fts': ('spend_record', ['vendor_name', 'item_description', 'po_number', 'enriched_description']),
+    'material_fts': ('material_data', ['final_search_term', 'enriched_description', 'item_description']),
+}
+
+# unicode61 treats everything except letters and digits as separators
+_TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+_fts_available = None
+
+
+def _index_ddl(fts, table, columns):
+    cols = ', '.join(columns)
+    new_vals = ', '.join(f'new.{c}' for c in columns)
+    old_vals = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols}, content='{table}', content_rowid='id',
+                tokenize='{FTS_TOKENIZER}', prefix='{FTS_PREFIXES}')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_vals});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_vals});
+            END""",
+    ]
+
+
+def fts5_supported(conn):
+    try:
+        conn.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)"))
+        conn.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except Exception:
+        return False
+
+
+def create_search_indexes(conn):
+    """Create the FTS tables and triggers and index existing rows (used by db_migrations)"""
+    if not fts5_supported(conn):
+        print("⚠️ SQLite FTS5 not available - text search will use ILIKE scans")
+        return False
+    for fts, (table, columns) in FTS_INDEXES.items():
+        for ddl in _index_ddl(fts, table, columns):
+            conn.execute(text(ddl))
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    return True
+
+
+def index_rows(conn, fts, where, params=None):
+    """Add content rows matching `where` to an FTS index (bulk writes made with the sync triggers dropped)"""
+    table, columns = FTS_INDEXES[fts]
+    cols = ', '.join(columns)
+    conn.execute(text(f"INSERT INTO {fts}(rowid, {cols}) SELECT id, {cols} FROM {table} WHERE {where}"), params or {})
+
+
+def unindex_rows(conn, fts, where, params=None):
+    """Remove content rows matching `where` from an FTS index, before they are deleted or rewritten"""
+    table, columns = FTS_INDEXES[fts]
+    cols = ', '.join(columns)
+    conn.execute(text(f"INSERT INTO {fts}({fts}, rowid, {cols}) SELECT 'delete', id, {cols} FROM {table} "
+                      f"WHERE {where}"), params or {})
+
+
+def rebuild_search_indexes():
+    """Re-index from the content tables (repair after writes that bypassed the triggers)"""
+    for fts in FTS_INDEXES:
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def search_available():
+    """True once both FTS tables exist (checked once per process)"""
+    global _fts_available
+    if not _fts_available:
+        found = db.session.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('spend_fts', 'material_fts')"
+        )).scalar()
+        _fts_available = found == len(FTS_INDEXES)
+    return _fts_available
+
+
+def fts_match_query(term, column=None):
+    """
+    Build an FTS5 MATCH expression from free text: every word becomes a
+    prefix phrase of its tokens ("64-17-5" -> "64 17 5"*), words are ANDed.
+    Returns None when the term has no searchable tokens.
+    """
+    phrases = []
+    for word in (term or '').split():
+        tokens = _TOKEN_RE.findall(word.lower())
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    if not phrases:
+        return None
+    query = ' '.join(phrases)
+    return f"{column} : ({query})" if column else query
+
+
+# ==========================================
+# QUERY BUILDING BLOCKS
+# ==========================================
+
+def _fts_rowids(fts, match):
+    return select(text('rowid')).select_from(text(fts)).where(
+        text(f"{fts} MATCH :{fts}_q").bindparams(**{f'{fts}_q': match})
+    )
+
+
+def material_match_ids(term, column=None):
+    """Select of material_data ids matching term (optionally within one indexed column)"""
+    match = fts_match_query(term, column)
+    return _fts_rowids('material_fts', match) if match else None
+
+
+def spend_match_ids(term, linked=True):
+    """
+    Select of spend_record ids matching term in the spend text fields or, unless
+    linked=False, in the enriched description of the linked material (spend_material_link).
+    """
+    match = fts_match_query(term)
+    if not match:
+        return None
+    if not linked:
+        return _fts_rowids('spend_fts', match)
+    linked = select(SpendMaterialLink.spend_id).where(
+        SpendMaterialLink.material_id.in_(material_match_ids(term, 'enriched_description'))
+    )
+    return union(_fts_rowids('spend_fts', match), linked)
+
+
+def spend_relevance(term):
+    """Subquery (id, rank) of direct spend_fts matches; lower bm25 rank = more relevant"""
+    match = fts_match_query(term)
+    return text(
+        "SELECT rowid AS id, bm25(spend_fts) AS rank FROM spend_fts WHERE spend_fts MATCH :spend_rank_q"
+    ).bindparams(spend_rank_q=match).columns(id=Integer, rank=Float).subquery('spend_rank')
+
+
+def material_relevance(term):
+    """Subquery (id, rank) of material_fts matches"""
+    match = fts_match_query(term)
+    return text(
+        "SELECT rowid AS id, bm25(material_fts) AS rank FROM material_fts WHERE material_fts MATCH :material_rank_q"
+    ).bindparams(material_rank_q=match).columns(id=Integer, rank=Float).subquery('material_rank')
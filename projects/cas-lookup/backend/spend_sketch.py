@@ -0,0 +1,125 @@
+"""
+Distinct-Count Sketches
+=======================
+HyperLogLog sketches of the PO numbers and buyers behind each spend rollup
+group (spend_rollup.po_sketch / buyer_sketch), so distinct-count KPIs over
+any filter combination a rollup covers are answered by merging the sketches
+of the selected groups instead of scanning the PO lines.
+
+A sketch has 2^HLL_PRECISION registers; each value is hashed to 64 bits
+(blake2b, stable across processes), the low bits pick a register and the
+register keeps the highest rank (leading zeros + 1) seen. Sketches are
+stored sparse: a sorted little-endian uint32 array of (register << 6 | rank),
+at most one entry per register, so a group with a handful of POs costs a few
+bytes. Merging is a register-wise maximum, which makes sketches mergeable
+across groups, rollups and filters in any order.
+
+Error bound: the standard error of an estimate is 1.04 / sqrt(2^HLL_PRECISION)
+(HLL_STANDARD_ERROR, 0.81 % at precision 14), i.e. 99 % of estimates are
+within about 2.1 % of the true count; small counts (below ~2.5 x the register
+count) use linear counting and are practically exact.
+
+SQLite gets two aggregate functions on every connection, used by the rollup
+INSERT ... SELECT statements:
+    hll_sketch(value)   sketch of the non-NULL values of a group
+    hll_merge(sketch)   union of sketches
+"""
+
+import hashlib
+import math
+import sqlite3
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HLL_PRECISION = 14
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_STANDARD_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+
+_RANK_BITS = 6
+_RANK_MASK = (1 << _RANK_BITS) - 1
+_HASH_BITS = 64 - HLL_PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+
+def _entry(value):
+    """Sparse entry (register << 6 | rank) of one value"""
+    h = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+    rest = h >> HLL_PRECISION
+    return ((h & (HLL_REGISTERS - 1)) << _RANK_BITS) | (_HASH_BITS - rest.bit_length() + 1)
+
+
+def _compact(entries):
+    """Sorted entries with only the highest rank per register"""
+    entries = np.unique(entries)
+    if len(entries) > 1:
+        registers = entries >> _RANK_BITS
+        entries = entries[np.append(registers[1:] != registers[:-1], True)]
+    return entries
+
+
+def encode(entries):
+    """Sketch bytes of a uint32 entry array (None for an empty sketch)"""
+    entries = _compact(np.asarray(entries, dtype=np.uint32))
+    return entries.astype('<u4').tobytes() if len(entries) else None
+
+
+def decode(sketch):
+    return np.frombuffer(sketch, dtype='<u4') if sketch else np.empty(0, dtype=np.uint32)
+
+
+def estimate(entries):
+    """Estimated distinct count of a uint32 entry array (entries of several sketches may repeat)"""
+    if len(entries) == 0:
+        return 0
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    np.maximum.at(registers, entries >> _RANK_BITS, (entries & _RANK_MASK).astype(np.uint8))
+    raw = _ALPHA * HLL_REGISTERS * HLL_REGISTERS / float(np.ldexp(1.0, -registers.astype(np.int32)).sum())
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * HLL_REGISTERS and zeros:
+        # Linear counting for small cardinalities
+        return int(round(HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)))
+    return int(round(raw))
+
+
+# ==========================================
+# SQLITE AGGREGATES
+# ==========================================
+
+class _SketchAggregate:
+    def __init__(self):
+        self.entries = {}
+
+    def step(self, value):
+        if value is None:
+            return
+        entry = _entry(value)
+        register = entry >> _RANK_BITS
+        if entry > self.entries.get(register, 0):
+            self.entries[register] = entry
+
+    def finalize(self):
+        return encode(list(self.entries.values())) if self.entries else None
+
+
+class _MergeAggregate:
+    def __init__(self):
+        self.sketches = []
+
+    def step(self, sketch):
+        if sketch:
+            self.sketches.append(sketch)
+
+    def finalize(self):
+        if not self.sketches:
+            return None
+        if len(self.sketches) == 1:
+            return self.sketches[0]
+        return encode(decode(b''.join(self.sketches)))
+
+
+@event.listens_for(Engine, "connect")
+def register_sketch_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_aggregate('hll_sketch', 1, _SketchAggregate)
+        dbapi_connection.create_aggregate('hll_merge', 1, _MergeAggregate)
@@ -0,0 +1,269 @@
+"""
+Columnar Snapshots
+==================
+Parquet snapshots of the spend and material tables, so a new environment or
+an analytics notebook starts from columnar files instead of re-parsing the
+Purchase History workbook or scanning SQLite:
+
+    <SNAPSHOT_DIR>/snapshot_<timestamp>/
+        manifest.json              tables, row counts, schema / data version
+        material_data/part-0.parquet
+        material_parameter/part-0.parquet
+        spend_material_link/part-0.parquet
+        spend_record/fiscal_year=2024/operating_unit=OU%20India/part-0.parquet
+
+spend_record is hive-partitioned by fiscal year and operating unit: readers
+filtering on them open only the matching files, and every reader loads only
+the columns it asks for.
+
+    write_snapshot       each table read in SNAPSHOT_BATCH_ROWS batches with the
+                         driver cursor and written as Arrow record batches
+    restore_snapshot     replaces the tables' contents in one transaction: rows
+                         keep their ids, secondary indexes and FTS triggers are
+                         dropped and rebuilt once, then derived spend data is
+                         synced (links, sites, rollups)
+    snapshot_cube        SpendCube straight from the files, no database needed
+
+spend_material_link is derived (spend_links.py): it is snapshotted so a cube
+can be built from the files alone, and rebuilt rather than restored.
+Requires pyarrow.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from sqlalchemy import text
+from models import db, SpendRecord, MaterialData, MaterialParameter, SpendMaterialLink
+from spend_export import arrow_type
+from spend_search import FTS_INDEXES
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+SNAPSHOT_BATCH_ROWS = int(os.environ.get('SNAPSHOT_BATCH_ROWS', 100000))
+MANIFEST = 'manifest.json'
+
+# Restore order: materials before the spend lines and links referencing them
+SNAPSHOT_TABLES = {
+    'material_data': MaterialData,
+    'material_parameter': MaterialParameter,
+    'spend_record': SpendRecord,
+    'spend_material_link': SpendMaterialLink,
+}
+SNAPSHOT_PARTITIONS = {'spend_record': ['fiscal_year', 'operating_unit']}
+DERIVED_TABLES = {'spend_material_link'}
+
+
+def snapshot_available():
+    return pa is not None
+
+
+def table_key(name):
+    return SNAPSHOT_TABLES[name].__table__.primary_key.columns.values()[0].name
+
+
+def table_schema(name):
+    """Arrow schema of a snapshot table, from its model columns"""
+    return pa.schema([(column.name, arrow_type(column)) for column in SNAPSHOT_TABLES[name].__table__.columns])
+
+
+def _partitioning(name):
+    columns = SNAPSHOT_PARTITIONS.get(name)
+    if not columns:
+        return None
+    schema = table_schema(name)
+    return ds.partitioning(pa.schema([schema.field(column) for column in columns]), flavor='hive')
+
+
+def _arrow_array(values, field):
+    """Arrow array of one column of SQLite rows (dates and datetimes are ISO text there)"""
+    if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+        return pa.array(values, pa.string()).cast(field.type)
+    if pa.types.is_boolean(field.type):
+        return pa.array(values, pa.int64()).cast(pa.bool_())
+    try:
+        return pa.array(values, field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # SQLite keeps whatever was written: 12 in a TEXT column, 'N/A' in a REAL one
+        if pa.types.is_string(field.type):
+            return pa.array([None if v is None else str(v) for v in values], pa.string())
+        return pa.array([v if isinstance(v, (int, float)) else None for v in values], field.type)
+
+
+def _record_batches(conn, name, schema, counts):
+    result = conn.exec_driver_sql(f"SELECT {', '.join(schema.names)} FROM {name} ORDER BY {table_key(name)}")
+    while True:
+        rows = result.fetchmany(SNAPSHOT_BATCH_ROWS)
+        if not rows:
+            break
+        counts[name] += len(rows)
+        arrays = [_arrow_array(list(values), field) for values, field in zip(zip(*rows), schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def write_snapshot(path=None):
+    """Snapshot every SNAPSHOT_TABLES table into a new directory (default under SNAPSHOT_DIR); returns the manifest"""
+    from db_migrations import MIGRATIONS
+    from data_version import get_data_version, SPEND
+
+    started = time.time()
+    path = path or os.path.join(SNAPSHOT_DIR, f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    if os.path.isdir(path) and os.listdir(path):
+        raise ValueError(f"Snapshot directory {path} is not empty")
+    os.makedirs(path, exist_ok=True)
+    conn = db.session.connection()
+    counts = {name: 0 for name in SNAPSHOT_TABLES}
+    tables = {}
+    for name in SNAPSHOT_TABLES:
+        table_started = time.time()
+        schema = table_schema(name)
+        ds.write_dataset(
+            pa.RecordBatchReader.from_batches(schema, _record_batches(conn, name, schema, counts)),
+            os.path.join(path, name), format='parquet', partitioning=_partitioning(name),
+            basename_template='part-{i}.parquet', existing_data_behavior='overwrite_or_ignore',
+            file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+        )
+        tables[name] = {"rows": counts[name], "seconds": round(time.time() - table_started, 2)}
+    manifest = {
+        "name": os.path.basename(path),
+        "created_at": datetime.utcnow().isoformat(),
+        "schema_version": MIGRATIONS[-1][0],
+        "spend_data_version": get_data_version(SPEND),
+        "partitioning": SNAPSHOT_PARTITIONS,
+        "tables": tables,
+        "bytes": _directory_bytes(path),
+        "seconds": round(time.time() - started, 2),
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    rows = ', '.join(f"{info['rows']} {name}" for name, info in tables.items())
+    print(f"📸 Snapshot {manifest['name']}: {rows} ({manifest['bytes'] / 1024 / 1024:.1f} MB) "
+          f"in {manifest['seconds']:.1f}s")
+    return dict(manifest, path=path)
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as handle:
+        return json.load(handle)
+
+
+def list_snapshots(directory=None):
+    """Manifests of the snapshots under SNAPSHOT_DIR, newest first"""
+    directory = directory or SNAPSHOT_DIR
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((n for n in os.listdir(directory) if os.path.isfile(os.path.join(directory, n, MANIFEST))),
+                   reverse=True)
+    return [dict(read_manifest(os.path.join(directory, n)), path=os.path.join(directory, n)) for n in names]
+
+
+def read_snapshot_table(path, name, columns=None, filters=None):
+    """
+    pa.Table of one snapshot table. filters: {column: value | [values]}; on
+    the partition columns they skip whole files.
+    """
+    directory = os.path.join(path, name)
+    if not os.path.isdir(directory):
+        # Tables that were empty when snapshotted have no files
+        schema = table_schema(name)
+        return schema.empty_table().select(columns) if columns else schema.empty_table()
+    dataset = ds.dataset(directory, format='parquet', partitioning=_partitioning(name))
+    expression = None
+    for column, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        term = ds.field(column).isin(list(values))
+        expression = term if expression is None else expression & term
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def _sqlite_values(array):
+    """Python values of an Arrow column as SQLAlchemy stores them in SQLite"""
+    if pa.types.is_timestamp(array.type) or pa.types.is_date(array.type):
+        # 'yyyy-mm-dd hh:mm:ss.ffffff' / 'yyyy-mm-dd', the SQLite DateTime / Date formats
+        array = array.cast(pa.string())
+    return array.to_pylist()
+
+
+def _replace_table(conn, name, table):
+    """Swap a table's rows for a snapshot's, in id order with indexes and triggers rebuilt once"""
+    dropped = conn.execute(text(
+        "SELECT name, type, sql FROM sqlite_master WHERE tbl_name = :table AND type IN ('index', 'trigger') "
+        "AND sql IS NOT NULL"), {"table": name}).fetchall()
+    for index, kind, _ in dropped:
+        conn.execute(text(f'DROP {kind.upper()} "{index}"'))
+    conn.execute(text(f"DELETE FROM {name}"))
+
+    # Columns added after the snapshot was taken keep their defaults
+    columns = [c.name for c in SNAPSHOT_TABLES[name].__table__.columns if c.name in table.column_names]
+    statement = f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    for batch in table.select(columns).sort_by(table_key(name)).to_batches(SNAPSHOT_BATCH_ROWS):
+        conn.exec_driver_sql(statement, list(zip(*(_sqlite_values(column) for column in batch.columns))))
+
+    for fts, (content, _) in FTS_INDEXES.items():
+        if content == name and conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :fts"), {"fts": fts}).first():
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    for _, _, ddl in dropped:
+        conn.execute(text(ddl))
+    conn.execute(text("PRAGMA analysis_limit = 1000"))
+    conn.execute(text(f"ANALYZE {name}"))
+    return table.num_rows
+
+
+def restore_snapshot(path, tables=None):
+    """
+    Replace the contents of the snapshot's tables (default: all but the
+    derived link table) in one transaction, then sync derived spend data.
+    Returns {table: rows restored}.
+    """
+    from spend_sync import after_spend_ingest
+
+    manifest = read_manifest(path)
+    names = [name for name in SNAPSHOT_TABLES if name not in DERIVED_TABLES]
+    if tables:
+        unknown = set(tables) - set(names)
+        if unknown:
+            raise ValueError(f"Cannot restore {', '.join(sorted(unknown))} (tables: {', '.join(names)})")
+        names = [name for name in names if name in tables]
+    started = time.time()
+    counts = {}
+    try:
+        conn = db.session.connection()
+        # Links point at the rows being replaced and are rebuilt by the sync below. Deleting them
+        # first also opens the transaction, so the index / trigger drops roll back with it
+        conn.execute(text("DELETE FROM spend_material_link"))
+        for name in names:
+            counts[name] = _replace_table(conn, name, read_snapshot_table(path, name))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    print(f"♻️ Restored snapshot {manifest['name']}: {', '.join(f'{n} {name}' for name, n in counts.items())} "
+          f"in {time.time() - started:.1f}s")
+    after_spend_ingest()
+    return counts
+
+
+def snapshot_cube(path, filters=None):
+    """SpendCube over a snapshot's files; filters on fiscal_year / operating_unit read only those partitions"""
+    from spend_cube import SpendCube, CUBE_DIMENSIONS, CUBE_MEASURES
+
+    linked = {'material_description', 'match_type'}
+    columns = ['id'] + [dim for dim in CUBE_DIMENSIONS if dim not in linked] + list(CUBE_MEASURES)
+    spend = read_snapshot_table(path, 'spend_record', columns, filters).sort_by('id').to_pandas()
+    links = read_snapshot_table(path, 'spend_material_link').to_pandas()
+    materials = read_snapshot_table(path, 'material_data', ['id', 'enriched_description']).to_pandas()
+    links = links.merge(materials.rename(columns={'id': 'material_id', 'enriched_description': 'material_description'}),
+                        on='material_id', how='left')
+    frame = spend.merge(links[['spend_id', 'material_description', 'match_type']],
+                        left_on='id', right_on='spend_id', how='left')
+    return SpendCube.from_frame(frame)
@@ -0,0 +1,74 @@
+"""
+Spend Derived-Data Sync
+=======================
+Single place that keeps structures derived from spend_record / material_data
+(link table, site locations, data version, spend_rollup, in-memory cube,
+result cache, material_risk) consistent after the base tables change.
+
+Callers that know which enriched_description values their change touched pass
+them as `materials` so only those material_risk rows are recomputed; without
+it the table is left stale and rebuilt in full on the next risk-analysis read.
+Ingestion always rebuilds spend_rollup in full; enrichment refreshes only the
+rollup groups of the given materials. Bulk material loads rebuild every
+spend link; edits of single materials recompute only the links touching them.
+"""
+
+from flask import current_app, has_app_context
+from models import db
+from spend_links import rebuild_spend_material_links, refresh_spend_material_links
+from spend_cube import refresh_loaded_spend_cube
+from data_version import bump_data_version, SPEND
+from result_cache import spend_result_cache, prewarm_spend_cache
+from risk_table import refresh_material_risks
+from spend_rollup import rebuild_spend_rollups, refresh_spend_rollups
+from site_geocoding import sync_site_locations
+
+
+def _spend_changed(materials=None, rebuild_rollups=False):
+    """Bump the spend data version, then refresh spend_rollup, in-process caches and material_risk"""
+    version = bump_data_version(SPEND)
+    try:
+        if rebuild_rollups or materials is None:
+            rebuild_spend_rollups(version)
+        else:
+            refresh_spend_rollups(materials, version)
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ spend_rollup refresh failed (raw spend serves until rebuilt): {e}")
+    refresh_loaded_spend_cube()
+    if materials is not None:
+        try:
+            refresh_material_risks(materials, version)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ material_risk refresh failed (full rebuild on next read): {e}")
+    spend_result_cache.clear()
+    if has_app_context():
+        prewarm_spend_cache(current_app._get_current_object())
+
+
+def after_spend_ingest(materials=None):
+    """Call after SpendRecord rows are inserted, replaced or deleted (materials: their enriched descriptions)"""
+    rebuild_spend_material_links()
+    # New supplier sites must be located before material risk is recomputed
+    sync_site_locations()
+    _spend_changed(materials, rebuild_rollups=True)
+
+
+def after_spend_enrichment(materials=None):
+    """Call after enriched_description / cas_number change on SpendRecord (materials: old and new values)"""
+    rebuild_spend_material_links()
+    _spend_changed(materials)
+
+
+def after_material_change():
+    """Call after MaterialData rows (or their CAS / enriched description) change"""
+    rebuild_spend_material_links()
+    # Risk is computed from spend_record alone: no material_risk rows change
+    _spend_changed(materials=())
+
+
+def after_material_edit(material_ids):
+    """Call after edits of single MaterialData rows: only the spend links touching them are recomputed"""
+    if refresh_spend_material_links(material_ids):
+        _spend_changed(materials=())
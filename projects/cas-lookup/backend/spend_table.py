@@ -0,0 +1,207 @@
+"""
+Spend Table Pagination
+======================
+Keyset (cursor) pagination for /api/spend-analysis/table.
+
+Pages are fetched with ORDER BY <sort column>, id and a WHERE condition that
+continues after the last row of the previous page, so every page is an index
+range scan of per_page rows regardless of depth (OFFSET scans and discards
+every preceding row). Cursors are opaque url-safe tokens carrying the sort
+key, the boundary (value, id) and the direction.
+
+Total counts come from the spend cube for plain filter sets and from a capped
+SQL count for text searches; both are cached per filter set and data version.
+"""
+
+import base64
+import json
+from datetime import date
+from sqlalchemy import and_, or_, tuple_, func
+from models import db, SpendRecord, MaterialData, SpendMaterialLink
+from spend_aggregation import cube_filters, apply_spend_filters
+from spend_search import search_available, fts_match_query, spend_match_ids, spend_relevance
+from spend_cube import get_spend_cube
+from data_version import get_data_version, SPEND
+from result_cache import ResultCache
+from spend_export import NOT_ENRICHED
+
+# Whitelisted sort keys -> indexed SpendRecord column (see ix_spend_record_*), except
+# enriched_description: the table shows the linked material's, so it sorts by that
+SORT_COLUMNS = {
+    'amount': SpendRecord.amount,
+    'quantity': SpendRecord.quantity,
+    'po_date': SpendRecord.po_date_d,
+    'po_date_d': SpendRecord.po_date_d,
+    'po_number': SpendRecord.po_number,
+    'vendor_name': SpendRecord.vendor_name,
+    'operating_unit': SpendRecord.operating_unit,
+    'item_description': SpendRecord.item_description,
+    'enriched_description': func.coalesce(MaterialData.enriched_description, NOT_ENRICHED),
+}
+DATE_SORT_KEYS = {'po_date', 'po_date_d'}
+
+# Text searches may also sort by bm25 relevance (see spend_search.py)
+RELEVANCE_SORT = 'relevance'
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+# Searches stop counting here and report total_is_estimate=True
+APPROX_COUNT_CAP = 10000
+
+table_count_cache = ResultCache(max_bytes=1024 * 1024, max_entries=1024)
+
+
+# ==========================================
+# QUERY
+# ==========================================
+
+def uses_fts(search):
+    """True when a table search runs on the FTS5 indexes (else ILIKE scans)"""
+    return bool(search) and search_available() and fts_match_query(search) is not None
+
+
+def table_query(*entities):
+    """Query over spend_record outer-joined to its linked material (MaterialData), as the table lists it"""
+    return db.session.query(*entities).outerjoin(
+        SpendMaterialLink, SpendMaterialLink.spend_id == SpendRecord.id
+    ).outerjoin(
+        MaterialData, MaterialData.id == SpendMaterialLink.material_id
+    )
+
+
+def filter_table_query(query, filters, search, sort_by):
+    """
+    Apply the table's text search and filters to a table_query().
+    Returns (query, count_query, sort_col): when sorting by relevance sort_col
+    is the ranking expression and count_query the direct-match query to count;
+    otherwise both are None.
+    """
+    use_fts = uses_fts(search)
+    sort_col = None
+    count_query = None
+    if use_fts and sort_by == RELEVANCE_SORT:
+        # Ranked direct spend_fts matches drive the query; bm25 is lower-is-better,
+        # so negate it and 'desc' lists the best matches first
+        rank = spend_relevance(search)
+        count_query = apply_spend_filters(query.filter(SpendRecord.id.in_(spend_match_ids(search, linked=False))), filters)
+        query = query.join(rank, rank.c.id == SpendRecord.id)
+        sort_col = -rank.c.rank
+    elif use_fts:
+        # FTS5 token-prefix match on spend text fields + linked material description
+        query = query.filter(SpendRecord.id.in_(spend_match_ids(search)))
+    elif search:
+        query = query.filter(db.or_(
+            SpendRecord.vendor_name.ilike(f'%{search}%'),
+            SpendRecord.item_description.ilike(f'%{search}%'),
+            SpendRecord.po_number.ilike(f'%{search}%'),
+            MaterialData.enriched_description.ilike(f'%{search}%')
+        ))
+    return apply_spend_filters(query, filters), count_query, sort_col
+
+
+def validate_sort(sort_by, search):
+    """Error message for an unsupported sort key, else None"""
+    if sort_by not in SORT_COLUMNS and not (sort_by == RELEVANCE_SORT and uses_fts(search)):
+        return f"Unsupported sort_by '{sort_by}'. Allowed: {', '.join(sorted(SORT_COLUMNS))}"
+    return None
+
+
+# ==========================================
+# CURSORS
+# ==========================================
+
+def encode_cursor(sort_key, ascending, value, row_id, direction):
+    if isinstance(value, date):
+        value = value.isoformat()
+    payload = {"s": sort_key, "a": ascending, "v": value, "id": row_id, "d": direction}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort_key, ascending):
+    """(value, id, direction) of a cursor; ValueError if it is malformed or from another sort"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        value, row_id, direction = payload["v"], int(payload["id"]), payload["d"]
+        if payload["s"] != sort_key or payload["a"] != ascending or direction not in ('next', 'prev'):
+            raise ValueError
+        if value is not None and sort_key in DATE_SORT_KEYS:
+            value = date.fromisoformat(value)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid or stale cursor for this sort order")
+    return value, row_id, direction
+
+
+def _after(col, value, row_id, ascending):
+    """
+    Rows strictly after (value, id) in ORDER BY col, id [ASC|DESC], following
+    SQLite's NULL placement (NULLs sort first ascending, last descending).
+    """
+    if ascending:
+        if value is None:
+            return or_(and_(col.is_(None), SpendRecord.id > row_id), col.isnot(None))
+        return tuple_(col, SpendRecord.id) > tuple_(value, row_id)
+    if value is None:
+        return and_(col.is_(None), SpendRecord.id < row_id)
+    return or_(tuple_(col, SpendRecord.id) < tuple_(value, row_id), col.is_(None))
+
+
+# ==========================================
+# PAGES
+# ==========================================
+
+def fetch_page(query, sort_key, ascending, per_page, cursor=None, page=1, sort_col=None):
+    """
+    Fetch one page of a (SpendRecord, ...) query.
+
+    With a cursor the page is located by keyset; without one the legacy page
+    number is honoured via OFFSET (first page and direct page jumps only).
+    sort_col overrides the whitelisted column (e.g. a relevance expression).
+    Returns (rows, next_cursor, prev_cursor); each row ends with a sort_value column.
+    """
+    col = SORT_COLUMNS[sort_key] if sort_col is None else sort_col
+    query = query.add_columns(col.label('sort_value'))
+    forward = True
+    if cursor:
+        value, row_id, direction = decode_cursor(cursor, sort_key, ascending)
+        forward = direction == 'next'
+        query = query.filter(_after(col, value, row_id, ascending if forward else not ascending))
+    scan_ascending = ascending if forward else not ascending
+    if scan_ascending:
+        query = query.order_by(col.asc(), SpendRecord.id.asc())
+    else:
+        query = query.order_by(col.desc(), SpendRecord.id.desc())
+    offset = 0 if cursor else (page - 1) * per_page
+    rows = query.offset(offset).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    def cursor_at(row, direction):
+        return encode_cursor(sort_key, ascending, row.sort_value, row[0].id, direction)
+
+    has_next = more if forward else True
+    has_prev = (bool(cursor) or offset > 0) if forward else more
+    next_cursor = cursor_at(rows[-1], 'next') if rows and has_next else None
+    prev_cursor = cursor_at(rows[0], 'prev') if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
+
+
+def table_total(query, filters, search, direct_only=False):
+    """(total, is_estimate) for the table's filter set, cached per data version"""
+    key = ('table-count', tuple(sorted(filters.items())), search, direct_only, get_data_version(SPEND))
+    cached = table_count_cache.get(key)
+    if cached is not None:
+        return tuple(json.loads(cached))
+
+    if not search:
+        # Plain filters are all cube dimensions: exact count without touching SQL
+        cube = get_spend_cube()
+        result = (cube.count(cube.mask(cube_filters(filters))), False)
+    else:
+        matched = query.order_by(None).with_entities(SpendRecord.id).limit(APPROX_COUNT_CAP + 1).count()
+        result = (min(matched, APPROX_COUNT_CAP), matched > APPROX_COUNT_CAP)
+    table_count_cache.put(key, json.dumps(result).encode())
+    return result
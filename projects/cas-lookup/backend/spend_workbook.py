@@ -0,0 +1,276 @@
+"""
+Spend Workbook Reader
+=====================
+Streams Purchase History extracts into cleaned spend_record batches without
+loading a whole workbook first (pd.read_excel builds every row as Python
+objects, then a frame of them, before the first row is cleaned):
+
+    xlsx / xlsm  openpyxl read_only + iter_rows(values_only): parses the
+                 sheet XML as it goes, memory stays flat
+                 python-calamine when installed, for workbooks up to
+                 WORKBOOK_CALAMINE_MAX_MB: a native parser ~5x faster, but it
+                 holds the whole sheet in memory (~15x the file size)
+    csv          pd.read_csv in chunks
+
+Rows are collected in WORKBOOK_BATCH_ROWS batches and each batch is mapped
+and cleaned (spend_ingest.clean_spend_frame) as soon as it is full, so only
+one batch of raw cells is alive at a time next to the compact cleaned
+columns. A source is one sheet of one file: a directory expands to its
+extracts and sheet_name=None to every sheet of a workbook.
+
+iter_spend_sources yields the cleaned batches of all sources in order as
+they are read: append / replace loads insert each one as it arrives
+(spend_ingest.insert_spend_batches, one transaction: SQLite has a single
+writer), so memory stays at about one batch. read_spend_sources collects
+them into one frame for a delta, which needs the complete extract. Several
+sources are read in INGEST_WORKERS processes, each sending back its batches
+once the whole source is read.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import pandas as pd
+from openpyxl import load_workbook
+from spend_ingest import clean_spend_frame, line_keys, resolve_columns
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WORKBOOK_BATCH_ROWS = int(os.environ.get('WORKBOOK_BATCH_ROWS', 20000))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+# 'calamine' / 'openpyxl'; empty picks by file size
+WORKBOOK_ENGINE = os.environ.get('WORKBOOK_ENGINE', '')
+WORKBOOK_CALAMINE_MAX_MB = float(os.environ.get('WORKBOOK_CALAMINE_MAX_MB', 50))
+
+SPEND_EXTENSIONS = ('.xlsx', '.xlsm', '.csv')
+
+
+def workbook_engine(path):
+    """'csv', 'calamine' or 'openpyxl' for an extract"""
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    if WORKBOOK_ENGINE:
+        return WORKBOOK_ENGINE
+    if CalamineWorkbook is not None and os.path.getsize(path) <= WORKBOOK_CALAMINE_MAX_MB * 1024 * 1024:
+        return 'calamine'
+    return 'openpyxl'
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished workers, in MB (None without resource)"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+
+def sheet_names(path):
+    engine = workbook_engine(path)
+    if engine == 'csv':
+        return [None]
+    if engine == 'calamine':
+        return CalamineWorkbook.from_path(path).sheet_names
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def spend_sources(path, sheet_name=0):
+    """
+    [(file, sheet)] for an extract or a directory of extracts (sorted, Excel
+    lock files skipped). sheet_name: index or name of one sheet, None for all.
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                 if name.lower().endswith(SPEND_EXTENSIONS) and not name.startswith('~$')]
+    else:
+        files = [path]
+    sources = []
+    for file in files:
+        names = sheet_names(file)
+        if sheet_name is None:
+            sources.extend((file, name) for name in names)
+        elif isinstance(sheet_name, int):
+            sources.append((file, names[sheet_name]))
+        elif sheet_name in names or names == [None]:
+            sources.append((file, sheet_name))
+        else:
+            raise ValueError(f"No sheet '{sheet_name}' in {os.path.basename(file)}")
+    return sources
+
+
+def _header_labels(row):
+    """Column labels like pd.read_excel: blank -> 'Unnamed: i', repeats -> 'LABEL.1'"""
+    labels, seen = [], {}
+    for i, value in enumerate(row):
+        label = f"Unnamed: {i}" if value is None or value == '' else value
+        if label in seen:
+            seen[label] += 1
+            label = f"{label}.{seen[label]}"
+        else:
+            seen[label] = 0
+        labels.append(label)
+    return labels
+
+
+def _openpyxl_rows(path, sheet):
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet = workbook[sheet]
+        # The stored dimension is often wrong for ERP exports: read every cell
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        yield header
+        width = len(header)
+        for row in worksheet.iter_rows(min_row=2, max_col=width, values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+def _native_dates(frame):
+    """Date-only cells (calamine) as datetimes, so po_date text matches what openpyxl / pandas yield"""
+    for label in frame.columns:
+        values = frame[label]
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        is_date = [isinstance(v, date) and not isinstance(v, datetime) for v in uniques]
+        if any(is_date):
+            converted = pd.Series([datetime.combine(v, datetime.min.time()) if d else v
+                                   for v, d in zip(uniques, is_date)] + [None], dtype=object)
+            frame[label] = converted.to_numpy()[codes]
+    return frame
+
+
+def iter_source_frames(path, sheet, batch_rows=None):
+    """Raw object frames of at most batch_rows rows; the first row of a sheet is the header"""
+    batch_rows = batch_rows or WORKBOOK_BATCH_ROWS
+    engine = workbook_engine(path)
+    if engine == 'csv':
+        yield from pd.read_csv(path, dtype=object, keep_default_na=True, chunksize=batch_rows)
+        return
+    if engine == 'calamine':
+        rows = iter(CalamineWorkbook.from_path(path).get_sheet_by_name(sheet).iter_rows())
+    else:
+        rows = _openpyxl_rows(path, sheet)
+    labels = _header_labels(next(rows, ()))
+    width = len(labels)
+    batch = []
+    for row in rows:
+        # Formatted but empty rows at the end of a sheet
+        if not any(row):
+            continue
+        batch.append(row[:width])
+        if len(batch) == batch_rows:
+            frame = pd.DataFrame(batch, columns=labels, dtype=object)
+            yield _native_dates(frame) if engine == 'calamine' else frame
+            batch = []
+    if batch:
+        frame = pd.DataFrame(batch, columns=labels, dtype=object)
+        yield _native_dates(frame) if engine == 'calamine' else frame
+
+
+def iter_spend_source(path, sheet, legacy=True, batch_rows=None, stats=None):
+    """
+    Cleaned record batches of one sheet, each cleaned as soon as it is read;
+    stats (a dict) is filled as they go. legacy=False skips sheets whose
+    headers are not recognized instead of reading them in the positional
+    layout (summary sheets of a workbook).
+    """
+    stats = {} if stats is None else stats
+    stats.update({"file": os.path.basename(path), "sheet": sheet, "engine": workbook_engine(path),
+                  "rows": 0, "kept": 0, "batches": 0, "seconds": 0.0})
+    columns = None
+    started = time.time()
+    for frame in iter_source_frames(path, sheet, batch_rows):
+        if columns is None:
+            columns, unmapped, layout = resolve_columns(frame.columns)
+            stats.update(layout=layout, unmapped=[str(label) for label in unmapped])
+            if layout == 'legacy' and not legacy:
+                stats["skipped_sheet"] = True
+                break
+        stats["rows"] += len(frame)
+        stats["batches"] += 1
+        records = clean_spend_frame(frame, columns)
+        stats["kept"] += len(records)
+        # Time spent reading and cleaning only, not in the consumer of the batches
+        stats["seconds"] = round(stats["seconds"] + time.time() - started, 2)
+        yield records
+        started = time.time()
+    stats["seconds"] = round(stats["seconds"] + time.time() - started, 2)
+
+
+def read_spend_source(path, sheet, legacy=True, batch_rows=None):
+    """([cleaned record batches], stats) of one sheet (see iter_spend_source)"""
+    stats = {}
+    parts = list(iter_spend_source(path, sheet, legacy, batch_rows, stats))
+    return parts, stats
+
+
+def _read_source(args):
+    return read_spend_source(*args)
+
+
+def _stream_sources(jobs):
+    for path, sheet, legacy in jobs:
+        stats = {}
+        yield iter_spend_source(path, sheet, legacy, stats=stats), stats
+
+
+def _numbered(results, stats):
+    """Batches of (batches, source stats) results with line keys numbered over all of them"""
+    seen, batches = {}, 0
+    for parts, source in results:
+        for records in parts:
+            records['line_key'] = line_keys(records, seen)
+            batches += 1
+            yield records
+        stats.append(source)
+        if source.get("skipped_sheet"):
+            print(f"⚠️ Skipping sheet '{source['sheet']}' of {source['file']}: spend headers not recognized")
+        elif source.get("unmapped"):
+            print(f"⚠️ Ignoring unmapped spend columns in {source['file']} [{source['sheet']}]: "
+                  f"{', '.join(source['unmapped'])}")
+    if not batches:
+        raise ValueError("No spend rows found in " + ', '.join(sorted({source['file'] for source in stats})))
+
+
+def iter_spend_sources(sources, workers=None, stats=None):
+    """
+    Cleaned record batches of all sources in order, as they are read. Line
+    keys are numbered over the combined extract, as if it were one sheet.
+    stats (a list) receives the stats of each source once it is read.
+    """
+    stats = [] if stats is None else stats
+    workers = min(workers or INGEST_WORKERS, len(sources))
+    # Every sheet of a multi-sheet read must be recognizable by its headers
+    legacy = len(sources) == 1
+    jobs = [(path, sheet, legacy) for path, sheet in sources]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from _numbered(pool.map(_read_source, jobs), stats)
+    else:
+        yield from _numbered(_stream_sources(jobs), stats)
+
+
+def read_spend_sources(sources, workers=None):
+    """(cleaned records of all sources in order, [stats per source]); see iter_spend_sources"""
+    stats = []
+    parts = list(iter_spend_sources(sources, workers, stats))
+    # One concat of every batch: the cleaned records are the bulk of the memory
+    if len(parts) == 1:
+        return parts[0], stats
+    return pd.concat(parts, ignore_index=True), stats
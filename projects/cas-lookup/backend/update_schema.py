@@ -1,58 +1,13 @@
 from app import app, db
-from sqlalchemy import text
+from db_migrations import run_migrations, migration_status
 
 def update_schema():
+    """Bring an existing database up to date (columns, tables and indexes)"""
     with app.app_context():
-        print("Checking for missing columns...")
-        try:
-            # Check if enriched_description exists in spend_record
-            with db.engine.connect() as conn:
-                conn.execute(text("SELECT enriched_description FROM spend_record LIMIT 1"))
-                print("Column 'enriched_description' already exists.")
-        except Exception:
-            print("Adding column 'enriched_description' to 'spend_record'...")
-            try:
-                with db.engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE spend_record ADD COLUMN enriched_description VARCHAR(500)"))
-                    conn.commit()
-                print("Successfully added 'enriched_description' column.")
-            except Exception as e:
-                print(f"Error adding column: {e}")
-
-        try:
-            # Check if cas_number exists in spend_record
-            with db.engine.connect() as conn:
-                conn.execute(text("SELECT cas_number FROM spend_record LIMIT 1"))
-                print("Column 'cas_number' already exists.")
-        except Exception:
-            print("Adding column 'cas_number' to 'spend_record'...")
-            try:
-                with db.engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE spend_record ADD COLUMN cas_number VARCHAR(100)"))
-                    conn.commit()
-                print("Successfully added 'cas_number' column.")
-            except Exception as e:
-                print(f"Error adding column: {e}")
-
-        try:
-            # Check if item_category exists in spend_record
-            with db.engine.connect() as conn:
-                conn.execute(text("SELECT item_category FROM spend_record LIMIT 1"))
-                print("Column 'item_category' already exists.")
-        except Exception:
-            print("Adding column 'item_category' to 'spend_record'...")
-            try:
-                with db.engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE spend_record ADD COLUMN item_category VARCHAR(100)"))
-                    conn.commit()
-                print("Successfully added 'item_category' column.")
-            except Exception as e:
-                print(f"Error adding column: {e}")
-            from models import UserPreference
-            db.create_all()
-            print("Ensured all tables (including UserPreference) are created.")
-        except Exception as e:
-            print(f"Error ensuring tables: {e}")
+        db.create_all()
+        applied = run_migrations(db.engine)
+        print(f"Applied migrations: {applied or 'none'}")
+        print(f"Schema status: {migration_status(db.engine)}")
 
 if __name__ == "__main__":
     update_schema()
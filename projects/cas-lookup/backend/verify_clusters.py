@@ -0,0 +1,194 @@
+"""
+Near-duplicate description clustering check and benchmark.
+
+    python verify_clusters.py               # 40 materials x 30 spellings, 20000 generated descriptions
+    python verify_clusters.py 100 50 100000
+
+Checks hand-picked ERP spellings that must share an LLM call and chemically
+different names that must not, then clusters generated spellings of known
+materials (pack sizes, grades, purities, vendor prefixes, British / American
+spelling, typos) and reports the LLM call reduction, the share of members
+clustered with the wrong material and the clustering time. Finally runs an
+enrichment job over clustered descriptions with a simulated LLM and checks
+that only representatives are sent and members take over their outcome.
+"""
+import os
+import sys
+import time
+import random
+import threading
+
+os.environ.setdefault('ENRICHMENT_WRITE_INTERVAL', '0.5')
+from sqlalchemy import text
+from app import app
+from models import db, EnrichmentJob, EnrichmentWorkItem
+from description_clusters import cluster_descriptions, fuzz
+from enrichment_jobs import create_job, start_job, active_job
+
+MUST_MERGE = [
+    ("GLYCERINE IP 99.5% 250KG DRUM", "GLYCERIN 99.5 IP BULK"),
+    ("GLYCERINE IP 99.5% 250KG DRUM", "AB - GLYCERINE"),
+    ("SODIUM LAURETH SULPHATE 70%", "SODIUM LAURETH SULFATE 25 KG"),
+    ("ALUMINIUM CHLOROHYDRATE 50% SOLUTION", "ALUMINUM CHLOROHYDRATE"),
+    ("CITRIC ACID 25KG BAG", "citric  acid"),
+    ("POLYSORBATE 20 200 L DRUM", "POLYSORBATE 20"),
+    ("DIMETHICONE 350 CST", "DIMETHICONE 350 CST 1000KG IBC"),
+    ("CAFFEINE ANHYDROUS 25KG", "CAFFEIN ANHYDROUS"),
+]
+MUST_NOT_MERGE = [
+    ("POLYSORBATE 20", "POLYSORBATE 80"),
+    ("PEG-40 HYDROGENATED CASTOR OIL", "PEG-60 HYDROGENATED CASTOR OIL"),
+    ("METHYLPARABEN", "ETHYLPARABEN"),
+    ("PROPYLPARABEN", "BUTYLPARABEN"),
+    ("STEARYL ALCOHOL", "CETEARYL ALCOHOL"),
+    ("SODIUM LAURYL SULFATE", "SODIUM LAURETH SULFATE"),
+    ("SODIUM BENZOATE", "POTASSIUM BENZOATE"),
+    ("SODIUM CHLORIDE", "POTASSIUM CHLORIDE"),
+    ("CITRIC ACID", "ASCORBIC ACID"),
+    ("CHEM ITEM 1 99% DRUM", "CHEM ITEM 10 99% DRUM"),
+    ("TRIMETHYLAMINE", "TRIETHYLAMINE"),
+    ("BENZOYL CHLORIDE", "BENZYL CHLORIDE"),
+    ("BENZYLALDEHYDE", "BENZALDEHYDE"),
+]
+
+MATERIALS = [
+    "GLYCERINE", "CITRIC ACID", "SODIUM LAURETH SULPHATE", "CETEARYL ALCOHOL", "STEARYL ALCOHOL", "CETYL ALCOHOL",
+    "DIMETHICONE", "CYCLOPENTASILOXANE", "PHENOXYETHANOL", "METHYLPARABEN", "PROPYLPARABEN", "ETHYLPARABEN",
+    "SODIUM BENZOATE", "POTASSIUM SORBATE", "XANTHAN GUM", "CARBOMER", "TRIETHANOLAMINE", "ISOPROPYL MYRISTATE",
+    "CAPRYLIC CAPRIC TRIGLYCERIDE", "COCAMIDOPROPYL BETAINE", "DISODIUM EDTA", "TOCOPHEROL", "PANTHENOL",
+    "ALLANTOIN", "NIACINAMIDE", "SODIUM HYALURONATE", "TITANIUM DIOXIDE", "ZINC OXIDE", "ALUMINIUM CHLOROHYDRATE",
+    "SODIUM CHLORIDE", "POTASSIUM CHLORIDE", "MAGNESIUM SULPHATE", "STEARIC ACID", "LACTIC ACID", "SALICYLIC ACID",
+    "BUTYLENE GLYCOL", "PROPYLENE GLYCOL", "GLYCERYL STEARATE", "SORBITOL", "MENTHOL",
+]
+NUMBERED = ["POLYSORBATE", "PEG", "CARBOMER", "CETETH", "STEARETH"]
+PACKS = ["", "25KG BAG", "25 KG", "200 L DRUM", "1000KG IBC", "DRUM", "BULK", "5 GAL PAIL", "1X20KG CTN"]
+GRADES = ["", "IP", "USP", "BP", "EP", "TECH", "PHARMA GRADE", "NF", "KOSHER"]
+PURITIES = ["", "99%", "99.5%", "98.0 %", "70%"]
+PREFIXES = ["", "AB - ", "XY-", "C1 - "]
+
+
+def spelling(name, rng):
+    """A plausible ERP spelling of a material name"""
+    words = name.split()
+    roll = rng.random()
+    if roll < 0.15:
+        words = [w.replace('SULPH', 'SULF') for w in words]
+    elif roll < 0.25 and words[-1].endswith('E') and len(words[-1]) > 6:
+        words[-1] = words[-1][:-1]  # GLYCERINE -> GLYCERIN
+    elif roll < 0.3:
+        words = [w.replace('ALUMINIUM', 'ALUMINUM') for w in words]
+    text_ = ' '.join(words + [rng.choice(GRADES), rng.choice(PURITIES), rng.choice(PACKS)])
+    text_ = rng.choice(PREFIXES) + text_
+    if rng.random() < 0.3:
+        text_ = text_.lower()
+    return ' '.join(text_.split()) if rng.random() < 0.7 else text_.replace(' ', '  ')
+
+
+def generated(materials, variants, rng):
+    """{description: material} with up to `variants` spellings per material"""
+    names = list(MATERIALS[:materials])
+    names += [f"{base} {n}" if base != "PEG" else f"PEG-{n}" for base in NUMBERED for n in (20, 40, 60, 80)]
+    descriptions = {}
+    for name in names:
+        for _ in range(variants):
+            descriptions.setdefault(spelling(name, rng), name)
+    return descriptions
+
+
+def check_pairs():
+    failures = 0
+    for pairs, merged, label in ((MUST_MERGE, True, "share an LLM call"), (MUST_NOT_MERGE, False, "stay apart")):
+        wrong = [(a, b) for a, b in pairs if (b in cluster_descriptions([a, b])) != merged]
+        for a, b in wrong:
+            print(f"   ❌ {a!r} / {b!r} should {label}")
+        print(f"   {'✅' if not wrong else '❌'} {len(pairs) - len(wrong)}/{len(pairs)} pairs {label}")
+        failures += len(wrong)
+    return failures
+
+
+def benchmark(materials, variants, total):
+    rng = random.Random(7)
+    descriptions = generated(materials, variants, rng)
+    started = time.perf_counter()
+    members = cluster_descriptions(list(descriptions))
+    elapsed = time.perf_counter() - started
+    wrong = sum(1 for member, (representative, _, _) in members.items()
+                if descriptions[member] != descriptions[representative])
+    calls = len(descriptions) - len(members)
+    fuzzy = sum(1 for _, match_type, _ in members.values() if match_type == 'fuzzy')
+    ok = wrong == 0 and calls <= len(set(descriptions.values())) * 1.5
+    print(f"   {'✅' if ok else '❌'} {len(descriptions)} spellings of {len(set(descriptions.values()))} materials -> "
+          f"{calls} LLM calls ({len(descriptions) / calls:.1f}x fewer), {fuzzy} fuzzy members, "
+          f"{wrong} clustered with the wrong material, {elapsed * 1000:.0f} ms")
+
+    # Scale: many distinct materials, a few spellings each
+    names = [f"CHEM ITEM {i}" for i in range(total // 4)]
+    spellings = [spelling(rng.choice(names), rng) for _ in range(total)]
+    spellings = list(dict.fromkeys(spellings))
+    started = time.perf_counter()
+    members = cluster_descriptions(spellings)
+    elapsed = time.perf_counter() - started
+    print(f"   ⏱️ {len(spellings)} descriptions clustered in {elapsed:.2f}s -> {len(spellings) - len(members)} "
+          f"LLM calls ({'rapidfuzz' if fuzz is not None else 'difflib'})")
+    return 0 if ok else 1
+
+
+class ClusterCleaner:
+    """Simulated LLM answering with the material behind a spelling"""
+
+    def __init__(self, descriptions):
+        self.descriptions = descriptions
+        self.asked = []
+        self._lock = threading.Lock()
+
+    def get_chemical_details(self, raw_desc):
+        with self._lock:
+            self.asked.append(raw_desc)
+        material = self.descriptions[raw_desc]
+        return {"cas": f"{abs(hash(material)) % 9000 + 1000}-00-0", "inci": material}
+
+
+def verify_job():
+    if active_job() is not None:
+        print("   ⚠️ job check skipped: an enrichment job is active on this database")
+        return 0
+    rng = random.Random(11)
+    descriptions = {f"ZZ {d}": m for d, m in generated(12, 10, rng).items()}
+    cleaner = ClusterCleaner(descriptions)
+    job = create_job(list(descriptions), {"workers": 4, "rate": 1000})
+    try:
+        start_job(app, job.id, lambda: cleaner).join(timeout=120)
+        db.session.expire_all()
+        job = db.session.get(EnrichmentJob, job.id)
+        items = {i.raw_description: i for i in EnrichmentWorkItem.query.filter_by(job_id=job.id)}
+        members = [i for i in items.values() if i.cluster_of]
+        checks = [
+            ("only representatives sent to the LLM", len(cleaner.asked) == job.llm_items == len(items) - len(members)
+             and all(not items[d].cluster_of for d in cleaner.asked)),
+            ("job completes with every item written", job.status == 'done' and job.current == len(items)
+             and all(i.status != 'pending' for i in items.values())),
+            ("members take over the representative's outcome", bool(members) and all(
+                (m.status, m.enriched_description, m.cas_number) ==
+                (items[m.cluster_of].status, items[m.cluster_of].enriched_description, items[m.cluster_of].cas_number)
+                for m in members)),
+            ("members carry a match flag", all(m.match_type in ('normalized', 'fuzzy') and m.similarity for m in members)),
+        ]
+    finally:
+        db.session.execute(text("DELETE FROM enrichment_work_item WHERE job_id = :id"), {"id": job.id})
+        db.session.execute(text("DELETE FROM enrichment_job WHERE id = :id"), {"id": job.id})
+        db.session.commit()
+    failures = 0
+    for name, ok in checks:
+        print(f"   {'✅' if ok else '❌'} {name}")
+        failures += not ok
+    return failures
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    materials, variants, total = (args + [40, 30, 20000][len(args):])[:3]
+    print("--- 🧪 Near-duplicate clustering ---")
+    failed = check_pairs() + benchmark(materials, variants, total)
+    with app.app_context():
+        failed += verify_job()
+    sys.exit(1 if failed else 0)
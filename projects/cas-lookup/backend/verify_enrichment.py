@@ -0,0 +1,306 @@
+"""
+Spend enrichment executor check and benchmark.
+
+    python verify_enrichment.py                 # 400 descriptions, 200 ms simulated LLM latency
+    python verify_enrichment.py 2000 0.5        # N descriptions, latency in seconds
+
+Runs the executor against a simulated Bedrock client (fixed latency, a mix of
+found / not found / unusable answers) once with a single worker and once with
+the worker pool, and checks that the progress counters match the answers.
+Then runs enrichment jobs through the job store (enrichment_jobs.py): a
+second job is refused while one is active, pause / resume / cancel stop and
+continue the runner, and a job whose lease holder died is taken over and
+only its pending items are sent to the LLM again. Finally a job is run in
+priority order with one worker, checking the order of the LLM calls, the
+spend coverage counters and the partial publishing of the enriched spend.
+The descriptions do not exist in the database, so the batched writes are
+executed but change no rows; the test jobs are deleted afterwards.
+The progress stream (.../events) is read while a job runs: events are
+coalesced to one per interval and carry throughput, ETA, latency and recent
+results. Last, the staged batch write (apply_enrichment_batch) is timed
+against one UPDATE per description on real spend descriptions and rolled back.
+"""
+import os
+import sys
+import time
+import threading
+
+# Runners notice pause / cancel within one write interval
+os.environ.setdefault('ENRICHMENT_WRITE_INTERVAL', '0.5')
+os.environ.setdefault('ENRICHMENT_PUBLISH_INTERVAL', '1')
+os.environ.setdefault('ENRICHMENT_EVENT_INTERVAL', '0.5')
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app import app
+from models import db, EnrichmentJob
+from data_version import get_data_version, SPEND
+from spend_enrichment import run_enrichment, apply_enrichment_batch, ENRICHMENT_WORKERS
+from enrichment_jobs import (create_job, start_job, set_job_status, claim_job, resume_orphaned_job, active_job,
+                             enrichment_candidates, EnrichmentJobConflict, PRIORITY_SCORES)
+
+
+class SimulatedCleaner:
+    """get_chemical_details with a fixed latency; thread-safe like the boto3 client"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.order = []
+        self._lock = threading.Lock()
+
+    def get_chemical_details(self, text):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.order.append(text)
+        n = int(text.rsplit('-', 1)[1])
+        if n % 5 == 0:
+            return None
+        if n % 7 == 0:
+            return {"cas": "NOT FOUND", "inci": "SOMETHING"}
+        return {"cas": f"{1000 + n}-00-{n % 10}", "inci": f"VERIFY CHEMICAL {n}"}
+
+
+def expected_counts(n):
+    found = [i for i in range(n) if i % 5 != 0]
+    return {"current": n, "errors": n - len(found), "processed": len(found)}
+
+
+def run(descriptions, latency, workers, rate):
+    cleaner = SimulatedCleaner(latency)
+    progress = {"current": 0, "processed": 0, "errors": 0}
+    started = time.perf_counter()
+    affected = run_enrichment(cleaner, descriptions, progress, workers=workers, rate=rate,
+                              write_batch=50, write_interval=1.0)
+    return progress, affected, cleaner.calls, time.perf_counter() - started
+
+
+def verify(n, latency):
+    descriptions = [f"zz verify enrichment item-{i}" for i in range(n)]
+    failures = 0
+    print(f"--- 🧪 Enrichment executor: {n} descriptions, {latency * 1000:.0f} ms per LLM call ---")
+    with app.app_context():
+        for label, workers, rate in (("sequential", 1, 1000.0), ("worker pool", max(ENRICHMENT_WORKERS, 16), 1000.0),
+                                     ("rate-limited pool", 16, 20.0)):
+            count = n if workers > 1 else min(n, 50)
+            progress, affected, calls, elapsed = run(descriptions[:count], latency, workers, rate)
+            want = expected_counts(count)
+            ok = progress == want and calls == count
+            if rate < 1000:
+                # The bucket starts full (ENRICHMENT_BURST tokens), then admits `rate` calls per second
+                ok = ok and elapsed >= (count - 10) / rate * 0.95
+            status = "✅" if ok else "❌"
+            print(f"   {status} {label} ({workers} workers, {rate:g}/s): {count} in {elapsed:.2f}s "
+                  f"= {count / elapsed:.1f}/s, counters {progress}")
+            failures += not ok
+    return failures
+
+
+def job_state(job_id):
+    db.session.expire_all()
+    job = db.session.get(EnrichmentJob, job_id)
+    pending = db.session.execute(text(
+        "SELECT COUNT(*) FROM enrichment_work_item WHERE job_id = :id AND status = 'pending'"), {"id": job_id}).scalar()
+    return job, pending
+
+
+def wait_until(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def delete_jobs(job_ids):
+    for job_id in job_ids:
+        db.session.execute(text("DELETE FROM enrichment_work_item WHERE job_id = :id"), {"id": job_id})
+        db.session.execute(text("DELETE FROM enrichment_job WHERE id = :id"), {"id": job_id})
+    db.session.commit()
+
+
+def verify_jobs(n=120, latency=0.05):
+    print(f"--- 🧪 Enrichment job store: {n} descriptions ---")
+    if active_job() is not None:
+        print("   ⚠️ skipped: an enrichment job is active on this database")
+        return 0
+    descriptions = [f"zz verify enrichment job item-{i}" for i in range(n)]
+    cleaner = SimulatedCleaner(latency)
+    checks, jobs = [], []
+    try:
+        # 1. one active job at a time; pause, resume, cancel
+        job = create_job(descriptions, {"workers": 4, "rate": 20})
+        jobs.append(job.id)
+        try:
+            create_job(descriptions)
+            checks.append(("second job refused while one is active", False))
+        except EnrichmentJobConflict as conflict:
+            checks.append(("second job refused while one is active", conflict.job.id == job.id))
+        runner = start_job(app, job.id, lambda: cleaner)
+        wait_until(lambda: job_state(job.id)[0].current >= n // 4)
+        set_job_status(job.id, 'paused')
+        runner.join(timeout=60)
+        paused, pending = job_state(job.id)
+        checks.append(("pause stops the runner and releases the lease",
+                       paused.status == 'paused' and paused.lease_owner is None and 0 < pending < n))
+        set_job_status(job.id, 'running')
+        checks.append(("resume re-claims the job", claim_job(job.id)))
+        runner = start_job(app, job.id, lambda: cleaner)
+        wait_until(lambda: job_state(job.id)[0].current >= n // 2)
+        set_job_status(job.id, 'cancelled')
+        runner.join(timeout=60)
+        cancelled, pending = job_state(job.id)
+        checks.append(("cancel stops the runner", cancelled.status == 'cancelled' and cancelled.active is None
+                       and cancelled.lease_owner is None and pending > 0))
+        checks.append(("counters match the written items", cancelled.current == n - pending))
+
+        # 2. crash: the lease holder died after writing some items
+        calls_before = cleaner.calls
+        job = create_job(descriptions, {"workers": 4, "rate": 20})
+        jobs.append(job.id)
+        db.session.execute(text("""
+            UPDATE enrichment_work_item SET status = 'not_found' WHERE job_id = :id AND id IN (
+                SELECT id FROM enrichment_work_item WHERE job_id = :id ORDER BY id LIMIT :k)
+        """), {"id": job.id, "k": n // 3})
+        db.session.execute(text(
+            "UPDATE enrichment_job SET current = :k, errors = :k, lease_owner = 'dead-process', lease_expires_at = :t "
+            "WHERE id = :id"), {"id": job.id, "k": n // 3, "t": datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        resumed = resume_orphaned_job(app, lambda: cleaner)
+        checks.append(("orphaned job is taken over", resumed == job.id))
+        wait_until(lambda: job_state(job.id)[0].status == 'done')
+        done, pending = job_state(job.id)
+        calls = cleaner.calls - calls_before
+        checks.append(("take-over completes the job", done.status == 'done' and pending == 0 and done.current == n))
+        checks.append(("only pending items re-sent to the LLM", calls == n - n // 3))
+        checks.append(("take-over forces a full spend sync", bool(done.full_sync)))
+
+        # 3. priority order, spend coverage and partial publishing
+        for priority in PRIORITY_SCORES:
+            candidates, spend_total, spend_enriched = enrichment_candidates(priority)
+            scores = [c[1] for c in candidates]
+            checks.append((f"candidates ordered by {priority}", scores == sorted(scores, reverse=True)
+                           and spend_enriched + sum(c[2] for c in candidates) <= spend_total + 1e-6 * abs(spend_total)))
+        cleaner = SimulatedCleaner(latency)
+        spend = {d: float((i * 37) % n + 1) for i, d in enumerate(descriptions)}
+        job = create_job([(d, spend[d], spend[d]) for d in descriptions], {"workers": 1, "rate": 1000},
+                         spend_total=2 * sum(spend.values()), spend_enriched=0.0)
+        jobs.append(job.id)
+        version_before = get_data_version(SPEND)
+        start_job(app, job.id, lambda: cleaner).join(timeout=120)
+        done, pending = job_state(job.id)
+        checks.append(("items sent highest spend first", cleaner.order == sorted(descriptions, key=lambda d: -spend[d])))
+        enriched = sum(spend[d] for d in descriptions if int(d.rsplit('-', 1)[1]) % 5 and int(d.rsplit('-', 1)[1]) % 7)
+        coverage = done.coverage()
+        checks.append(("coverage counts the enriched spend", abs(done.enriched_spend - enriched) < 1e-6
+                       and coverage["job_spend_done_pct"] == 100.0 and coverage["items_done_pct"] == 100.0
+                       and coverage["spend_enriched_pct"] == round(100.0 * enriched / done.spend_total, 2)))
+        published = get_data_version(SPEND) - version_before
+        checks.append((f"enriched spend published during the run ({published} syncs)", published > 1))
+    finally:
+        delete_jobs(jobs)
+    failures = 0
+    for name, ok in checks:
+        print(f"   {'✅' if ok else '❌'} {name}")
+        failures += not ok
+    return failures
+
+
+def read_events(response):
+    """(arrival time, event name, data) of each event of a streamed response"""
+    buffer = ""
+    for chunk in response.response:
+        buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+            if "event" in fields:
+                yield time.monotonic(), fields["event"], json.loads(fields["data"])
+
+
+def verify_stream(n=600, latency=0.02):
+    print(f"--- 🧪 Enrichment progress stream: {n} descriptions ---")
+    if active_job() is not None:
+        print("   ⚠️ skipped: an enrichment job is active on this database")
+        return 0
+    from blueprints.enrichment import EVENT_INTERVAL
+    descriptions = [f"zz verify enrichment stream item-{i}" for i in range(n)]
+    job = create_job(descriptions, {"workers": 2, "rate": 1000})
+    try:
+        started = time.monotonic()
+        runner = start_job(app, job.id, lambda: SimulatedCleaner(latency))
+        response = app.test_client().get(f"/api/spend-analysis/enrich-jobs/{job.id}/events", buffered=False)
+        events = list(read_events(response))
+        elapsed = time.monotonic() - started
+        runner.join(timeout=60)
+        progress = [data for _, name, data in events if name == 'progress']
+        live = [p["live"] for p in progress if p["live"].get("throughput")]
+        gaps = [b[0] - a[0] for a, b in zip(events, events[1:])]
+        checks = [
+            ("stream ends with the finished job", bool(events) and events[-1][1] == 'end'
+             and events[-1][2]["status"] == 'done' and events[-1][2]["current"] == n),
+            (f"events coalesced ({len(events)} in {elapsed:.1f}s, interval {EVENT_INTERVAL}s)",
+             len(events) <= elapsed / EVENT_INTERVAL + 2 and all(g >= EVENT_INTERVAL * 0.9 for g in gaps)),
+            ("progress carries throughput, ETA, latency and recent results", bool(live) and all(
+                l["eta_seconds"] is not None and "SimulatedCleaner" in l["latency"] and l["recent"] for l in live)),
+            ("latency measured per call", bool(live) and
+             abs(live[-1]["latency"]["SimulatedCleaner"]["p50_ms"] - latency * 1000) < latency * 1000),
+        ]
+    finally:
+        delete_jobs([job.id])
+    failures = 0
+    for name, ok in checks:
+        print(f"   {'✅' if ok else '❌'} {name}")
+        failures += not ok
+    return failures
+
+
+def verify_staged_writes(k=200):
+    print(f"--- 🧪 Staged enrichment writes: {k} descriptions ---")
+    descriptions = [d for (d,) in db.session.execute(text(
+        "SELECT DISTINCT item_description FROM spend_record WHERE item_description IS NOT NULL LIMIT :k"), {"k": k})]
+    if not descriptions:
+        print("   ⚠️ skipped: no spend data")
+        return 0
+    results = {d: (f"Verify{i}_cas_{1000 + i}-00-0", f"{1000 + i}-00-0", f"VERIFY {i}") for i, d in enumerate(descriptions)}
+    placeholders = ', '.join(f":d{i}" for i in range(len(descriptions)))
+    params = {f"d{i}": d for i, d in enumerate(descriptions)}
+    lines = db.session.execute(text(f"SELECT COUNT(*) FROM spend_record WHERE item_description IN ({placeholders})"),
+                               params).scalar()
+
+    started = time.perf_counter()
+    db.session.execute(
+        text("UPDATE spend_record SET enriched_description = :e, cas_number = :c WHERE item_description = :d"),
+        [{"d": d, "e": e, "c": c} for d, (e, c, _) in results.items()])
+    db.session.execute(
+        text("UPDATE material_data SET enriched_description = :e, cas_number = :c, inci_name = :i "
+             "WHERE item_description = :d"),
+        [{"d": d, "e": e, "c": c, "i": i} for d, (e, c, i) in results.items()])
+    per_description = time.perf_counter() - started
+    db.session.rollback()
+
+    started = time.perf_counter()
+    apply_enrichment_batch([(d, True, r) for d, r in results.items()], commit=False)
+    staged = time.perf_counter() - started
+    written = db.session.execute(text(
+        f"SELECT COUNT(*) FROM spend_record WHERE item_description IN ({placeholders}) AND enriched_description LIKE 'Verify%'"
+    ), params).scalar()
+    db.session.rollback()
+    ok = written == lines
+    print(f"   {'✅' if ok else '❌'} {lines} spend lines: one UPDATE per description {per_description:.2f}s, "
+          f"staged UPDATE ... FROM {staged:.2f}s ({written} lines written)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    n = int(args[0]) if args else 400
+    latency = float(args[1]) if len(args) > 1 else 0.2
+    failed = verify(n, latency)
+    with app.app_context():
+        failed += verify_jobs()
+        failed += verify_stream()
+        failed += verify_staged_writes()
+    sys.exit(1 if failed else 0)
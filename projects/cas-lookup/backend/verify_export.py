@@ -0,0 +1,126 @@
+"""
+Spend export check and benchmark.
+
+    python verify_export.py                     # every format, all rows of the live DB (+ a few seeded)
+    python verify_export.py csv parquet         # selected formats
+    python verify_export.py --memory csv        # ... plus the peak Python heap while streaming
+
+Seeds a few tagged spend lines (removed afterwards, with derived data synced
+both times) so an empty database still exports rows. Streams each export
+through the test client into a temporary file, checks the row count against
+the table view's total - for all rows and for the seeded operating unit -
+and reports time and size. --memory traces allocations (tracemalloc), which
+slows the export down.
+"""
+import sys
+import io
+import csv
+import time
+import tempfile
+import threading
+import tracemalloc
+from sqlalchemy import text
+from app import app
+from models import db, SpendRecord
+from spend_export import EXPORT_FORMATS, format_available
+from spend_sync import after_spend_ingest
+
+SEED_TAG = 'VERIFY-EXPORT'
+SEED_UNIT = 'OU Verify Export'
+SEED_LINES = 5
+
+
+def seed_rows():
+    """Tagged spend lines, some with empty fields; returns their ids"""
+    lines = [SpendRecord(po_number=f'{SEED_TAG}-{i}', vendor_name=f'{SEED_TAG} Vendor, "Quoted"',
+                         item_description=None if i % 2 else 'SOLVENT DRUM', operating_unit=SEED_UNIT,
+                         fiscal_year=None if i == 0 else 2024, amount=1000.0 + i, quantity=float(i + 1))
+             for i in range(SEED_LINES)]
+    db.session.add_all(lines)
+    db.session.commit()
+    after_spend_ingest()
+    return [line.id for line in lines]
+
+
+def remove_seed(spend_ids):
+    ids = ','.join(map(str, spend_ids))
+    db.session.execute(text(f"DELETE FROM spend_material_link WHERE spend_id IN ({ids})"))
+    db.session.execute(text(f"DELETE FROM spend_record WHERE id IN ({ids})"))
+    db.session.commit()
+    after_spend_ingest()
+
+
+def export_to_file(client, fmt, handle, **filters):
+    response = client.get('/api/spend-analysis/export', query_string=dict(filters, format=fmt), buffered=False)
+    if response.status_code != 200:
+        raise RuntimeError(f"{fmt}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}")
+    size = 0
+    for chunk in response.response:
+        handle.write(chunk)
+        size += len(chunk)
+    response.close()
+    return size
+
+
+def count_rows(fmt, handle):
+    handle.seek(0)
+    if fmt == 'csv':
+        reader = csv.reader(io.TextIOWrapper(handle, encoding='utf-8-sig', newline=''))
+        return sum(1 for _ in reader) - 1
+    if fmt == 'xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(handle, read_only=True)
+        # write-only workbooks carry no dimensions: count the rows
+        return sum(sum(1 for _ in ws.iter_rows(values_only=True)) - 1 for ws in workbook.worksheets)
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(handle).metadata.num_rows
+
+
+def wait_for_background_work():
+    """Startup preloads (spend cube, material_risk) run in threads; let them finish before timing"""
+    while threading.active_count() > 1:
+        time.sleep(0.5)
+
+
+def verify(formats, trace_memory=False):
+    failures = 0
+    with app.app_context():
+        spend_ids = seed_rows()
+    try:
+        with app.test_client() as client:
+            expected = client.get('/api/spend-analysis/table', query_string={"per_page": 1}).get_json()["total"]
+            wait_for_background_work()
+            print(f"--- 🧪 Spend export ({expected:,} rows, {SEED_LINES} seeded) ---")
+            for fmt in formats:
+                if not format_available(fmt):
+                    print(f"   ⚠️ {fmt}: not available (missing optional dependency)")
+                    continue
+                with tempfile.TemporaryFile() as handle:
+                    if trace_memory:
+                        tracemalloc.start()
+                    started = time.perf_counter()
+                    size = export_to_file(client, fmt, handle)
+                    elapsed = time.perf_counter() - started
+                    memory = ""
+                    if trace_memory:
+                        memory = f", peak heap {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB"
+                        tracemalloc.stop()
+                    rows = count_rows(fmt, handle)
+                with tempfile.TemporaryFile() as handle:
+                    export_to_file(client, fmt, handle, operating_unit=SEED_UNIT)
+                    seeded = count_rows(fmt, handle)
+                ok = rows == expected and seeded == SEED_LINES
+                print(f"   {'✅' if ok else '❌'} {fmt}: {rows:,} rows ({seeded} of {SEED_LINES} seeded when filtered), "
+                      f"{size / 1e6:.1f} MB in {elapsed:.2f}s{memory}")
+                failures += not ok
+    finally:
+        with app.app_context():
+            remove_seed(spend_ids)
+    return failures
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    trace_memory = '--memory' in args
+    formats = [a for a in args if a != '--memory'] or list(EXPORT_FORMATS)
+    sys.exit(1 if verify(formats, trace_memory) else 0)
@@ -0,0 +1,434 @@
+"""
+Bulk spend ingestion check and benchmark.
+
+    python verify_ingest.py              # 1,000,000 generated rows
+    python verify_ingest.py 200000
+
+Runs against a scratch SQLite file with the full schema (migrations, FTS
+triggers, secondary indexes), never the application database. Generates a
+Purchase History extract with ERP headers and the cell types Excel hands
+over (float PO numbers, Timestamps, Excel serial dates, '1,234.50' amounts),
+times mapping + cleaning and the insert, and checks the loaded rows against
+the per-row parsing the ingestion replaced. Then checks a small append
+(trigger path), the legacy positional layout and an .xlsx round trip, and
+a delta load: a refreshed extract (changed, removed and new PO lines)
+against the loaded one, with enrichment that must survive. Finally the
+streaming workbook reader: each available engine against pd.read_excel
+(rows/s and peak RSS, each in a fresh process), a directory of a
+multi-sheet workbook and a CSV read sequentially and in parallel, and an
+append / replace load inserting batches as they are read against
+collecting the extract first (peak RSS, and a failure halfway rolls back).
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from models import db
+from db_migrations import run_migrations
+import spend_workbook
+from spend_ingest import (map_spend_columns, legacy_columns, clean_spend_frame, insert_spend_rows, read_spend_file,
+                          insert_spend_batches, apply_spend_delta, backfill_fingerprints, INSERT_COLUMNS)
+
+
+def generate_extract(n, seed=1):
+    """Source frame shaped like pd.read_excel(dtype=object) of a Purchase History sheet"""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 1100, n)
+    dates = pd.Timestamp('2021-04-01') + pd.to_timedelta(days, unit='D')
+    po_dates = pd.Series(dates, dtype=object)
+    serial = np.arange(n) % 50 == 0
+    po_dates[serial] = (dates[serial] - pd.Timestamp('1899-12-30')).days.astype(float)
+    po_dates[np.arange(n) % 100 == 0] = None
+    amounts = pd.Series(np.round(rng.random(n) * 1e6, 2), dtype=object)
+    commas = np.arange(n) % 20 == 0
+    amounts[commas] = [f"{a:,.2f}" for a in amounts[commas]]
+    po_numbers = 4500000000 + rng.integers(0, n // 3 + 1, n)
+    vendors = np.array([f"Vendor {i} " for i in range(2000)] + [None], dtype=object)
+    items = np.array([f"CHEM ITEM {i} 99% DRUM" for i in range(5000)] + [None], dtype=object)
+    return pd.DataFrame({
+        'OPERATING_UNIT': np.array(['OU India', 'OU Brazil', 'OU Global', ' OU SEA', None], dtype=object)[days % 5],
+        'PO_NUMBER': po_numbers.astype(float),
+        'PO_DATE': po_dates,
+        'Month': dates.strftime('%b'),
+        'year': dates.year.astype(float),
+        'PO_TYPE': 'STANDARD',
+        'PO_STATUS': np.array(['APPROVED', 'CLOSED', ''], dtype=object)[days % 3],
+        'BUYER_NAME': np.array([f"Buyer {i}" for i in range(40)], dtype=object)[days % 40],
+        'SUPPLIER_NUMBER': rng.integers(1, 2000, n),
+        'SUPPLIER_NAME': vendors[rng.integers(0, len(vendors), n)],
+        'SUPPLIER_SITE': np.array(['SURAT', 'MUMBAI', 'Porto Alegre', None], dtype=object)[days % 4],
+        'ITEM_CODE': np.array([f"IC{i}" for i in range(5000)], dtype=object)[rng.integers(0, 5000, n)],
+        'ITEM_DESCRIPTION': items[rng.integers(0, len(items), n)],
+        'QUANTITY': pd.Series(rng.integers(1, 500, n), dtype=object),
+        'UOM': 'KG',
+        'CURRENCY': 'INR',
+        'EXCHANGE_RATE': 1.0,
+        'PRICE': np.round(rng.random(n) * 100, 2),
+        'PAYMENT_TERM': np.array(['NET 30', 'NET 60', None], dtype=object)[days % 3],
+        'BASE_PRICE_FC': np.round(rng.random(n) * 1e5, 2),
+        'BASE_PRICE_INR': amounts,
+        'FREIGHT_TERMS_DSP': None,
+        'SHIP_VIA_LOOKUP_CODE': None,
+        'FOB_DSP': None,
+        'LINE_NUMBER': pd.Series(po_numbers).groupby(po_numbers).cumcount().to_numpy() + 1,
+        'SHIPMENT_NUMBER': 1.0,
+    })
+
+
+# Per-cell parsing of the iterrows loader this module replaced
+def parse_float(val):
+    try:
+        if pd.isna(val):
+            return 0.0
+        return float(str(val).replace(',', '').strip())
+    except Exception:
+        return 0.0
+
+
+def parse_str(val):
+    if pd.isna(val):
+        return None
+    return str(val).strip()
+
+
+def scratch_engine():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    run_migrations(engine)
+    return engine, path
+
+
+def check(name, ok, detail=''):
+    print(f"   {'✅' if ok else '❌'} {name}{' - ' + detail if detail else ''}")
+    return 0 if ok else 1
+
+
+def verify_bulk(engine, n):
+    frame = generate_extract(n)
+    started = time.perf_counter()
+    columns, unmapped = map_spend_columns(frame.columns)
+    records = clean_spend_frame(frame, columns)
+    cleaned = time.perf_counter()
+    with engine.begin() as conn:
+        inserted = insert_spend_rows(conn, records)
+    loaded = time.perf_counter()
+    total = loaded - started
+    print(f"   ⏱️ {inserted:,} rows: map + clean {cleaned - started:.1f}s, insert + reindex {loaded - cleaned:.1f}s "
+          f"-> {total:.1f}s ({inserted / total:,.0f} rows/s)")
+
+    failures = check("ingested in under a minute", total < 60, f"{total:.1f}s")
+    failures += check("every header mapped", not unmapped and len(columns) == 26)
+    kept = frame[frame['SUPPLIER_NAME'].notna() | frame['ITEM_DESCRIPTION'].notna()]
+    expected_spend = sum(parse_float(v) for v in kept['BASE_PRICE_INR'])
+    with engine.connect() as conn:
+        count, spend, dated = conn.execute(text(
+            "SELECT COUNT(*), TOTAL(amount), COUNT(period_month) FROM spend_record")).first()
+        indexes = conn.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = 'spend_record' AND sql IS NOT NULL")).scalar()
+        vendor = kept['SUPPLIER_NAME'].dropna().iloc[0].strip()
+        fts_hits = conn.execute(text("SELECT COUNT(*) FROM spend_fts WHERE spend_fts MATCH :q"),
+                                {"q": f'vendor_name : "{vendor}"'}).scalar()
+        plan = ' '.join(r[3] for r in conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM spend_record WHERE vendor_name = 'Vendor 1'")))
+    failures += check("empty rows dropped, every other row loaded", count == len(kept) == inserted)
+    failures += check("amounts match per-row parsing", abs(spend - expected_spend) < 1e-3 * len(kept),
+                      f"{spend:,.2f}")
+    failures += check("typed periods for every parseable date", dated == kept['PO_DATE'].notna().sum())
+    failures += check("indexes and FTS triggers recreated", indexes >= 16 and 'ix_spend_record_vendor_name' in plan)
+    failures += check("FTS index rebuilt", fts_hits == (kept['SUPPLIER_NAME'].str.strip() == vendor).sum())
+
+    # Cell-level comparison with the old loader on every 200th row (ids follow the source order)
+    numbers = {'quantity', 'price', 'exchange_rate', 'base_price_fc', 'base_price_inr'}
+    positions = range(0, len(kept), 200)
+    with engine.connect() as conn:
+        loaded_rows = conn.execute(text(f"SELECT {', '.join(INSERT_COLUMNS)} FROM spend_record WHERE id IN "
+                                        f"({', '.join(str(p + 1) for p in positions)}) ORDER BY id")).fetchall()
+    mismatches = 0
+    for position, got in zip(positions, loaded_rows):
+        row = kept.iloc[position]
+        for column, label in columns.items():
+            value = parse_float(row[label]) if column in numbers else parse_str(row[label])
+            if isinstance(row[label], float) and column not in numbers and value is not None:
+                value = value[:-2]  # float cells of text columns lose the '.0'
+            if column in ('vendor_name', 'item_description'):
+                value = value or 'Unknown'
+            if got[INSERT_COLUMNS.index(column)] != (value or (0.0 if column in numbers else None)):
+                mismatches += 1
+    failures += check("sampled cells match the per-row loader", mismatches == 0 and len(loaded_rows) == len(positions),
+                      f"{len(loaded_rows)} rows, {mismatches} mismatches")
+    return failures
+
+
+def verify_append(engine):
+    frame = generate_extract(2000, seed=2)
+    frame['SUPPLIER_NAME'] = 'Appended Vendor'
+    with engine.begin() as conn:
+        before = conn.execute(text("SELECT COUNT(*) FROM spend_record")).scalar()
+        started = time.perf_counter()
+        inserted = insert_spend_rows(conn, clean_spend_frame(frame, map_spend_columns(frame.columns)[0]))
+        elapsed = time.perf_counter() - started
+        after = conn.execute(text("SELECT COUNT(*) FROM spend_record")).scalar()
+        hits = conn.execute(text("SELECT COUNT(*) FROM spend_fts WHERE spend_fts MATCH 'appended'")).scalar()
+    return check("small append keeps indexes, FTS triggers index it",
+                 after == before + inserted == before + 2000 and hits == 2000, f"{elapsed * 1000:.0f} ms")
+
+
+def verify_legacy_and_xlsx(engine):
+    frame = generate_extract(3000, seed=4).iloc[:, :24]
+    legacy = frame.copy()
+    legacy.columns = [f"Column {i}" for i in range(24)]
+    expected = clean_spend_frame(frame, map_spend_columns(frame.columns)[0]).drop(columns='created_at')
+    by_position = clean_spend_frame(legacy, legacy_columns(legacy.columns)).drop(columns='created_at')
+    failures = check("unrecognized headers fall back to the legacy layout",
+                     not map_spend_columns(legacy.columns)[0] and by_position.equals(expected))
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        frame.to_excel(path, index=False)
+        started = time.perf_counter()
+        source = read_spend_file(path)
+        records = clean_spend_frame(source, map_spend_columns(source.columns)[0])
+        elapsed = time.perf_counter() - started
+        same = records.drop(columns='created_at').equals(expected)
+        failures += check(".xlsx round trip cleans to the same records", same,
+                          f"{len(records)} rows read + cleaned in {elapsed:.2f}s")
+    finally:
+        os.remove(path)
+    with engine.begin() as conn:
+        inserted = insert_spend_rows(conn, clean_spend_frame(legacy, legacy_columns(legacy.columns)), replace=True)
+        count = conn.execute(text("SELECT COUNT(*) FROM spend_record")).scalar()
+        stale = conn.execute(text("SELECT COUNT(*) FROM spend_fts WHERE spend_fts MATCH 'appended'")).scalar()
+    failures += check("replace swaps the table contents and the FTS index", count == inserted and stale == 0)
+    return failures
+
+
+def load_records(engine, frame, delta=True):
+    records = clean_spend_frame(frame, map_spend_columns(frame.columns)[0])
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        counts = apply_spend_delta(conn, records)[0] if delta else insert_spend_rows(conn, records, replace=True)
+    return counts, time.perf_counter() - started
+
+
+def verify_delta(engine, n):
+    base = generate_extract(n, seed=6)
+    base = base[base['SUPPLIER_NAME'].notna() | base['ITEM_DESCRIPTION'].notna()].reset_index(drop=True)
+    _, full_seconds = load_records(engine, base, delta=False)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE spend_record SET enriched_description = 'ENRICHED ' || item_description, "
+                          "cas_number = '50-00-0'"))
+
+    # Monthly refresh: 1% of lines changed, 1% removed, 2% new POs
+    rng = np.random.default_rng(8)
+    picks = rng.permutation(len(base))
+    changed, removed = picks[:n // 100], picks[n // 100:n // 50]
+    refresh = base.copy()
+    refresh.loc[changed, 'BASE_PRICE_INR'] = 123.45
+    refresh = refresh.drop(index=removed)
+    extra = generate_extract(n // 50, seed=9)
+    extra = extra[extra['SUPPLIER_NAME'].notna() | extra['ITEM_DESCRIPTION'].notna()]
+    extra['PO_NUMBER'] = extra['PO_NUMBER'] + 1e8
+    refresh = pd.concat([refresh, extra], ignore_index=True)
+
+    counts, seconds = load_records(engine, refresh)
+    print(f"   ⏱️ delta of {len(refresh):,} lines in {seconds:.1f}s (full load of {len(base):,}: {full_seconds:.1f}s): "
+          f"{counts}")
+    expected = {"inserted": len(extra), "updated": len(changed), "unchanged": len(base) - len(changed) - len(removed),
+                "tombstoned": len(removed), "restored": 0}
+    failures = check("inserted / updated / unchanged / tombstoned counts", counts == expected)
+    with engine.connect() as conn:
+        total, kept, tombstones, new_enriched = conn.execute(text("""
+            SELECT (SELECT TOTAL(amount) FROM spend_record),
+                   (SELECT COUNT(*) FROM spend_record WHERE amount = 123.45 AND enriched_description LIKE 'ENRICHED %'),
+                   (SELECT COUNT(*) FROM spend_tombstone WHERE enriched_description LIKE 'ENRICHED %'),
+                   (SELECT COUNT(*) FROM spend_record WHERE po_number >= '46' AND enriched_description IS NOT NULL)
+        """)).first()
+    expected_total = sum(parse_float(v) for v in refresh['BASE_PRICE_INR'])
+    failures += check("table matches the refreshed extract", abs(total - expected_total) < 1e-3 * len(refresh))
+    failures += check("changed lines keep their enrichment", kept == len(changed))
+    failures += check("removed lines tombstoned with their enrichment", tombstones == len(removed))
+    failures += check("new lines start unenriched", new_enriched == 0)
+
+    counts, seconds = load_records(engine, refresh)
+    failures += check("unchanged extract writes nothing", counts["unchanged"] == len(refresh) and
+                      counts["inserted"] == counts["updated"] == counts["tombstoned"] == 0, f"{seconds:.1f}s")
+
+    comeback = pd.concat([refresh, base.loc[removed[:10]]], ignore_index=True)
+    counts, _ = load_records(engine, comeback)
+    failures += check("lines that come back get their enrichment again",
+                      counts["inserted"] == counts["restored"] == 10 and counts["tombstoned"] == 0)
+
+    with engine.begin() as conn:
+        before = conn.execute(text("SELECT id, line_key, content_hash FROM spend_record ORDER BY id")).fetchall()
+        conn.execute(text("UPDATE spend_record SET line_key = NULL, content_hash = NULL"))
+        backfill_fingerprints(conn)
+        after = conn.execute(text("SELECT id, line_key, content_hash FROM spend_record ORDER BY id")).fetchall()
+    failures += check("fingerprints recomputed from stored rows match the loaded ones", before == after)
+    return failures
+
+
+def _peak_rss_mb():
+    """VmHWM of this process image: ru_maxrss also counts the parent's pages a spawned process started from"""
+    try:
+        with open('/proc/self/status') as status:
+            kb = next(line for line in status if line.startswith('VmHWM')).split()[1]
+        return round(int(kb) / 1024, 1)
+    except (OSError, StopIteration):
+        return spend_workbook.peak_rss_mb()
+
+
+def _measure_reader(args):
+    """(rows, seconds, peak RSS MB) of reading + cleaning an extract; runs in a fresh process"""
+    reader, path = args
+    started = time.perf_counter()
+    if reader == 'read_excel':
+        source = read_spend_file(path)
+        records = clean_spend_frame(source, map_spend_columns(source.columns)[0])
+    else:
+        spend_workbook.WORKBOOK_ENGINE = reader
+        records, _ = spend_workbook.read_spend_sources(spend_workbook.spend_sources(path), workers=1)
+    return len(records), time.perf_counter() - started, _peak_rss_mb()
+
+
+def _measure_load(args):
+    """(rows, seconds, peak RSS MB) of a replace load into its own scratch DB; runs in a fresh process"""
+    how, path = args
+    spend_workbook.WORKBOOK_ENGINE = 'openpyxl'
+    engine, db_path = scratch_engine()
+    try:
+        started = time.perf_counter()
+        sources = spend_workbook.spend_sources(path)
+        with engine.begin() as conn:
+            if how == 'stream':
+                rows = insert_spend_batches(conn, spend_workbook.iter_spend_sources(sources, workers=1), replace=True)
+            else:
+                records, _ = spend_workbook.read_spend_sources(sources, workers=1)
+                rows = insert_spend_rows(conn, records, replace=True)
+        return rows, time.perf_counter() - started, _peak_rss_mb()
+    finally:
+        engine.dispose()
+        os.remove(db_path)
+
+
+def _stored(engine):
+    columns = [column for column in INSERT_COLUMNS if column != 'created_at']
+    with engine.connect() as conn:
+        return pd.DataFrame(conn.execute(text(f"SELECT {', '.join(columns)} FROM spend_record ORDER BY id")).fetchall(),
+                            columns=columns)
+
+
+def verify_streamed_load(engine, single, records):
+    """Replace load inserting the batches of a multi-batch sheet as they are read, against the collected records"""
+    with engine.begin() as conn:
+        insert_spend_rows(conn, records, replace=True)
+    expected = _stored(engine)
+    sources = spend_workbook.spend_sources(single)
+    with engine.begin() as conn:
+        inserted = insert_spend_batches(conn, spend_workbook.iter_spend_sources(sources, workers=1), replace=True)
+    failures = check("streamed replace stores the same rows and line keys as collecting first",
+                     inserted == len(records) and _stored(engine).equals(expected), f"{inserted:,} rows")
+
+    def failing():
+        batches = spend_workbook.iter_spend_sources(sources, workers=1)
+        yield next(batches)
+        raise ValueError("unreadable row")
+
+    objects = "SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = 'spend_record' AND sql IS NOT NULL"
+    with engine.connect() as conn:
+        before = conn.execute(text(objects)).scalar()
+    try:
+        with engine.begin() as conn:
+            insert_spend_batches(conn, failing(), replace=True)
+    except ValueError:
+        pass
+    with engine.connect() as conn:
+        count, after = conn.execute(text(f"SELECT (SELECT COUNT(*) FROM spend_record), ({objects})")).first()
+    failures += check("failure halfway through a stream rolls back rows, indexes and triggers",
+                      count == len(expected) and after == before)
+    return failures
+
+
+def verify_streaming(engine, n):
+    frame = generate_extract(n, seed=5)
+    expected = clean_spend_frame(frame, map_spend_columns(frame.columns)[0]).drop(columns='created_at')
+    engines = ['openpyxl'] + (['calamine'] if spend_workbook.CalamineWorkbook is not None else [])
+    directory = tempfile.mkdtemp()
+    failures = 0
+    try:
+        single = os.path.join(directory, 'single.xlsx')
+        frame.to_excel(single, index=False)
+        spawn = multiprocessing.get_context('spawn')
+        peaks = {}
+        for reader in ['read_excel'] + engines:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                rows, seconds, peaks[reader] = pool.submit(_measure_reader, (reader, single)).result()
+            print(f"   ⏱️ {reader}: {rows:,} rows read + cleaned in {seconds:.1f}s "
+                  f"({rows / seconds:,.0f} rows/s, peak RSS {peaks[reader]} MB)")
+        if n >= 4 * spend_workbook.WORKBOOK_BATCH_ROWS:
+            failures += check("openpyxl stream peaks below pd.read_excel", peaks['openpyxl'] < peaks['read_excel'],
+                              f"{peaks['read_excel'] - peaks['openpyxl']:.0f} MB less")
+        for how in ('collect', 'stream'):
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                rows, seconds, peaks[how] = pool.submit(_measure_load, (how, single)).result()
+            print(f"   ⏱️ replace load, {how}: {rows:,} rows read + inserted in {seconds:.1f}s "
+                  f"({rows / seconds:,.0f} rows/s, peak RSS {peaks[how]} MB)")
+        if n >= 4 * spend_workbook.WORKBOOK_BATCH_ROWS:
+            failures += check("streamed load peaks below collecting the extract", peaks['stream'] < peaks['collect'],
+                              f"{peaks['collect'] - peaks['stream']:.0f} MB less")
+
+        # Several batches per sheet, so line keys have to be renumbered over the whole extract
+        spend_workbook.WORKBOOK_BATCH_ROWS = max(1000, n // 7)
+        for engine_name in engines:
+            spend_workbook.WORKBOOK_ENGINE = engine_name
+            records, stats = spend_workbook.read_spend_sources(spend_workbook.spend_sources(single), workers=1)
+            failures += check(f"{engine_name} stream cleans to the same records",
+                              records.drop(columns='created_at').equals(expected), f"{stats[0]['batches']} batches")
+        failures += verify_streamed_load(engine, single, records)
+
+        spend_workbook.WORKBOOK_ENGINE = ''
+        extracts = os.path.join(directory, 'extracts')
+        os.mkdir(extracts)
+        thirds = [frame.iloc[i * n // 3:(i + 1) * n // 3] for i in range(3)]
+        with pd.ExcelWriter(os.path.join(extracts, 'a_history.xlsx')) as writer:
+            thirds[0].to_excel(writer, sheet_name='FY22', index=False)
+            pd.DataFrame({'Note': ['Totals by OU'], 'Total': [1.0]}).to_excel(writer, sheet_name='Summary', index=False)
+            thirds[1].to_excel(writer, sheet_name='FY23', index=False)
+        thirds[2].to_csv(os.path.join(extracts, 'b_recent.csv'), index=False)
+        sources = spend_workbook.spend_sources(extracts, sheet_name=None)
+        sequential, stats = spend_workbook.read_spend_sources(sources, workers=1)
+        failures += check("directory of sheets reads as one extract",
+                          sequential.drop(columns='created_at').equals(expected),
+                          f"{len(sources)} sources, skipped: {[s['sheet'] for s in stats if s.get('skipped_sheet')]}")
+        started = time.perf_counter()
+        parallel, _ = spend_workbook.read_spend_sources(sources, workers=2)
+        failures += check("parallel read matches the sequential one",
+                          parallel.drop(columns='created_at').equals(sequential.drop(columns='created_at')),
+                          f"{time.perf_counter() - started:.1f}s with 2 workers on {os.cpu_count()} CPU(s)")
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    engine, path = scratch_engine()
+    try:
+        print(f"--- 🧪 Bulk spend ingestion ({n:,} rows, scratch DB) ---")
+        failed = verify_bulk(engine, n) + verify_append(engine) + verify_legacy_and_xlsx(engine)
+        print(f"--- 🧪 Delta ingestion ({n // 10:,} lines) ---")
+        failed += verify_delta(engine, n // 10)
+        print(f"--- 🧪 Streaming workbook reader ({n // 10:,} rows) ---")
+        failed += verify_streaming(engine, n // 10)
+    finally:
+        engine.dispose()
+        os.remove(path)
+    sys.exit(1 if failed else 0)
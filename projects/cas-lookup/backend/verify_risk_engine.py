@@ -0,0 +1,206 @@
+"""
+Risk engine regression check and benchmark.
+
+    python verify_risk_engine.py              # compare against the row-loop implementation on the live DB
+    python verify_risk_engine.py 1000000      # ... plus a synthetic benchmark with N spend lines
+"""
+import sys
+import time
+import random
+from collections import namedtuple
+import pandas as pd
+from app import app
+from models import SpendRecord
+from geocoding_data import CITY_COORDS
+from spend_cube import SpendCube, CUBE_DIMENSIONS, get_spend_cube
+from risk_engine import compute_material_risks, load_risk_config, RISK_CONFIG_DEFAULTS, RISK_RESULT_LIMIT
+
+
+def site_country(site):
+    """The original exact CITY_COORDS lookup (before site_location)"""
+    if not site:
+        return "Unknown"
+    site_key = site.lower().strip()
+    if site_key in CITY_COORDS:
+        name = CITY_COORDS[site_key]['name']
+        if ',' in name:
+            return name.split(',')[-1].strip()
+        return name
+    return "Unknown"
+
+
+def exact_countries(cube):
+    """Engine site -> country mapping using the original lookup, for like-for-like comparison"""
+    return {site: site_country(site) for site in cube.labels['supplier_site']}
+
+
+def legacy_risk_analysis(records, config):
+    """The original per-record implementation of /api/spend-analysis/risk-analysis"""
+    SENSITIVE_COUNTRIES = config['sensitive_countries']
+    HIGH_RISK_COUNTRIES = config['high_risk_countries']
+    CONCENTRATION_THRESHOLD = config['concentration_threshold']
+    DISASTER_COUNTRIES = config['natural_disaster_countries']
+
+    material_risks = {}
+    for r in records:
+        mat = r.enriched_description
+        if not mat or str(mat).lower() in ['other', 'unknown', 'nan', 'none']:
+            continue
+        mat_key = (mat, r.item_code or "N/A")
+        if mat_key not in material_risks:
+            material_risks[mat_key] = {"material": mat, "item_code": r.item_code or "N/A", "suppliers": set(),
+                                       "countries": {}, "sites": {}, "total_spend": 0}
+        m = material_risks[mat_key]
+        m["suppliers"].add(r.supplier_number)
+        country = site_country(r.supplier_site)
+        site = r.supplier_site or "Unknown"
+        m["countries"][country] = m["countries"].get(country, 0) + (r.amount or 0)
+        m["sites"][site] = m["sites"].get(site, 0) + (r.amount or 0)
+        m["total_spend"] += (r.amount or 0)
+
+    results = []
+    for m_data in material_risks.values():
+        risks = []
+        max_severity = "Low"
+        if len(m_data["suppliers"]) == 1:
+            risks.append({"type": "Single Source", "severity": "High", "description": "Only one vendor globally for this material."})
+            max_severity = "High"
+        geo_risk_countries = [c for c in m_data["countries"] if c != "Unknown" and any(sc in c for sc in SENSITIVE_COUNTRIES)]
+        if geo_risk_countries:
+            severity = "High" if any(hc in str(geo_risk_countries) for hc in HIGH_RISK_COUNTRIES) else "Medium"
+            risks.append({"type": "Geo Political", "severity": severity,
+                          "description": f"Sourcing from sensitive regions: {', '.join(geo_risk_countries)}"})
+            if severity == "High": max_severity = "High"
+            elif max_severity != "High": max_severity = "Medium"
+        if len(m_data["suppliers"]) == 1:
+            supplier_countries = [c for c in m_data["countries"] if c != "Unknown"]
+            if supplier_countries and any(any(sc in country for sc in SENSITIVE_COUNTRIES) for country in supplier_countries):
+                risks.append({"type": "Country Risk", "severity": "Medium",
+                              "description": f"Single source from sensitive country: {', '.join(supplier_countries)}"})
+                if max_severity != "High": max_severity = "Medium"
+        if len(m_data["suppliers"]) > 1:
+            for country, spend in m_data["countries"].items():
+                if country != "Unknown" and m_data["total_spend"] > 0:
+                    if (spend / m_data["total_spend"]) * 100 > CONCENTRATION_THRESHOLD and any(sc in country for sc in SENSITIVE_COUNTRIES):
+                        risks.append({"type": "Country Risk", "severity": "Medium",
+                                      "description": f"Over {CONCENTRATION_THRESHOLD}% of spend from sensitive country: {country}"})
+                        if max_severity != "High": max_severity = "Medium"
+                        break
+        disaster_countries = [c for c in m_data["countries"] if c != "Unknown" and any(dc.lower() in c.lower() for dc in DISASTER_COUNTRIES)]
+        if disaster_countries:
+            risks.append({"type": "Natural Disaster", "severity": "High",
+                          "description": f"Sourcing from disaster-affected regions: {', '.join(disaster_countries)}"})
+            max_severity = "High"
+        if risks:
+            valid_sites = {s: spend for s, spend in m_data["sites"].items() if s and s != "Unknown"}
+            results.append({"material": m_data["material"], "item_code": m_data["item_code"],
+                            "total_spend": m_data["total_spend"], "supplier_count": len(m_data["suppliers"]),
+                            "risks": risks, "max_severity": max_severity,
+                            "dominant_site": max(valid_sites, key=valid_sites.get) if valid_sites else "Unknown"})
+    results.sort(key=lambda x: (x["max_severity"] == "High", x["max_severity"] == "Medium", x["total_spend"]), reverse=True)
+    return {
+        "material_risks": results[:RISK_RESULT_LIMIT],
+        "summary": {
+            "high_risk_count": len([r for r in results if r["max_severity"] == "High"]),
+            "medium_risk_count": len([r for r in results if r["max_severity"] == "Medium"]),
+            "low_risk_count": len([r for r in results if r["max_severity"] == "Low"]),
+            "total_risky_materials": len(results)
+        }
+    }
+
+
+def compare(expected, actual):
+    """List of differences between two risk-analysis responses (spend compared with a relative tolerance)"""
+    diffs = []
+    if expected["summary"] != actual["summary"]:
+        diffs.append(f"summary {expected['summary']} != {actual['summary']}")
+    for i, (e, a) in enumerate(zip(expected["material_risks"], actual["material_risks"])):
+        spend_ok = abs(e["total_spend"] - a["total_spend"]) <= 1e-9 * max(1.0, abs(e["total_spend"]))
+        rest_e = {k: v for k, v in e.items() if k != "total_spend"}
+        rest_a = {k: v for k, v in a.items() if k != "total_spend"}
+        if not spend_ok or rest_e != rest_a:
+            diffs.append(f"row {i}: {e['material']} / {e['item_code']}")
+    if len(expected["material_risks"]) != len(actual["material_risks"]):
+        diffs.append("different number of rows")
+    return diffs
+
+
+def verify_live_db():
+    print("--- 🧪 Risk engine vs. row loop (live DB) ---")
+    with app.app_context():
+        config = load_risk_config()
+        cube = get_spend_cube()
+        scopes = [('All', 'All')]
+        scopes += [(ou, 'All') for ou in sorted(u for u in cube.distinct_values('operating_unit') if u)[:3]]
+        scopes += [('All', y) for y in sorted(y for y in cube.distinct_values('year') if y)[-2:]]
+        countries = exact_countries(cube)
+        configs = [config, dict(config, concentration_threshold=40, natural_disaster_countries=['india', 'Chin'])]
+        failures = 0
+        for cfg in configs:
+            for ou, year in scopes:
+                query = SpendRecord.query
+                if ou != 'All':
+                    query = query.filter(SpendRecord.operating_unit == ou)
+                if year != 'All':
+                    query = query.filter(SpendRecord.year == year)
+                t0 = time.perf_counter()
+                expected = legacy_risk_analysis(query.order_by(SpendRecord.id).all(), cfg)
+                t1 = time.perf_counter()
+                filters = {k: v for k, v in (('operating_unit', ou), ('year', year)) if v != 'All'}
+                actual = compute_material_risks(cube, cube.mask(filters), cfg, countries=countries)
+                t2 = time.perf_counter()
+                diffs = compare(expected, actual)
+                status = "✅" if not diffs else "❌"
+                print(f"   {status} ou={ou} year={year}: {actual['summary']['total_risky_materials']} risky, "
+                      f"loop {(t1 - t0) * 1000:.0f} ms, engine {(t2 - t1) * 1000:.0f} ms")
+                for d in diffs[:5]:
+                    print(f"      {d}")
+                failures += bool(diffs)
+        return failures
+
+
+def synthetic_frame(n):
+    """n synthetic spend lines: 5k materials with 1-2 item codes each, 2k suppliers, every geocoded site plus unknown ones"""
+    random.seed(7)
+    sites = list(CITY_COORDS) + ['XYZ PLANT', 'Unit 4', None]
+    materials = [f'Material {i}' for i in range(5000)] + ['Other', 'nan', None]
+    rows = {dim: [None] * n for dim in CUBE_DIMENSIONS}
+    picks = [random.randrange(len(materials)) for _ in range(n)]
+    rows['enriched_description'] = [materials[i] for i in picks]
+    # one or two item codes per material
+    rows['item_code'] = [f'IC{i * 2 + random.randint(0, 1)}' if random.random() > 0.1 else None for i in picks]
+    # every fifth material is single-sourced
+    rows['supplier_number'] = [f'S{i}' if i % 5 == 0 else f'S{random.randint(1, 2000)}' for i in picks]
+    rows['supplier_site'] = [random.choice(sites) for _ in range(n)]
+    rows['operating_unit'] = [random.choice(['OU India', 'OU Brazil', 'OU Global']) for _ in range(n)]
+    rows['year'] = [str(random.randint(2021, 2024)) for _ in range(n)]
+    rows['amount'] = [random.random() * 1e5 if random.random() > 0.02 else None for _ in range(n)]
+    rows['quantity'] = [1.0] * n
+    return pd.DataFrame(rows)
+
+
+def benchmark(n):
+    print(f"--- ⏱️ Benchmark: {n:,} spend lines ---")
+    frame = synthetic_frame(n)
+    cube = SpendCube.from_frame(frame)
+    Row = namedtuple('Row', ['enriched_description', 'item_code', 'supplier_number', 'supplier_site', 'amount'])
+    records = [Row(*t) for t in frame[list(Row._fields)].astype(object).where(frame[list(Row._fields)].notna(), None).itertuples(index=False)]
+    config = dict(RISK_CONFIG_DEFAULTS, natural_disaster_countries=['Japan'])
+
+    t0 = time.perf_counter()
+    expected = legacy_risk_analysis(records, config)
+    t1 = time.perf_counter()
+    actual = compute_material_risks(cube, None, config, countries=exact_countries(cube))
+    t2 = time.perf_counter()
+    diffs = compare(expected, actual)
+    print(f"   row loop (rows already in memory): {t1 - t0:.2f} s")
+    print(f"   risk engine (cube):               {t2 - t1:.2f} s  ({(t1 - t0) / max(t2 - t1, 1e-9):.0f}x)")
+    print(f"   {'✅ identical' if not diffs else '❌ ' + '; '.join(diffs[:5])} ({actual['summary']['total_risky_materials']} risky materials)")
+    return bool(diffs)
+
+
+if __name__ == "__main__":
+    failed = verify_live_db()
+    if len(sys.argv) > 1:
+        failed += benchmark(int(sys.argv[1]))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,152 @@
+"""
+Spend rollup regression check and benchmark.
+
+    python verify_rollups.py          # dashboard via the router vs. the raw spend cube, on the live DB
+
+Rebuilds spend_rollup, then for a set of filter combinations compares every
+dashboard widget answered by the query router against the same widget
+computed from the raw spend cube alone (amounts within a relative tolerance,
+ties in ranked lists compared as sets), and reports which source served each
+widget and both timings. PO / buyer counts estimated from HyperLogLog
+sketches must be within SKETCH_TOLERANCE of the exact count, and exact=True
+must reproduce the raw counts. Finally checks that an incremental refresh of
+a few materials leaves the rollups identical to a full rebuild.
+"""
+import sys
+import time
+import threading
+from sqlalchemy import text
+from app import app
+from models import db
+from spend_cube import get_spend_cube
+from spend_aggregation import compute_dashboard, cube_filters, build_spend_dashboard
+from spend_rollup import (SpendQueryRouter, ROLLUPS, rebuild_spend_rollups, refresh_spend_rollups,
+                          get_rollup_cubes)
+from spend_sketch import HLL_STANDARD_ERROR
+from data_version import get_data_version, SPEND
+
+# Allowed relative error of sketch estimates (4 standard errors)
+SKETCH_TOLERANCE = 4 * HLL_STANDARD_ERROR
+
+
+class RawRouter(SpendQueryRouter):
+    """Router that never uses a rollup (the pre-rollup behaviour)"""
+
+    def covering_rollup(self, dims):
+        return None
+
+
+def wait_for_background_work():
+    """Startup preloads (spend cube, rollups) run in threads; let them finish before timing"""
+    while threading.active_count() > 1:
+        time.sleep(0.5)
+
+
+def close(a, b, tolerance=1e-6):
+    return abs(a - b) <= tolerance * max(1.0, abs(a), abs(b))
+
+
+def compare_series(name, expected, actual, key='value'):
+    """Ranked {name, value} lists: same values in order, same names up to ties"""
+    if len(expected) != len(actual):
+        return [f"{name}: {len(expected)} vs {len(actual)} entries"]
+    diffs = []
+    for i, (e, a) in enumerate(zip(expected, actual)):
+        if not close(e[key], a[key]):
+            diffs.append(f"{name}[{i}]: {e} != {a}")
+    # Equal values may legitimately swap places: match entries by name
+    expected_values = {r['name']: r[key] for r in expected}
+    actual_values = {r['name']: r[key] for r in actual}
+    if not diffs and (expected_values.keys() != actual_values.keys()
+                      or not all(close(v, actual_values[k]) for k, v in expected_values.items())):
+        diffs.append(f"{name}: different entries")
+    return diffs
+
+
+def compare(expected, actual):
+    diffs = []
+    approximate = actual["approximate"]["widgets"]
+    for k, v in expected["kpis"].items():
+        tolerance = SKETCH_TOLERANCE if f"kpis.{k}" in approximate else 1e-6
+        if not close(v, actual["kpis"][k], tolerance):
+            diffs.append(f"kpis.{k}: {v} != {actual['kpis'][k]}")
+    for widget in ("category_data", "trend_data", "region_data", "supplier_data", "payment_term_data", "po_status_data"):
+        diffs += compare_series(widget, expected[widget], actual[widget])
+    diffs += compare_series("pareto_data", expected["pareto_data"], actual["pareto_data"], key='spend')
+    return diffs
+
+
+def filter_sets(cube):
+    units = sorted(u for u in cube.distinct_values('operating_unit') if u)
+    years = sorted(y for y in cube.distinct_values('year') if y)
+    vendors = [v for v, _ in cube.group_sum('vendor_name', top=2) if v]
+    materials = [m for m, _ in cube.group_sum('enriched_description', top=2) if m]
+    sets = [{}]
+    sets += [{'operating_unit': u} for u in units[:2]]
+    sets += [{'year': y} for y in years[-2:]]
+    sets += [{'supplier': v} for v in vendors]
+    sets += [{'enriched_description': m} for m in materials]
+    if units and years:
+        sets.append({'operating_unit': units[0], 'year': years[-1]})
+    sets.append({'supplier': 'No such vendor'})
+    return sets
+
+
+def verify_dashboard():
+    failures = 0
+    cube = get_spend_cube()
+    get_rollup_cubes()
+    print(f"--- 🧪 Dashboard: rollup router vs. raw spend cube ({cube.row_count:,} lines) ---")
+    for filters in filter_sets(cube):
+        t0 = time.perf_counter()
+        expected = compute_dashboard(RawRouter(cube_filters(filters)))
+        t1 = time.perf_counter()
+        actual = build_spend_dashboard(filters)
+        t2 = time.perf_counter()
+        exact = build_spend_dashboard(filters, exact=True)
+        diffs = compare(expected, actual) + compare(expected, exact)
+        sources = sorted(set(actual["served_by"].values()))
+        errors = [abs(actual["kpis"][k] - v) / max(v, 1) for k, v in expected["kpis"].items()
+                  if f"kpis.{k}" in actual["approximate"]["widgets"]]
+        status = "✅" if not diffs else "❌"
+        print(f"   {status} {filters or 'no filters'}: raw {(t1 - t0) * 1000:.0f} ms, "
+              f"router {(t2 - t1) * 1000:.0f} ms via {', '.join(sources)}, "
+              f"sketch error {max(errors, default=0) * 100:.2f}%")
+        for d in diffs[:5]:
+            print(f"      {d}")
+        failures += bool(diffs)
+    return failures
+
+
+def rollup_rows():
+    rows = db.session.execute(text(f"""
+        SELECT rollup, {', '.join(ROLLUPS[next(iter(ROLLUPS))])}, ROUND(amount, 4), ROUND(quantity, 4), line_count
+        FROM spend_rollup""")).fetchall()
+    return sorted(rows, key=repr)
+
+
+def verify_incremental():
+    """Refresh a few materials in place; the result must equal a full rebuild"""
+    print("--- 🧪 Incremental refresh vs. full rebuild ---")
+    materials = {m for m, _ in get_spend_cube().group_sum('enriched_description', top=3)} | {None}
+    version = get_data_version(SPEND)
+    t0 = time.perf_counter()
+    refresh_spend_rollups(materials, version + 1)
+    t1 = time.perf_counter()
+    refreshed = rollup_rows()
+    rebuild_spend_rollups(version)
+    t2 = time.perf_counter()
+    rebuilt = rollup_rows()
+    ok = refreshed == rebuilt
+    print(f"   {'✅' if ok else '❌'} {len(materials)} materials: refresh {(t1 - t0) * 1000:.0f} ms, "
+          f"full rebuild {(t2 - t1) * 1000:.0f} ms ({len(rebuilt):,} rollup rows)")
+    return not ok
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        wait_for_background_work()
+        rebuild_spend_rollups()
+        failed = verify_dashboard()
+        failed += verify_incremental()
+    sys.exit(1 if failed else 0)
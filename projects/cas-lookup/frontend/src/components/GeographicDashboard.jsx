@@ -1,5 +1,5 @@
-import React, { useEffect, useState } from 'react';
-import { MapContainer, TileLayer, CircleMarker, Popup, useMap } from 'react-leaflet';
+import React, { useCallback, useEffect, useState } from 'react';
+import { MapContainer, TileLayer, CircleMarker, Popup, useMap, useMapEvents } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
 import {
     BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer,
@@ -16,7 +16,9 @@ const FitBounds = ({ suppliers }) => {
 
     useEffect(() => {
         if (suppliers && suppliers.length > 0) {
-            const bounds = suppliers.map(s => [s.latitude, s.longitude]);
+            const bounds = suppliers.flatMap(s => s.bounds
+                ? [[s.bounds[0], s.bounds[1]], [s.bounds[2], s.bounds[3]]]
+                : [[s.latitude, s.longitude]]);
             map.fitBounds(bounds, { padding: [50, 50] });
         }
     }, [suppliers, map]);
@@ -24,12 +26,67 @@ const FitBounds = ({ suppliers }) => {
     return null;
 };
 
+// Viewport as the API's bbox parameter (south,west,north,east), longitudes wrapped to [-180, 180]
+const viewportBbox = (map) => {
+    const b = map.getBounds();
+    const wrap = (lng) => ((((lng + 180) % 360) + 360) % 360) - 180;
+    const south = Math.max(-90, b.getSouth());
+    const north = Math.min(90, b.getNorth());
+    let west = -180;
+    let east = 180;
+    if (b.getEast() - b.getWest() < 360) {
+        west = wrap(b.getWest());
+        east = wrap(b.getEast());
+    }
+    return [south, west, north, east].map(v => v.toFixed(4)).join(',');
+};
+
+// Re-fetches server-side clusters whenever the map is panned or zoomed
+const ViewportClusters = ({ queryParams, onLoad }) => {
+    const map = useMap();
+
+    const load = useCallback(async () => {
+        try {
+            const res = await fetch(
+                `/api/spend-analysis/suppliers-map${queryParams}&zoom=${map.getZoom()}&bbox=${viewportBbox(map)}`
+            );
+            if (res.ok) {
+                const json = await res.json();
+                onLoad(json.clusters);
+            }
+        } catch (err) {
+            console.error("Failed to fetch map clusters:", err);
+        }
+    }, [map, queryParams, onLoad]);
+
+    useMapEvents({ moveend: load });
+    useEffect(() => { load(); }, [load]);
+
+    return null;
+};
+
+// Clicking a cluster zooms to its members
+const ZoomToCluster = ({ cluster }) => {
+    const map = useMap();
+
+    useEffect(() => {
+        if (cluster && cluster.type === 'cluster') {
+            const [south, west, north, east] = cluster.bounds;
+            map.fitBounds([[south, west], [north, east]], { padding: [50, 50], maxZoom: 18 });
+        }
+    }, [cluster, map]);
+
+    return null;
+};
+
 const GeographicDashboard = () => {
     const [data, setData] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const [selectedRegion, setSelectedRegion] = useState(null);
     const [mapData, setMapData] = useState(null);
+    const [mapQuery, setMapQuery] = useState('');
+    const [viewportClusters, setViewportClusters] = useState(null);
     const [selectedDescription, setSelectedDescription] = useState('All');
     const [uniqueDescriptions, setUniqueDescriptions] = useState([]);
     const [operatingUnit, setOperatingUnit] = useState('All');
@@ -78,7 +135,8 @@ const GeographicDashboard = () => {
                 }
                 const [dashboardRes, mapRes] = await Promise.all([
                     fetch(`/api/spend-analysis/dashboard${queryParams}`),
-                    fetch(`/api/spend-analysis/suppliers-map${queryParams}`)
+                    // Clustered overview; the map then loads clusters for its own viewport
+                    fetch(`/api/spend-analysis/suppliers-map${queryParams}&zoom=2`)
                 ]);
 
                 if (!dashboardRes.ok || !mapRes.ok) throw new Error('Failed to fetch data');
@@ -88,6 +146,9 @@ const GeographicDashboard = () => {
 
                 setData(dashboardJson);
                 setMapData(mapJson);
+                setMapQuery(queryParams);
+                setViewportClusters(null);
+                setSelectedRegion(null);
             } catch (err) {
                 console.error(err);
                 setError(err.message);
@@ -103,7 +164,9 @@ const GeographicDashboard = () => {
     if (!data || !mapData) return null;
 
     const { kpis, region_data, trend_data } = data;
-    const { suppliers, summary } = mapData;
+    const { clusters, summary } = mapData;
+    // Clusters and single-supplier points of the current viewport, highest spend first
+    const features = viewportClusters || clusters;
 
     const formatCurrency = (val) => {
         if (!val) return '₹0';
@@ -133,6 +196,8 @@ const GeographicDashboard = () => {
         return sizes[category] || 6;
     };
 
+    const getClusterRadius = (count) => Math.min(30, 10 + Math.log10(count) * 6);
+
     const KPICard = ({ title, value, icon: Icon, color }) => (
         <div className="bg-slate-800 border border-slate-700 rounded-xl p-4 flex items-center justify-between shadow-lg hover:border-cyan-500/50 transition-colors">
             <div>
@@ -255,11 +320,46 @@ const GeographicDashboard = () => {
                                 url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
                             />
 
-                            <FitBounds suppliers={suppliers} />
+                            <FitBounds suppliers={clusters} />
+                            <ViewportClusters queryParams={mapQuery} onLoad={setViewportClusters} />
+                            <ZoomToCluster cluster={selectedRegion} />
 
-                            {suppliers.map((supplier, idx) => (
+                            {features.map((supplier) => supplier.type === 'cluster' ? (
                                 <CircleMarker
-                                    key={idx}
+                                    key={supplier.id}
+                                    center={[supplier.latitude, supplier.longitude]}
+                                    radius={getClusterRadius(supplier.count)}
+                                    fillColor={getMarkerColor(supplier.spend_category)}
+                                    color="#fff"
+                                    weight={3}
+                                    opacity={1}
+                                    fillOpacity={0.6}
+                                    eventHandlers={{
+                                        click: () => setSelectedRegion(supplier)
+                                    }}
+                                >
+                                    <Popup>
+                                        <div className="text-xs">
+                                            <p className="font-bold text-sm mb-1">
+                                                {supplier.count.toLocaleString()} supplier sites
+                                            </p>
+                                            <div className="space-y-0.5">
+                                                <p className="text-slate-600 font-medium">
+                                                    {supplier.vendor_count.toLocaleString()} vendors · top: {supplier.top_vendor}
+                                                </p>
+                                                <p className="text-blue-600 font-bold mt-1">
+                                                    {formatCurrency(supplier.total_spend)}
+                                                </p>
+                                                <p className="text-slate-500 text-[10px]">
+                                                    {supplier.transaction_count.toLocaleString()} transactions
+                                                </p>
+                                            </div>
+                                        </div>
+                                    </Popup>
+                                </CircleMarker>
+                            ) : (
+                                <CircleMarker
+                                    key={`${supplier.vendor_name}|${supplier.operating_unit}|${supplier.supplier_site}`}
                                     center={[supplier.latitude, supplier.longitude]}
                                     radius={getMarkerRadius(supplier.spend_category)}
                                     fillColor={getMarkerColor(supplier.spend_category)}
@@ -316,7 +416,9 @@ const GeographicDashboard = () => {
                 {/* Supplier Details Panel */}
                 <div className="bg-slate-800 border border-slate-700 rounded-xl p-6 shadow-lg">
                     <h3 className="text-lg font-bold text-white mb-4">
-                        {selectedRegion ? 'Supplier Details' : 'Top Suppliers by Location'}
+                        {selectedRegion
+                            ? (selectedRegion.type === 'cluster' ? 'Cluster Details' : 'Supplier Details')
+                            : 'Top Suppliers by Location'}
                     </h3>
 
                     {selectedRegion ? (
@@ -329,16 +431,39 @@ const GeographicDashboard = () => {
                             </button>
 
                             <div className="space-y-3">
-                                <div>
-                                    <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Vendor Name</p>
-                                    <p className="text-sm font-semibold text-white">{selectedRegion.vendor_name}</p>
-                                </div>
+                                {selectedRegion.type === 'cluster' ? (
+                                    <>
+                                        <div>
+                                            <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Supplier Sites</p>
+                                            <p className="text-sm font-semibold text-white">
+                                                {selectedRegion.count.toLocaleString()} sites · {selectedRegion.vendor_count.toLocaleString()} vendors
+                                            </p>
+                                        </div>
 
-                                <div>
-                                    <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Site & Unit</p>
-                                    <p className="text-sm text-slate-300">Site: {selectedRegion.supplier_site}</p>
-                                    <p className="text-xs text-slate-500 mt-1">Unit: {selectedRegion.operating_unit}</p>
-                                </div>
+                                        <div>
+                                            <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Top Vendors</p>
+                                            {selectedRegion.top_vendors.map(v => (
+                                                <div key={v.vendor_name} className="flex justify-between gap-2 text-sm">
+                                                    <span className="text-slate-300 truncate">{v.vendor_name}</span>
+                                                    <span className="text-slate-400">{formatCurrency(v.total_spend)}</span>
+                                                </div>
+                                            ))}
+                                        </div>
+                                    </>
+                                ) : (
+                                    <>
+                                        <div>
+                                            <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Vendor Name</p>
+                                            <p className="text-sm font-semibold text-white">{selectedRegion.vendor_name}</p>
+                                        </div>
+
+                                        <div>
+                                            <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Site & Unit</p>
+                                            <p className="text-sm text-slate-300">Site: {selectedRegion.supplier_site}</p>
+                                            <p className="text-xs text-slate-500 mt-1">Unit: {selectedRegion.operating_unit}</p>
+                                        </div>
+                                    </>
+                                )}
 
                                 <div>
                                     <p className="text-xs text-slate-500 uppercase tracking-wider mb-1">Total Spend</p>
@@ -364,7 +489,7 @@ const GeographicDashboard = () => {
                         </div>
                     ) : (
                         <div className="space-y-2 max-h-[500px] overflow-y-auto custom-scrollbar">
-                            {suppliers.slice(0, 15).map((supplier, idx) => (
+                            {features.slice(0, 15).map((supplier, idx) => (
                                 <div
                                     key={idx}
                                     onClick={() => setSelectedRegion(supplier)}
@@ -374,10 +499,12 @@ const GeographicDashboard = () => {
                                         <div className="flex-1 min-w-0">
                                             <p className="text-sm font-semibold text-white truncate flex items-center gap-2">
                                                 <MapPin className="w-3 h-3 text-cyan-400" />
-                                                {supplier.vendor_name}
+                                                {supplier.type === 'cluster' ? supplier.top_vendor : supplier.vendor_name}
                                             </p>
                                             <p className="text-xs text-slate-400 mt-1">
-                                                Site: {supplier.supplier_site} | Unit: {supplier.operating_unit}
+                                                {supplier.type === 'cluster'
+                                                    ? `${supplier.count.toLocaleString()} sites · ${supplier.vendor_count.toLocaleString()} vendors in this area`
+                                                    : `Site: ${supplier.supplier_site} | Unit: ${supplier.operating_unit}`}
                                             </p>
                                         </div>
                                         <div className="text-right">
@@ -71,16 +71,34 @@ const SpendAnalyticsTab = () => {
         setShowStyleSelector(false);
     };
 
+    const enrichmentJobId = enrichmentStatus?.job_id;
+
     useEffect(() => {
         let interval;
+        if (isEnriching && enrichmentJobId && window.EventSource) {
+            // The server pushes coalesced progress; the browser reconnects when the stream is recycled
+            const source = new EventSource(`/api/spend-analysis/enrich-jobs/${enrichmentJobId}/events`);
+            const update = (event) => {
+                const status = JSON.parse(event.data);
+                setEnrichmentStatus(status);
+                if (status.status !== 'running') {
+                    setIsEnriching(false);
+                    source.close();
+                }
+            };
+            source.addEventListener('progress', update);
+            source.addEventListener('end', update);
+            return () => source.close();
+        }
         if (isEnriching) {
+            // Until the job id is known (or without EventSource support): poll the status
             interval = setInterval(async () => {
                 try {
                     const res = await fetch('/api/spend-analysis/enrich-status');
                     if (res.ok) {
                         const status = await res.json();
                         setEnrichmentStatus(status);
-                        if (status.status === 'done') {
+                        if (status.status !== 'running') {
                             setIsEnriching(false);
                             clearInterval(interval);
                         }
@@ -91,13 +109,25 @@ const SpendAnalyticsTab = () => {
             }, 2000);
         }
         return () => clearInterval(interval);
-    }, [isEnriching]);
+    }, [isEnriching, enrichmentJobId]);
 
     const handleRunEnrichment = async () => {
         try {
             setIsEnriching(true);
             const res = await fetch('/api/spend-analysis/enrich', { method: 'POST' });
-            if (!res.ok) {
+            if (res.ok) {
+                const started = await res.json();
+                if (started.job_id) {
+                    setEnrichmentStatus({ ...started, current: 0 });
+                } else {
+                    setIsEnriching(false);
+                }
+            } else if (res.status === 409) {
+                // Another user or worker already started a run: follow that one
+                const err = await res.json();
+                setEnrichmentStatus(err.job);
+                setIsEnriching(err.job.status === 'running');
+            } else if (!res.ok) {
                 const err = await res.json();
                 alert(err.error || "Failed to start enrichment");
                 setIsEnriching(false);
@@ -108,6 +138,23 @@ const SpendAnalyticsTab = () => {
         }
     };
 
+    // Pause / resume / cancel the current enrichment job (shared by all server workers)
+    const controlEnrichment = async (action) => {
+        if (!enrichmentStatus?.job_id) return;
+        try {
+            const res = await fetch(`/api/spend-analysis/enrich-jobs/${enrichmentStatus.job_id}/${action}`, { method: 'POST' });
+            const job = await res.json();
+            if (!res.ok) {
+                alert(job.error || `Failed to ${action} enrichment`);
+                return;
+            }
+            setEnrichmentStatus(job);
+            setIsEnriching(job.status === 'running');
+        } catch (err) {
+            console.error(`Enrichment ${action} failed:`, err);
+        }
+    };
+
     const handleClearEnrichment = async () => {
         if (!window.confirm("Are you sure you want to clear all standardized chemical mapping? This cannot be undone.")) return;
 
@@ -172,17 +219,35 @@ const SpendAnalyticsTab = () => {
                         </div>
                         <div className="flex items-center gap-4">
                             {/* Enrichment Progress Indicator */}
-                            {enrichmentStatus && (enrichmentStatus.status === 'running' || enrichmentStatus.status === 'done') && (
+                            {enrichmentStatus && ['running', 'paused', 'done'].includes(enrichmentStatus.status) && (
                                 <div className="flex flex-col items-end mr-4">
                                     <div className="flex items-center gap-2 text-xs">
-                                        <span className={enrichmentStatus.status === 'running' ? 'text-amber-400 animate-pulse' : 'text-green-400'}>
-                                            {enrichmentStatus.status === 'running' ? 'Advanced mapping in progress...' : 'Advanced mapping complete'}
+                                        <span className={enrichmentStatus.status === 'running' ? 'text-amber-400 animate-pulse' : enrichmentStatus.status === 'paused' ? 'text-slate-400' : 'text-green-400'}>
+                                            {enrichmentStatus.status === 'running' ? 'Advanced mapping in progress...' : enrichmentStatus.status === 'paused' ? 'Advanced mapping paused' : 'Advanced mapping complete'}
                                         </span>
                                         <span className="text-slate-500">{enrichmentStatus.current}/{enrichmentStatus.total} items</span>
+                                        {enrichmentStatus.coverage && (
+                                            <span className="text-slate-400">{enrichmentStatus.coverage.spend_enriched_pct.toFixed(1)}% of spend enriched</span>
+                                        )}
+                                        {enrichmentStatus.status === 'running' && enrichmentStatus.live?.throughput > 0 && (
+                                            <span className="text-slate-500">
+                                                {enrichmentStatus.live.throughput.toFixed(1)}/s
+                                                {enrichmentStatus.live.eta_seconds != null && ` · ETA ${Math.ceil(enrichmentStatus.live.eta_seconds / 60)} min`}
+                                            </span>
+                                        )}
+                                        {enrichmentStatus.status === 'running' && (
+                                            <button onClick={() => controlEnrichment('pause')} className="text-slate-400 hover:text-white">Pause</button>
+                                        )}
+                                        {enrichmentStatus.status === 'paused' && (
+                                            <button onClick={() => controlEnrichment('resume')} className="text-amber-400 hover:text-amber-300">Resume</button>
+                                        )}
+                                        {['running', 'paused'].includes(enrichmentStatus.status) && (
+                                            <button onClick={() => controlEnrichment('cancel')} className="text-red-400 hover:text-red-300">Cancel</button>
+                                        )}
                                     </div>
                                     <div className="w-48 h-1.5 bg-slate-700 rounded-full mt-1 overflow-hidden">
                                         <div
-                                            className={`h-full transition-all duration-300 ${enrichmentStatus.status === 'running' ? 'bg-amber-500' : 'bg-green-500'}`}
+                                            className={`h-full transition-all duration-300 ${enrichmentStatus.status === 'running' ? 'bg-amber-500' : enrichmentStatus.status === 'paused' ? 'bg-slate-500' : 'bg-green-500'}`}
                                             style={{ width: `${(enrichmentStatus.current / (enrichmentStatus.total || 1)) * 100}%` }}
                                         />
                                     </div>
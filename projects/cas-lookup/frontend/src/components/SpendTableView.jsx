@@ -14,11 +14,15 @@ const SpendTableView = () => {
     const [currentPage, setCurrentPage] = useState(1);
     const [totalPages, setTotalPages] = useState(1);
     const [totalRecords, setTotalRecords] = useState(0);
+    // Keyset cursors for Previous/Next; page-number jumps fall back to page offsets
+    const [cursor, setCursor] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [prevCursor, setPrevCursor] = useState(null);
     const perPage = 50;
 
     useEffect(() => {
         fetchTableData();
-    }, [currentPage, sortBy, sortOrder, searchTerm]);
+    }, [currentPage, cursor, sortBy, sortOrder, searchTerm]);
 
     const fetchTableData = async () => {
         setLoading(true);
@@ -30,6 +34,7 @@ const SpendTableView = () => {
                 sort_order: sortOrder,
                 search: searchTerm
             });
+            if (cursor) params.set('cursor', cursor);
 
             const res = await fetch(`/api/spend-analysis/table?${params}`);
             if (!res.ok) throw new Error('Failed to fetch table data');
@@ -38,6 +43,8 @@ const SpendTableView = () => {
             setData(json.records);
             setTotalPages(json.pages);
             setTotalRecords(json.total);
+            setNextCursor(json.next_cursor);
+            setPrevCursor(json.prev_cursor);
         } catch (err) {
             console.error(err);
             setError(err.message);
@@ -53,48 +60,27 @@ const SpendTableView = () => {
             setSortBy(column);
             setSortOrder('desc');
         }
+        setCursor(null);
         setCurrentPage(1); // Reset to first page on sort change
     };
 
     const handleSearch = (e) => {
         setSearchTerm(e.target.value);
+        setCursor(null);
         setCurrentPage(1); // Reset to first page on search
     };
 
-    const exportToCSV = () => {
-        if (data.length === 0) return;
-
-        const headers = [
-            'PO Number', 'Vendor Name', 'Item Description', 'Enriched Description', 'CAS Number', 'Operating Unit',
-            'Quantity', 'Amount (INR)', 'PO Date', 'Buyer Name', 'Currency'
-        ];
-
-        const csvData = data.map(row => [
-            row.po_number || '',
-            row.vendor_name || '',
-            row.item_description || '',
-            row.enriched_description || '',
-            row.cas_number || '',
-            row.operating_unit || '',
-            row.quantity || 0,
-            row.amount || 0,
-            row.po_date || '',
-            row.buyer_name || '',
-            row.currency_code || ''
-        ]);
-
-        const csvContent = [
-            headers.join(','),
-            ...csvData.map(row => row.map(cell => `"${cell}"`).join(','))
-        ].join('\n');
-
-        const blob = new Blob([csvContent], { type: 'text/csv' });
-        const url = window.URL.createObjectURL(blob);
+    // Server-side streaming export of every row matching the current search and sort
+    const exportData = (format) => {
+        const params = new URLSearchParams({
+            format,
+            sort_by: sortBy,
+            sort_order: sortOrder,
+            search: searchTerm
+        });
         const a = document.createElement('a');
-        a.href = url;
-        a.download = `spend_data_${new Date().toISOString().split('T')[0]}.csv`;
+        a.href = `/api/spend-analysis/export?${params}`;
         a.click();
-        window.URL.revokeObjectURL(url);
     };
 
     const formatCurrency = (val) => {
@@ -141,14 +127,23 @@ const SpendTableView = () => {
                     />
                 </div>
 
-                {/* Export Button */}
-                <button
-                    onClick={exportToCSV}
-                    className="flex items-center gap-2 px-4 py-2 bg-cyan-600 hover:bg-cyan-500 text-white rounded-lg transition-colors shadow-sm font-medium"
-                >
-                    <Download className="w-4 h-4" />
-                    Export CSV
-                </button>
+                {/* Export Buttons */}
+                <div className="flex items-center gap-2">
+                    {[
+                        { format: 'csv', label: 'Export CSV' },
+                        { format: 'xlsx', label: 'Excel' },
+                        { format: 'parquet', label: 'Parquet' }
+                    ].map(({ format, label }) => (
+                        <button
+                            key={format}
+                            onClick={() => exportData(format)}
+                            className="flex items-center gap-2 px-4 py-2 bg-cyan-600 hover:bg-cyan-500 text-white rounded-lg transition-colors shadow-sm font-medium"
+                        >
+                            <Download className="w-4 h-4" />
+                            {label}
+                        </button>
+                    ))}
+                </div>
             </div>
 
             {/* Results Info */}
@@ -293,8 +288,8 @@ const SpendTableView = () => {
 
                 <div className="flex items-center gap-2">
                     <button
-                        onClick={() => setCurrentPage(p => Math.max(1, p - 1))}
-                        disabled={currentPage === 1}
+                        onClick={() => { setCursor(prevCursor); setCurrentPage(p => Math.max(1, p - 1)); }}
+                        disabled={currentPage === 1 || !prevCursor}
                         className="flex items-center gap-1 px-3 py-2 bg-slate-800 hover:bg-slate-700 disabled:opacity-50 disabled:cursor-not-allowed text-slate-200 rounded-lg border border-slate-700 transition-colors text-sm"
                     >
                         <ArrowLeft className="w-4 h-4" />
@@ -318,7 +313,7 @@ const SpendTableView = () => {
                             return (
                                 <button
                                     key={pageNum}
-                                    onClick={() => setCurrentPage(pageNum)}
+                                    onClick={() => { setCursor(null); setCurrentPage(pageNum); }}
                                     className={`px-3 py-2 rounded-lg text-sm transition-colors ${currentPage === pageNum
                                         ? 'bg-cyan-600 text-white font-semibold'
                                         : 'bg-slate-800 text-slate-300 hover:bg-slate-700 border border-slate-700'
@@ -331,8 +326,8 @@ const SpendTableView = () => {
                     </div>
 
                     <button
-                        onClick={() => setCurrentPage(p => Math.min(totalPages, p + 1))}
-                        disabled={currentPage === totalPages}
+                        onClick={() => { setCursor(nextCursor); setCurrentPage(p => Math.min(totalPages, p + 1)); }}
+                        disabled={currentPage === totalPages || !nextCursor}
                         className="flex items-center gap-1 px-3 py-2 bg-slate-800 hover:bg-slate-700 disabled:opacity-50 disabled:cursor-not-allowed text-slate-200 rounded-lg border border-slate-700 transition-colors text-sm"
                     >
                         Next
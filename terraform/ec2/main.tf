@@ -206,7 +206,7 @@ resource "aws_instance" "cas_app" {
               [Service]
               User=ec2-user
               WorkingDirectory=/opt/cas-lookup
-              ExecStart=/usr/bin/python3.11 -m gunicorn --workers 2 --bind 0.0.0.0:5000 --timeout 600 app:app
+              ExecStart=/usr/bin/python3.11 -m gunicorn --workers 2 --threads 8 --bind 0.0.0.0:5000 --timeout 600 app:app
               Restart=always
               
               [Install]